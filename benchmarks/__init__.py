@@ -0,0 +1,15 @@
+"""Benchmarks for Doozer.
+
+Each scenario runs an application with an in-memory consumer until it
+has processed a fixed number of messages. Scenarios vary the size of
+the messages, the number of workers, the callbacks, and the settings.
+Each one is run in its own process, and its throughput, latency
+percentiles (from reading a message to acknowledging it), and peak RSS
+are reported::
+
+    $ python -m benchmarks --output before.json
+    $ python -m benchmarks --compare before.json 'noop-*'
+
+Use ``--list`` to see the scenarios and ``--help`` for the other
+options.
+"""
@@ -0,0 +1,94 @@
+"""Command line interface for the benchmarks."""
+from __future__ import annotations
+
+import argparse
+import fnmatch
+import json
+import sys
+from typing import List, Optional
+
+from .runner import compare, format_results, run
+from .scenarios import SCENARIOS
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Run the benchmarks.
+
+    Args:
+        argv: The command line arguments. Defaults to ``sys.argv``.
+
+    Returns:
+        The exit status.
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Measure the throughput, latency, and memory use of Doozer.",
+    )
+    parser.add_argument(
+        "scenarios",
+        nargs="*",
+        metavar="SCENARIO",
+        help="glob patterns of the scenarios to run (default: all)",
+    )
+    parser.add_argument(
+        "-n",
+        "--messages",
+        type=int,
+        default=20000,
+        help="the number of messages per scenario (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        type=int,
+        default=3,
+        help="the number of runs of each scenario (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-o", "--output", metavar="FILE", help="save the results to FILE as JSON"
+    )
+    parser.add_argument(
+        "-c",
+        "--compare",
+        metavar="FILE",
+        help="compare the results to those saved in FILE",
+    )
+    parser.add_argument(
+        "-l", "--list", action="store_true", help="list the scenarios and exit"
+    )
+    args = parser.parse_args(argv)
+
+    patterns = args.scenarios or ["*"]
+    scenarios = [
+        scenario
+        for scenario in SCENARIOS
+        if any(fnmatch.fnmatch(scenario.name, pattern) for pattern in patterns)
+    ]
+
+    if args.list:
+        for scenario in scenarios:
+            print(scenario.name)
+        return 0
+
+    if not scenarios:
+        parser.error("no scenarios match {}".format(" ".join(patterns)))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    results = run(scenarios, args.messages, args.repeat)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+
+    changes = compare(baseline, results) if baseline is not None else None
+    print(format_results(results, changes))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
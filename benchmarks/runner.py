@@ -0,0 +1,239 @@
+"""Run the benchmarks and report the results."""
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime, timezone
+import math
+import multiprocessing
+import platform
+import sys
+from time import perf_counter
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import doozer
+
+from .scenarios import SCENARIOS, Scenario, build, scenario_messages
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    # Not available on Windows.
+    resource = None
+
+__all__ = ("compare", "format_results", "run", "run_scenario")
+
+# The latency percentiles to report.
+PERCENTILES = (50, 90, 99)
+
+
+def run(
+    scenarios: Iterable[Scenario], messages: int, repeat: int = 1
+) -> Dict[str, Any]:
+    """Run scenarios, each in its own process.
+
+    Running each scenario in a fresh process keeps the peak RSS of one
+    from hiding that of another and keeps them from warming up each
+    other's caches.
+
+    Args:
+        scenarios: The scenarios to run.
+        messages: The number of messages each scenario should process
+            before its fraction is applied.
+        repeat: The number of times to run each scenario. The run with
+            the median throughput is reported.
+
+    Returns:
+        The results, along with information about the environment in
+        which they were produced.
+    """
+    context = multiprocessing.get_context("spawn")
+
+    results = []
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        for scenario in scenarios:
+            runs = [
+                pool.apply(run_scenario, (scenario.name, messages))
+                for _ in range(repeat)
+            ]
+            runs.sort(key=lambda run: run["messages_per_second"])
+            results.append(runs[len(runs) // 2])
+
+    return {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "doozer": doozer.__version__,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "messages": messages,
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def run_scenario(name: str, messages: int) -> Dict[str, Any]:
+    """Run a scenario in the current process.
+
+    Args:
+        name: The name of the scenario.
+        messages: The number of messages to process before the
+            scenario's fraction is applied.
+
+    Returns:
+        The results of the scenario.
+    """
+    scenario = {scenario.name: scenario for scenario in SCENARIOS}[name]
+    count = scenario_messages(scenario, messages)
+
+    latencies: List[float] = []
+    app = build(scenario, count, latencies)
+
+    started = perf_counter()
+    app.run_forever(num_workers=scenario.workers, loop=asyncio.new_event_loop())
+    elapsed = perf_counter() - started
+
+    latencies.sort()
+    return {
+        "name": scenario.name,
+        "profile": scenario.profile,
+        "size": scenario.size,
+        "workers": scenario.workers,
+        "settings": scenario.settings,
+        "messages": len(latencies),
+        "seconds": elapsed,
+        "messages_per_second": len(latencies) / elapsed,
+        "latency": {
+            **{"p{}".format(p): _percentile(latencies, p) for p in PERCENTILES},
+            "max": latencies[-1] if latencies else None,
+        },
+        "peak_rss": _peak_rss(),
+    }
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Compare two sets of results.
+
+    Args:
+        baseline: The results to compare against.
+        current: The new results.
+
+    Returns:
+        For each scenario in both, the relative change in throughput,
+        99th percentile latency, and peak RSS. Positive values mean
+        the current results are larger.
+    """
+    previous = {result["name"]: result for result in baseline["results"]}
+
+    changes = []
+    for result in current["results"]:
+        before = previous.get(result["name"])
+        if before is None:
+            continue
+
+        changes.append(
+            {
+                "name": result["name"],
+                "messages_per_second": _change(
+                    before["messages_per_second"], result["messages_per_second"]
+                ),
+                "p99": _change(before["latency"]["p99"], result["latency"]["p99"]),
+                "peak_rss": _change(before["peak_rss"], result["peak_rss"]),
+            }
+        )
+    return changes
+
+
+def format_results(
+    results: Dict[str, Any], changes: Optional[Sequence[Dict[str, Any]]] = None
+) -> str:
+    """Format results as a table.
+
+    Args:
+        results: The results returned by :func:`run`.
+        changes: The changes returned by :func:`compare`, if any.
+
+    Returns:
+        The table.
+    """
+    headers = ["scenario", "msg/s", "p50 ms", "p90 ms", "p99 ms", "max ms", "RSS MiB"]
+    changed = {change["name"]: change for change in changes or ()}
+    if changes is not None:
+        headers += ["msg/s Δ", "p99 Δ", "RSS Δ"]
+
+    rows = []
+    for result in results["results"]:
+        latency = result["latency"]
+        row = [
+            result["name"],
+            "{:,.0f}".format(result["messages_per_second"]),
+            *(_milliseconds(latency[key]) for key in ("p50", "p90", "p99", "max")),
+            "-"
+            if result["peak_rss"] is None
+            else "{:.1f}".format(result["peak_rss"] / 2 ** 20),
+        ]
+        if changes is not None:
+            change = changed.get(result["name"], {})
+            row += [
+                _percent(change.get(key))
+                for key in ("messages_per_second", "p99", "peak_rss")
+            ]
+        rows.append(row)
+
+    widths = [
+        max(len(str(row[i])) for row in [headers] + rows) for i in range(len(headers))
+    ]
+    lines = []
+    for row in [headers] + rows:
+        cells = [row[0].ljust(widths[0])]
+        cells += [cell.rjust(width) for cell, width in zip(row[1:], widths[1:])]
+        lines.append("  ".join(cells))
+    lines.insert(1, "  ".join("-" * width for width in widths))
+    return "\n".join(lines)
+
+
+def _change(before: Optional[float], after: Optional[float]) -> Optional[float]:
+    """Return the relative change between two values."""
+    if not before or after is None:
+        return None
+    return (after - before) / before
+
+
+def _milliseconds(seconds: Optional[float]) -> str:
+    """Format a number of seconds as milliseconds."""
+    if seconds is None:
+        return "-"
+    return "{:.3f}".format(seconds * 1000)
+
+
+def _peak_rss() -> Optional[int]:
+    """Return the peak resident set size of the process in bytes."""
+    if resource is None:  # pragma: no cover
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        # Linux reports kilobytes, while macOS reports bytes.
+        peak *= 1024
+    return peak
+
+
+def _percent(value: Optional[float]) -> str:
+    """Format a relative change as a percentage."""
+    if value is None:
+        return "-"
+    return "{:+.1%}".format(value)
+
+
+def _percentile(values: Sequence[float], percent: float) -> Optional[float]:
+    """Return a percentile of sorted values using the nearest rank.
+
+    Args:
+        values: The values, in ascending order.
+        percent: The percentile, between 0 and 100.
+
+    Returns:
+        The percentile, or None if there are no values.
+    """
+    if not values:
+        return None
+    rank = math.ceil(len(values) * percent / 100)
+    return values[max(rank, 1) - 1]
@@ -0,0 +1,165 @@
+"""The workloads run by the benchmarks."""
+from __future__ import annotations
+
+import asyncio
+from time import perf_counter
+from typing import Any, Dict, List, NamedTuple
+
+from doozer import Abort, Application
+
+__all__ = ("SCENARIOS", "Scenario", "build", "scenario_messages")
+
+# The number of items in the body of each size of message. Each item is
+# a small dict so that copying a message gets more expensive as it
+# grows.
+SIZES = {"small": 1, "medium": 64, "large": 1024}
+
+
+class Scenario(NamedTuple):
+    """A workload to benchmark.
+
+    Attributes:
+        name: A unique name used to select and compare the scenario.
+        profile: The name of the callback profile (see ``PROFILES``).
+        size: The name of the message size (see ``SIZES``).
+        workers: The number of workers to run.
+        settings: Additional settings for the application.
+        fraction: The fraction of the requested number of messages to
+            process. Slow profiles use fewer messages.
+    """
+
+    name: str
+    profile: str
+    size: str
+    workers: int
+    settings: Dict[str, Any] = {}
+    fraction: float = 1
+
+
+class Consumer:
+    """An in-memory consumer that reads a fixed number of messages.
+
+    Each message records when it was read so that its latency can be
+    measured once it has been acknowledged.
+
+    Args:
+        count: The number of messages to read.
+        size: The number of items in the body of each message.
+    """
+
+    def __init__(self, count: int, size: int) -> None:
+        """Initialize the instance."""
+        self.count = count
+        self.body = [{"key": i, "value": "x" * 16} for i in range(size)]
+        self.read_count = 0
+
+    async def read(self) -> Dict[str, Any]:
+        """Return the next message."""
+        if self.read_count == self.count:
+            raise Abort("benchmark.done", None)
+        self.read_count += 1
+        return {"id": self.read_count, "read_at": perf_counter(), "body": self.body}
+
+
+async def noop(app: Application, message: Any) -> None:
+    """Do nothing."""
+
+
+async def cpu(app: Application, message: Any) -> None:
+    """Do a fixed amount of work without yielding to the event loop."""
+    sum(i * i for i in range(2000))
+
+
+async def io(app: Application, message: Any) -> None:
+    """Wait on something else, like a network call would."""
+    await asyncio.sleep(0.001)
+
+
+async def fanout(app: Application, message: Any) -> List[int]:
+    """Return several results for each message."""
+    return list(range(10))
+
+
+async def passthrough(app: Application, value: Any) -> Any:
+    """Return the value unchanged."""
+    return value
+
+
+def _chain(app: Application) -> None:
+    """Add preprocessors and postprocessors that do nothing."""
+    for _ in range(5):
+        app.message_preprocessor(passthrough)
+    for _ in range(2):
+        app.result_postprocessor(passthrough)
+
+
+# Each profile is a callback and a function that registers any other
+# callbacks it needs.
+PROFILES: Dict[str, Any] = {
+    "noop": (noop, None),
+    "cpu": (cpu, None),
+    "io": (io, None),
+    "fanout": (fanout, lambda app: app.result_postprocessor(passthrough)),
+    "chain": (noop, _chain),
+}
+
+SCENARIOS = (
+    Scenario("noop-small-1", "noop", "small", 1),
+    Scenario("noop-small-4", "noop", "small", 4),
+    Scenario("noop-small-4-sleep", "noop", "small", 4, {"SLEEP_TIME": 0}),
+    Scenario("noop-small-4-nocopy", "noop", "small", 4, {"MESSAGE_COPY": "none"}),
+    Scenario("noop-medium-4", "noop", "medium", 4),
+    Scenario("noop-medium-4-nocopy", "noop", "medium", 4, {"MESSAGE_COPY": "none"}),
+    Scenario("noop-large-4", "noop", "large", 4, fraction=0.1),
+    Scenario("noop-large-4-nocopy", "noop", "large", 4, {"MESSAGE_COPY": "none"}, 0.1),
+    Scenario("chain-small-4", "chain", "small", 4),
+    Scenario("fanout-small-4", "fanout", "small", 4),
+    Scenario("cpu-small-1", "cpu", "small", 1, fraction=0.2),
+    Scenario("cpu-small-4", "cpu", "small", 4, fraction=0.2),
+    Scenario("io-small-1", "io", "small", 1, fraction=0.05),
+    Scenario("io-small-16", "io", "small", 16, fraction=0.2),
+    Scenario("io-small-64", "io", "small", 64, fraction=0.2),
+)
+
+
+def build(scenario: Scenario, messages: int, latencies: List[float]) -> Application:
+    """Build the application for a scenario.
+
+    Args:
+        scenario: The scenario.
+        messages: The number of messages to read.
+        latencies: A list to which the time between reading each
+            message and acknowledging it will be appended.
+
+    Returns:
+        The application.
+    """
+    callback, register = PROFILES[scenario.profile]
+    consumer = Consumer(messages, SIZES[scenario.size])
+
+    app = Application(scenario.name, consumer=consumer, callback=callback)
+    app.settings.update(scenario.settings)
+
+    if register is not None:
+        register(app)
+
+    # Acknowledging every message is what most applications do, and it
+    # means the message is copied unless MESSAGE_COPY says otherwise.
+    @app.message_acknowledgement
+    async def acknowledge(app: Application, message: Any) -> None:
+        latencies.append(perf_counter() - message["read_at"])
+
+    return app
+
+
+def scenario_messages(scenario: Scenario, messages: int) -> int:
+    """Return the number of messages to use for a scenario.
+
+    Args:
+        scenario: The scenario.
+        messages: The requested number of messages.
+
+    Returns:
+        The number of messages, at least 1.
+    """
+    return max(int(messages * scenario.fraction), 1)
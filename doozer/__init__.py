@@ -6,7 +6,8 @@ import os as _os
 import pkg_resources as _pkg_resources
 
 from .base import Application  # NOQA
-from .exceptions import Abort  # NOQA
+from .exceptions import Abort, ProcessingTimeout  # NOQA
+from .executors import in_process, in_thread  # NOQA
 from .extensions import Extension  # NOQA
 
 try:
@@ -2,21 +2,61 @@
 from __future__ import annotations
 
 import asyncio
-from asyncio import AbstractEventLoop, Future, Queue
-from contextlib import suppress
-from copy import deepcopy
+from asyncio import AbstractEventLoop, Future, Queue, QueueFull, Task
+from collections import deque
+from concurrent.futures import (
+    Executor,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from contextlib import contextmanager, suppress
+from copy import copy, deepcopy
+import inspect
 import logging
+import math
+import signal
 import sys
+from time import perf_counter
 import traceback
-from typing import Any, Dict, Iterable, List, NoReturn, Optional
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    NoReturn,
+    Optional,
+    Set,
+    Union,
+)
 
 from . import extensions
 from .config import Config
-from .exceptions import Abort
+from .exceptions import Abort, ProcessingTimeout
+from .metrics import Metrics
 from .types import Callback, Consumer, Message
 
 __all__ = ("Application",)
 
+# The strategies that can be used to keep a copy of the original message
+# for the message acknowledgement callbacks.
+_COPY_STRATEGIES: Dict[str, Callable[[Message], Message]] = {
+    "deep": deepcopy,
+    "none": lambda message: message,
+    "shallow": copy,
+}
+
+# A sentinel placed on the queue to wake up idle processors once the
+# consumer has stopped. Each processor that receives it puts it back
+# before exiting so that it reaches every processor.
+_STOP = object()
+
 
 class Application:
     """A service application.
@@ -35,7 +75,14 @@ class Application:
             instance of :class:`doozer.base.Application` and the
             (possibly) preprocessed incoming message.  While this isn't
             required, it must be provided before the application can be
-            run.
+            run. If ``BATCH_CALLBACK`` is enabled, it will receive a list
+            of messages instead. If the callback is an asynchronous
+            generator, each result it yields will be postprocessed as
+            soon as it's produced.
+
+    Attributes:
+        metrics (doozer.metrics.Metrics): The counters, gauges, and
+            latency histograms recorded while the application runs.
     """
 
     def __init__(
@@ -52,12 +99,36 @@ class Application:
         # Configuration
         self.settings = Config()
         self.settings.from_object(settings or {})
+        self.settings.setdefault("ACKNOWLEDGEMENT_BATCH_SIZE", 100)
+        self.settings.setdefault("ACKNOWLEDGEMENT_BATCH_WAIT", 1)
+        self.settings.setdefault("AUTOSCALE_INTERVAL", 1)
+        self.settings.setdefault("AUTOSCALE_UTILIZATION", 0.75)
+        self.settings.setdefault("BATCH_CALLBACK", False)
+        self.settings.setdefault("BATCH_SIZE", 1)
+        self.settings.setdefault("BATCH_WAIT", 0)
+        self.settings.setdefault("CALLBACK_TIMEOUT", None)
         self.settings.setdefault("DEBUG", False)
-        self.settings.setdefault("SLEEP_TIME", 0.1)
+        self.settings.setdefault("MESSAGE_COPY", "deep")
+        self.settings.setdefault("MESSAGE_KEY", None)
+        self.settings.setdefault("MESSAGE_TIMEOUT", None)
+        self.settings.setdefault("MAX_WORKERS", None)
+        self.settings.setdefault("METRICS_ADDRESS", None)
+        self.settings.setdefault("METRICS_FILE", None)
+        self.settings.setdefault("METRICS_INTERVAL", 10)
+        self.settings.setdefault("NUM_READERS", 1)
+        self.settings.setdefault("POSTPROCESS_CONCURRENCY", 1)
+        self.settings.setdefault("POSTPROCESS_TIMEOUT", None)
+        self.settings.setdefault("PREPROCESS_TIMEOUT", None)
+        self.settings.setdefault("PREFETCH_COUNT", None)
+        self.settings.setdefault("PROCESS_POOL_SIZE", None)
+        self.settings.setdefault("SHUTDOWN_TIMEOUT", None)
+        self.settings.setdefault("SLEEP_TIME", None)
+        self.settings.setdefault("THREAD_POOL_SIZE", None)
 
         # Callbacks
         self.callback = callback
         self._callbacks: Dict[str, List[Callback]] = {
+            "batch_acknowledgement": [],
             "error": [],
             "message_acknowledgement": [],
             "message_preprocessor": [],
@@ -68,8 +139,24 @@ class Application:
 
         self.extensions: Dict[str, extensions.Extension] = {}
 
+        self.metrics = Metrics()
+
+        # Executors used to run synchronous callbacks. They're created
+        # the first time they're needed.
+        self._executors: Dict[str, Executor] = {}
+
         self.consumer = consumer
 
+        # Messages waiting to be passed to the batch acknowledgement
+        # callbacks. The lock is created the first time they're flushed.
+        self._acknowledged: List[Message] = []
+        self._acknowledgement_lock: Optional[asyncio.Lock] = None
+
+        # The reasons consumption has been paused and the readers
+        # waiting for it to resume.
+        self._pause_reasons: Set[str] = set()
+        self._resume_waiters: Deque[Future] = deque()
+
         self.logger = logging.getLogger(self.name)
 
     def __str__(self):
@@ -78,6 +165,29 @@ class Application:
     def __repr__(self):
         return "<Application: {}>".format(self)
 
+    def batch_acknowledgement(self, callback: Callback) -> Callback:
+        """Register a batch acknowledgement callback.
+
+        Args:
+            callback: A callable object that takes two arguments: an
+                instance of :class:`doozer.base.Application` and a list
+                of original incoming messages. It will be called with
+                up to ``ACKNOWLEDGEMENT_BATCH_SIZE`` messages once they
+                have been fully processed, waiting no more than
+                ``ACKNOWLEDGEMENT_BATCH_WAIT`` seconds for the batch to
+                fill.
+
+        Returns:
+            The callback.
+
+        Raises:
+            TypeError: If the callback isn't a coroutine.
+
+        .. versionadded:: 2.0
+        """
+        self._register_callback(callback, "batch_acknowledgement")
+        return callback
+
     def error(self, callback: Callback) -> Callback:
         """Register an error callback.
 
@@ -133,6 +243,30 @@ class Application:
         self._register_callback(callback, "message_preprocessor")
         return callback
 
+    def pause_consumption(self, reason: str = "paused") -> None:
+        """Stop reading messages from the consumer.
+
+        Messages that have already been read will still be processed.
+        Consumption stays paused until it has been resumed for every
+        reason it was paused. If the consumer provides ``pause``, it
+        will be called when consumption is first paused.
+
+        Args:
+            reason: Why consumption is being paused.
+
+        .. versionadded:: 2.0
+        """
+        paused = bool(self._pause_reasons)
+        self._pause_reasons.add(reason)
+        if paused:
+            return
+
+        self.logger.debug("consumption.paused", extra={"reason": reason})
+
+        pause = getattr(self.consumer, "pause", None)
+        if pause is not None:
+            pause()
+
     def result_postprocessor(self, callback: Callback) -> Callback:
         """Register a result postprocessing callback.
 
@@ -151,6 +285,36 @@ class Application:
         self._register_callback(callback, "result_postprocessor")
         return callback
 
+    def resume_consumption(self, reason: str = "paused") -> None:
+        """Resume reading messages from the consumer.
+
+        If consumption was also paused for other reasons, it will stay
+        paused. If the consumer provides ``resume``, it will be called
+        when consumption resumes.
+
+        Args:
+            reason: The reason consumption was paused.
+
+        .. versionadded:: 2.0
+        """
+        if reason not in self._pause_reasons:
+            return
+
+        self._pause_reasons.remove(reason)
+        if self._pause_reasons:
+            return
+
+        self.logger.debug("consumption.resumed", extra={"reason": reason})
+
+        resume = getattr(self.consumer, "resume", None)
+        if resume is not None:
+            resume()
+
+        while self._resume_waiters:
+            waiter = self._resume_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
     def run_forever(
         self,
         num_workers: int = 1,
@@ -162,7 +326,8 @@ class Application:
         Args:
             num_workers: The number of asynchronous tasks to use to
                 process messages received through the consumer.
-                Defaults to 1.
+                Defaults to 1. If ``MAX_WORKERS`` is set, this is the
+                fewest tasks that will be used.
             loop: An event loop that, if provided, will be used for
                 running the application. If none is provided, the
                 default event loop will be used.
@@ -170,8 +335,9 @@ class Application:
                 Defaults to True.
 
         Raises:
-            TypeError: If the consumer is None or the callback isn't a
-                coroutine.
+            TypeError: If the consumer, callback, or ``MESSAGE_KEY``
+                isn't valid.
+            ValueError: If a setting used to run the application isn't valid.
 
         .. versionchanged:: 1.2
 
@@ -182,8 +348,76 @@ class Application:
         if self.consumer is None:
             raise TypeError("The Application's consumer cannot be None.")
 
-        if not asyncio.iscoroutinefunction(self.callback):
-            raise TypeError("The Application's callback must be a coroutine.")
+        if not _is_callback(self.callback):
+            raise TypeError(
+                "The Application's callback must be a coroutine or an "
+                "asynchronous generator."
+            )
+
+        # Make sure the settings are valid before starting anything.
+        _copy_function(self.settings["MESSAGE_COPY"])
+
+        num_readers = self.settings["NUM_READERS"]
+        if num_readers < 1:
+            raise ValueError(
+                "NUM_READERS must be at least 1. Got {!r}".format(num_readers)
+            )
+
+        max_workers = self.settings["MAX_WORKERS"]
+        if max_workers is not None and max_workers < num_workers:
+            raise ValueError(
+                "MAX_WORKERS must be at least {}. Got {!r}".format(
+                    num_workers, max_workers
+                )
+            )
+
+        prefetch_count = self.settings["PREFETCH_COUNT"]
+        if prefetch_count is None:
+            prefetch_count = max_workers or num_workers
+        elif prefetch_count < 1:
+            raise ValueError(
+                "PREFETCH_COUNT must be at least 1. Got {!r}".format(prefetch_count)
+            )
+
+        for key in (
+            "CALLBACK_TIMEOUT",
+            "MESSAGE_TIMEOUT",
+            "POSTPROCESS_TIMEOUT",
+            "PREPROCESS_TIMEOUT",
+            "SHUTDOWN_TIMEOUT",
+        ):
+            timeout = self.settings[key]
+            if timeout is not None and timeout <= 0:
+                raise ValueError("{} must be positive. Got {!r}".format(key, timeout))
+
+        message_key = self.settings["MESSAGE_KEY"]
+        if message_key is not None:
+            if not callable(message_key):
+                raise TypeError(
+                    "MESSAGE_KEY must be callable. Got {!r}".format(message_key)
+                )
+            if self.settings["BATCH_CALLBACK"]:
+                raise ValueError("MESSAGE_KEY can't be used with BATCH_CALLBACK.")
+            # Messages read by different readers can reach the queue in
+            # any order.
+            if num_readers > 1:
+                raise ValueError("MESSAGE_KEY can't be used with NUM_READERS > 1.")
+
+        batch_size = self.settings["ACKNOWLEDGEMENT_BATCH_SIZE"]
+        if batch_size < 1:
+            raise ValueError(
+                "ACKNOWLEDGEMENT_BATCH_SIZE must be at least 1. Got {!r}".format(
+                    batch_size
+                )
+            )
+
+        batch_wait = self.settings["ACKNOWLEDGEMENT_BATCH_WAIT"]
+        if batch_wait <= 0:
+            raise ValueError(
+                "ACKNOWLEDGEMENT_BATCH_WAIT must be positive. Got {!r}".format(
+                    batch_wait
+                )
+            )
 
         # Use the specified event loop, otherwise use the default one.
         loop = loop or _new_event_loop()
@@ -215,56 +449,153 @@ class Application:
         self.logger.debug("application.started")
 
         # Create an asynchronous queue to pass the messages from the
-        # consumer to the processor. The queue should hold one message
-        # for each processing task.
-        queue = asyncio.Queue(maxsize=num_workers)
+        # consumer to the processor. Unless told otherwise, the queue
+        # should hold one message for each processing task. If messages
+        # have keys, those with the same key are processed in order.
+        if message_key is None:
+            queue = asyncio.Queue(maxsize=prefetch_count)
+        else:
+            queue = _KeyedQueue(message_key, maxsize=prefetch_count)
+
+        # Keep track of how busy the application is.
+        busy = self.metrics.gauge("workers.busy")
+        total = self.metrics.gauge("workers.total")
+        self.metrics.gauge(
+            "workers.utilization",
+            lambda: busy.value / total.value if total.value else 0,
+        )
+        self.metrics.gauge("queue.depth", queue.qsize)
+        self.metrics.gauge("consumption.paused", lambda: int(bool(self._pause_reasons)))
+
+        # Create a task to export the metrics if there's anywhere to
+        # export them to.
+        if self.settings["METRICS_FILE"] or self.settings["METRICS_ADDRESS"]:
+            exporter = loop.create_task(self._export_metrics())
+        else:
+            exporter = None
+
+        # Create a task to acknowledge batches that haven't filled up.
+        if self._callbacks["batch_acknowledgement"]:
+            acknowledger = loop.create_task(self._acknowledge_periodically())
+        else:
+            acknowledger = None
+        self.metrics.gauge("acknowledgements.pending", lambda: len(self._acknowledged))
+
+        # Create tasks to read from the consumer and wrap them inside a
+        # future to monitor them. Once it's done, wake up any processors
+        # waiting on an empty queue so they can exit.
+        readers = _Readers()
+        consumer = asyncio.gather(
+            *(
+                loop.create_task(self._consume(queue, readers))
+                for _ in range(num_readers)
+            )
+        )
+        consumer.add_done_callback(lambda _: _stop_processors(queue))
 
-        # Create a task to monitor the consumer.
-        consumer = loop.create_task(self._consume(queue))
+        # Create a task to run the tasks that process each message
+        # received by the consumer. When the loop stops running it
+        # should be restarted and wait until the task is done.
+        future = loop.create_task(
+            self._supervise(consumer, queue, loop, num_workers, max_workers)
+        )
 
-        # Create tasks to process each message received by the
-        # consumer and wrap them inside a future. When the loop stops
-        # running it should be restarted and wait until the future is
-        # done.
-        tasks = [
-            loop.create_task(self._process(consumer, queue, loop))
-            for _ in range(num_workers)
-        ]
-        future = asyncio.gather(*tasks)
+        # When told to stop, stop reading messages and give the workers
+        # SHUTDOWN_TIMEOUT seconds to process the ones already read
+        # before abandoning them.
+        shutdown_timeout = self.settings["SHUTDOWN_TIMEOUT"]
+        stopping = False
+
+        def abandon():
+            if not future.done():
+                self.logger.warning("application.abandoning")
+                future.cancel()
+
+        def stop(signum=None):
+            nonlocal stopping
+            if signum is not None:
+                self.logger.info(
+                    "application.stopping",
+                    extra={"signal": signal.Signals(signum).name},
+                )
+
+            if stopping:
+                # Don't wait for the workers if asked to stop again.
+                abandon()
+                return
+
+            stopping = True
+            readers.stop()
+            if shutdown_timeout is not None:
+                loop.call_later(shutdown_timeout, abandon)
+
+        handlers = _add_signal_handlers(loop, stop)
 
         try:
             # Run the loop until the consumer says to stop or message
             # processing fails.
             loop.run_until_complete(asyncio.gather(consumer, future))
         except BaseException:
-            self.logger.exception("loop.canceled")
+            if not future.cancelled():
+                self.logger.exception("loop.canceled")
         finally:
             # If something went wrong while processing the message,
             # cancel the consumer. This will alert the processors to
             # stop once the queue is empty.
+            if not future.done():
+                stop()
             consumer.cancel()
 
-            # Run the loop until message processing completes. This will
-            # allow the tasks to finish processing all of the messages
-            # in the queue and then exit cleanly.
-            loop.run_until_complete(future)
-
-            # Check for any exceptions that may have been raised by the
-            # tasks inside the future.
-            exc = future.exception()
-            if exc:
-                self.logger.exception("tasks.erred", exc_info=exc)
-
-            # Teardown
-            tasks = [
-                loop.create_task(callback(self))
-                for callback in self._callbacks["teardown"]
-            ]
-            future = asyncio.gather(*tasks)
-            loop.run_until_complete(future)
+            try:
+                # Run the loop until message processing completes. This
+                # will allow the tasks to finish processing all of the
+                # messages in the queue and then exit cleanly.
+                with suppress(asyncio.CancelledError):
+                    loop.run_until_complete(future)
+                loop.run_until_complete(asyncio.wait([consumer]))
+
+                abandoned = self.metrics.counter("messages.abandoned")
+                if future.cancelled():
+                    # Count the messages that were never processed along
+                    # with the ones the workers were processing.
+                    abandoned.inc(_pending(queue))
+                else:
+                    # Check for any exceptions that may have been raised
+                    # by the tasks inside the future.
+                    exc = future.exception()
+                    if exc:
+                        self.logger.exception("tasks.erred", exc_info=exc)
+
+                if abandoned.value:
+                    self.logger.warning(
+                        "messages.abandoned", extra={"count": abandoned.value}
+                    )
 
-            # Clean up after ourselves.
-            loop.close()
+            finally:
+                # Acknowledge any messages that have been processed
+                # since the last batch.
+                if acknowledger:
+                    acknowledger.cancel()
+                    loop.run_until_complete(asyncio.wait([acknowledger]))
+                    loop.run_until_complete(self._flush_acknowledgements())
+
+                # Export the final state of the metrics.
+                if exporter:
+                    exporter.cancel()
+                    loop.run_until_complete(asyncio.wait([exporter]))
+
+                # Teardown
+                tasks = [
+                    loop.create_task(callback(self))
+                    for callback in self._callbacks["teardown"]
+                ]
+                future = asyncio.gather(*tasks)
+                loop.run_until_complete(future)
+
+                # Clean up after ourselves.
+                _remove_signal_handlers(loop, handlers)
+                self._shutdown_executors()
+                loop.close()
 
         self.logger.debug("application.stopped")
 
@@ -321,6 +652,16 @@ class Application:
             },
         )
 
+    async def _acknowledge_periodically(self) -> None:
+        """Flush the acknowledged messages until cancelled.
+
+        Messages are flushed every ``ACKNOWLEDGEMENT_BATCH_WAIT`` seconds
+        so that they don't wait long for a batch to fill.
+        """
+        while True:
+            await asyncio.sleep(self.settings["ACKNOWLEDGEMENT_BATCH_WAIT"])
+            await self._flush_acknowledgements()
+
     async def _apply_callbacks(self, callbacks: List[Callback], value: Message) -> Any:
         """Apply callbacks to a set of arguments.
 
@@ -340,30 +681,227 @@ class Application:
             value = await callback(self, value)
         return value
 
-    async def _consume(self, queue: Queue) -> None:
+    async def _consume(self, queue: Queue, readers: Optional[_Readers] = None) -> None:
         """Read in incoming messages.
 
         Messages will be read from the consumer until it raises an
-        :class:`~doozer.exceptions.Abort` exception.
+        :class:`~doozer.exceptions.Abort` exception. When more than one
+        task is reading from the consumer, the first one to receive the
+        exception stops the others.
+
+        If the consumer provides ``read_many``, it will be used to read
+        up to ``BATCH_SIZE`` messages at a time, waiting no more than
+        ``BATCH_WAIT`` seconds for the batch to fill. When
+        ``BATCH_CALLBACK`` is enabled, each batch is added to the queue
+        as a single list of messages.
 
         Args:
             queue: Any messages read in by the consumer will be added to
                 the queue to share them with any future processing the
                 messages.
+            readers: The tasks reading from the consumer. If not
+                provided, this is assumed to be the only one.
         """
-        while True:
-            # Read messages and add them to the queue.
+        if readers is None:
+            readers = _Readers()
+
+        read_many = getattr(self.consumer, "read_many", None)
+        batch_callback = self.settings["BATCH_CALLBACK"]
+
+        consumed = self.metrics.counter("messages.consumed")
+        abandoned = self.metrics.counter("messages.abandoned")
+        read_latency = self.metrics.histogram("latency.read")
+
+        if read_many is None and not batch_callback:
+            # Avoid the overhead of batches when they aren't needed.
+            while not readers.stopped:
+                # Read messages and add them to the queue.
+                try:
+                    with readers.reading():
+                        if self._pause_reasons:
+                            await self._wait_for_resume()
+                        started = perf_counter()
+                        value = await self.consumer.read()
+                except Abort:
+                    self.logger.debug("consumer.aborted")
+                    readers.stop()
+                    return
+                except asyncio.CancelledError:
+                    if readers.stopped:
+                        return
+                    raise
+
+                else:
+                    read_latency.observe(perf_counter() - started)
+                    consumed.inc()
+                    try:
+                        await queue.put(value)
+                    except asyncio.CancelledError:
+                        # The message was read but never queued.
+                        abandoned.inc()
+                        raise
+
+        while not readers.stopped:
+            # Read batches of messages and add them to the queue.
             try:
-                value = await self.consumer.read()
+                with readers.reading():
+                    if self._pause_reasons:
+                        await self._wait_for_resume()
+                    started = perf_counter()
+                    if read_many is None:
+                        values = [await self.consumer.read()]
+                    else:
+                        values = await read_many(
+                            self.settings["BATCH_SIZE"], self.settings["BATCH_WAIT"]
+                        )
             except Abort:
                 self.logger.debug("consumer.aborted")
+                readers.stop()
+                return
+            except asyncio.CancelledError:
+                if readers.stopped:
+                    return
+                raise
+
+            if not values:
+                continue
+
+            read_latency.observe(perf_counter() - started)
+            consumed.inc(len(values))
+
+            if batch_callback:
+                # The whole batch is queued as a single message.
+                values = [values]
+
+            queued = 0
+            try:
+                for value in values:
+                    await queue.put(value)
+                    queued += 1
+            except asyncio.CancelledError:
+                # The messages were read but never queued.
+                abandoned.inc(len(values) - queued)
+                raise
+
+    def _executor(self, kind: str) -> Executor:
+        """Return one of the application's executors.
+
+        Args:
+            kind: Either ``"thread"`` or ``"process"``.
+
+        Returns:
+            The executor. The thread pool is sized by
+            ``THREAD_POOL_SIZE`` and the process pool by
+            ``PROCESS_POOL_SIZE``.
+        """
+        try:
+            return self._executors[kind]
+        except KeyError:
+            pass
+
+        if kind == "thread":
+            executor = ThreadPoolExecutor(
+                max_workers=self.settings.get("THREAD_POOL_SIZE"),
+                thread_name_prefix=self.name,
+            )
+        else:
+            executor = ProcessPoolExecutor(
+                max_workers=self.settings.get("PROCESS_POOL_SIZE")
+            )
+
+        self._executors[kind] = executor
+        self.logger.debug("executor.started", extra={"kind": kind})
+        return executor
+
+    async def _export_metrics(self) -> None:
+        """Export the metrics until cancelled.
+
+        If ``METRICS_FILE`` is set, the metrics will be written to it
+        every ``METRICS_INTERVAL`` seconds and once more when the task
+        is cancelled. If ``METRICS_ADDRESS`` is set, the metrics will
+        be served over HTTP from it.
+        """
+        path = self.settings["METRICS_FILE"]
+        address = self.settings["METRICS_ADDRESS"]
+
+        server = None
+        if address:
+            host, _, port = address.rpartition(":")
+            server = await self.metrics.serve(host or None, int(port))
+            self.logger.debug("metrics.serving", extra={"address": address})
+
+        try:
+            while True:
+                if path:
+                    self.metrics.dump(path)
+                await asyncio.sleep(self.settings["METRICS_INTERVAL"])
+        finally:
+            if path:
+                self.metrics.dump(path)
+            if server:
+                server.close()
+                await server.wait_closed()
+
+    async def _fail(self, message: Message, exc: Exception) -> None:
+        """Log the failed message and call the error callbacks.
+
+        Args:
+            message: The message that failed to process.
+            exc: The exception that was raised.
+        """
+        if isinstance(exc, ProcessingTimeout):
+            self.metrics.counter("messages.timed_out").inc()
+            self.logger.error(
+                "message.timed_out", extra={"stage": exc.stage}, exc_info=exc
+            )
+        else:
+            self.logger.error("message.failed", exc_info=exc)
+
+        for callback in self._callbacks["error"]:
+            # Any callback can prevent execution of further callbacks by
+            # raising Abort.
+            try:
+                await callback(self, message, exc)
+            except Abort:
+                break
+
+    async def _flush_acknowledgements(self) -> None:
+        """Pass the acknowledged messages to the batch callbacks.
+
+        Only one batch is acknowledged at a time so that batches are
+        acknowledged in the order they were filled. If a callback raises
+        an exception, it's logged and the batch is dropped. Its messages
+        were never acknowledged, so a consumer that redelivers
+        unacknowledged messages will deliver them again.
+        """
+        if self._acknowledgement_lock is None:
+            self._acknowledgement_lock = asyncio.Lock()
+
+        async with self._acknowledgement_lock:
+            if not self._acknowledged:
                 return
 
+            messages, self._acknowledged = self._acknowledged, []
+            try:
+                for callback in self._callbacks["batch_acknowledgement"]:
+                    await callback(self, messages)
+            except Exception:
+                self.metrics.counter("acknowledgements.failed").inc()
+                self.logger.exception(
+                    "acknowledgements.failed", extra={"count": len(messages)}
+                )
             else:
-                await queue.put(value)
+                self.metrics.counter("acknowledgements.flushed").inc()
+                self.logger.debug(
+                    "acknowledgements.flushed", extra={"count": len(messages)}
+                )
 
     async def _process(
-        self, future: Future, queue: Queue, loop: AbstractEventLoop
+        self,
+        future: Future,
+        queue: Queue,
+        loop: AbstractEventLoop,
+        workers: Optional[_Workers] = None,
     ) -> None:
         """Process incoming messages.
 
@@ -372,52 +910,182 @@ class Application:
                 consumer is no longer receiving new messages.
             queue: A queue containing incoming messages to be processed.
             loop: The event loop used by the application.
+            workers: The tasks processing messages. If not provided,
+                this is assumed to be the only one.
         """
+        if workers is None:
+            workers = _Workers()
+
+        sleep_time = self.settings.get("SLEEP_TIME")
+        copy_message = _copy_function(self.settings.get("MESSAGE_COPY", "deep"))
+        acknowledgements = self._callbacks["message_acknowledgement"]
+        batch_acknowledgements = self._callbacks["batch_acknowledgement"]
+        batch_size = self.settings.get("ACKNOWLEDGEMENT_BATCH_SIZE", 100)
+        streaming = inspect.isasyncgenfunction(self.callback)
+
+        message_timeout = self.settings.get("MESSAGE_TIMEOUT")
+        preprocess_timeout = self.settings.get("PREPROCESS_TIMEOUT")
+        callback_timeout = self.settings.get("CALLBACK_TIMEOUT")
+        postprocess_timeout = self.settings.get("POSTPROCESS_TIMEOUT")
+
+        # Look up the metrics once rather than for every message.
+        metrics = self.metrics
+        busy = metrics.gauge("workers.busy")
+        processed = metrics.counter("messages.processed")
+        aborted = metrics.counter("messages.aborted")
+        failed = metrics.counter("messages.failed")
+        acknowledged = metrics.counter("messages.acknowledged")
+        abandoned = metrics.counter("messages.abandoned")
+        preprocess_latency = metrics.histogram("latency.preprocess")
+        callback_latency = metrics.histogram("latency.callback")
+        postprocess_latency = metrics.histogram("latency.postprocess")
+        acknowledge_latency = metrics.histogram("latency.acknowledge")
+        message_latency = metrics.histogram("latency.message")
+
         while True:
-            if queue.empty():
-                # If there aren't any messages in the queue, check to
-                # see if the consumer is done. If it is, exit.
-                # Otherwise yield control back to the event loop and
-                # then try again.
-                if future.done():
+            try:
+                with workers.waiting():
+                    if queue.empty():
+                        # If there aren't any messages in the queue,
+                        # check to see if the consumer is done. If it
+                        # is, exit.
+                        if future.done():
+                            break
+
+                        if sleep_time is not None:
+                            # If polling has been requested, yield
+                            # control back to the event loop and then
+                            # try again.
+                            await asyncio.sleep(sleep_time)
+                            continue
+
+                    # Otherwise wait for the next message. The consumer
+                    # will place _STOP on the queue when it's done.
+                    message = await queue.get()
+            except asyncio.CancelledError:
+                # Idle workers are cancelled when there are more of them
+                # than needed.
+                if workers.retired():
                     break
+                raise
 
-                await asyncio.sleep(self.settings["SLEEP_TIME"])
-                continue
+            if message is _STOP:
+                _stop_processors(queue)
+                break
 
-            message = await queue.get()
             # Save a copy of the original message in case its needed
-            # later.
-            original_message = deepcopy(message)
+            # later. If nothing will acknowledge it, don't bother.
+            if acknowledgements or batch_acknowledgements:
+                original_message = copy_message(message)
+            else:
+                original_message = None
+
+            busy.inc()
+            started = received = perf_counter()
+            cancelled = False
+
+            if message_timeout is None:
+                deadline = None
+            else:
+                deadline = received + message_timeout
 
             try:
-                message = await self._apply_callbacks(
-                    self._callbacks["message_preprocessor"], message
+                message = await _wait_for(
+                    self._apply_callbacks(
+                        self._callbacks["message_preprocessor"], message
+                    ),
+                    "preprocess",
+                    preprocess_timeout,
+                    deadline,
                 )
                 self.logger.debug("message.preprocessed")
 
-                results = await self.callback(self, message)
+                now = perf_counter()
+                preprocess_latency.observe(now - started)
+                started = now
+
+                if streaming:
+                    # Nothing runs until the results are iterated over.
+                    # The time spent producing them will be included in
+                    # the time spent postprocessing them, and
+                    # CALLBACK_TIMEOUT applies to each one.
+                    results = self.callback(self, message)
+                else:
+                    results = await _wait_for(
+                        self.callback(self, message),
+                        "callback",
+                        callback_timeout,
+                        deadline,
+                    )
+
+                    now = perf_counter()
+                    callback_latency.observe(now - started)
+                    started = now
+            except asyncio.CancelledError:
+                cancelled = True
+                raise
             except Abort as e:
+                aborted.inc()
                 await self._abort(e)
             except Exception as e:
-                self.logger.error("message.failed", exc_info=sys.exc_info())
-
-                for callback in self._callbacks["error"]:
-                    # Any callback can prevent execution of further
-                    # callbacks by raising Abort.
-                    try:
-                        await callback(self, message, e)
-                    except Abort:
-                        break
+                failed.inc()
+                await self._fail(message, e)
 
             else:
-                await self._postprocess_results(results)
+                try:
+                    await _wait_for(
+                        self._postprocess_results(results),
+                        "postprocess",
+                        postprocess_timeout,
+                        deadline,
+                    )
+                except asyncio.CancelledError:
+                    cancelled = True
+                    raise
+                except ProcessingTimeout as e:
+                    failed.inc()
+                    await self._fail(message, e)
+                except _CallbackError as e:
+                    # The streaming callback failed partway through.
+                    # Handle it just like any other callback failure.
+                    try:
+                        raise e.exception
+                    except Abort as exc:
+                        aborted.inc()
+                        await self._abort(exc)
+                    except Exception as exc:
+                        failed.inc()
+                        await self._fail(message, exc)
+                else:
+                    processed.inc()
+                    postprocess_latency.observe(perf_counter() - started)
             finally:
-                # Don't use _apply_callbacks here since we want to pass
-                # the original message into each callback.
-                for callback in self._callbacks["message_acknowledgement"]:
-                    await callback(self, original_message)
-                self.logger.debug("message.acknowledged")
+                if cancelled:
+                    # The worker was stopped before it finished. Leave
+                    # the message unacknowledged so that it can be
+                    # delivered again.
+                    abandoned.inc()
+                    busy.dec()
+                else:
+                    # Don't use _apply_callbacks here since we want to pass
+                    # the original message into each callback.
+                    started = perf_counter()
+                    for callback in acknowledgements:
+                        await callback(self, original_message)
+                    if batch_acknowledgements:
+                        self._acknowledged.append(original_message)
+                        if len(self._acknowledged) >= batch_size:
+                            await self._flush_acknowledgements()
+                    now = perf_counter()
+                    acknowledge_latency.observe(now - started)
+                    message_latency.observe(now - received)
+                    acknowledged.inc()
+                    self.logger.debug("message.acknowledged")
+
+                    busy.dec()
+
+                    # Let the next message with the same key be processed.
+                    queue.task_done()
 
                 # If there are no new messages in the queue, _process
                 # won't reassign the variables that it uses to track the
@@ -433,23 +1101,116 @@ class Application:
                 del message
                 del original_message
 
-    async def _postprocess_results(self, results: Iterable) -> None:
+    async def _postprocess_results(
+        self, results: Union[Iterable, AsyncIterable]
+    ) -> None:
         """Postprocess the results.
 
+        If ``POSTPROCESS_CONCURRENCY`` is greater than 1, up to that many
+        results will be postprocessed at the same time.
+
+        Results from an asynchronous iterable are postprocessed as they
+        are produced. The next result isn't requested until there is
+        room to postprocess it.
+
         Args:
             results: The results returned by processing the message.
+
+        Raises:
+            _CallbackError: If iterating over asynchronous results
+                raises an exception.
         """
         if results is None:
             return
 
-        for result in results:
+        if hasattr(results, "__aiter__"):
+            results = _stream(results, self.settings.get("CALLBACK_TIMEOUT"))
+
+        concurrency = self.settings.get("POSTPROCESS_CONCURRENCY", 1)
+        if concurrency > 1:
+            await self._postprocess_results_concurrently(results, concurrency)
+            return
+
+        if hasattr(results, "__aiter__"):
+            async for result in results:
+                await self._postprocess_result(result)
+        else:
+            for result in results:
+                await self._postprocess_result(result)
+
+    async def _postprocess_result(self, result: Any) -> None:
+        """Postprocess a single result.
+
+        Args:
+            result: A result returned by processing the message.
+        """
+        try:
+            await self._apply_callbacks(self._callbacks["result_postprocessor"], result)
+            self.logger.debug("result.postprocessed")
+        except Abort as e:
+            await self._abort(e)
+
+    async def _postprocess_results_concurrently(
+        self, results: Union[Iterable, AsyncIterable], concurrency: int
+    ) -> None:
+        """Postprocess the results concurrently.
+
+        No more than ``concurrency`` results will be postprocessed at
+        once. If postprocessing a result raises an exception, no new
+        results will be postprocessed and, once those already started
+        are done, the first exception will be raised.
+
+        Args:
+            results: The results returned by processing the message.
+            concurrency: The maximum number of results to postprocess
+                at the same time.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        pending = set()
+        errors = []
+
+        if hasattr(results, "__aiter__"):
+            iterator = results.__aiter__()
+        else:
+            iterator = _aiter(results)
+
+        async def postprocess(result):
             try:
-                await self._apply_callbacks(
-                    self._callbacks["result_postprocessor"], result
-                )
-                self.logger.debug("result.postprocessed")
-            except Abort as e:
-                await self._abort(e)
+                await self._postprocess_result(result)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                semaphore.release()
+
+        try:
+            while True:
+                # Wait for room before asking for the next result so
+                # that streaming callbacks don't get ahead.
+                await semaphore.acquire()
+                if errors:
+                    break
+
+                try:
+                    result = await iterator.__anext__()
+                except StopAsyncIteration:
+                    break
+
+                task = asyncio.ensure_future(postprocess(result))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+        except asyncio.CancelledError:
+            # Don't leave the results being postprocessed running on
+            # their own once the message has timed out or been
+            # abandoned.
+            for task in pending:
+                task.cancel()
+            raise
+        finally:
+            if pending:
+                await asyncio.wait(pending)
+
+        if errors:
+            raise errors[0]
 
     def _register_callback(self, callback: Callback, callback_container: str) -> None:
         """Register a callback.
@@ -472,6 +1233,129 @@ class Application:
             extra={"type": callback_container, "callback": callback.__qualname__},
         )
 
+    def _shutdown_executors(self) -> None:
+        """Shut down the application's executors.
+
+        This will wait for any work submitted to them to finish.
+        """
+        while self._executors:
+            kind, executor = self._executors.popitem()
+            executor.shutdown(wait=True)
+            self.logger.debug("executor.stopped", extra={"kind": kind})
+
+    async def _supervise(
+        self,
+        future: Future,
+        queue: Queue,
+        loop: AbstractEventLoop,
+        min_workers: int,
+        max_workers: Optional[int],
+    ) -> None:
+        """Run the tasks that process incoming messages.
+
+        If ``max_workers`` is provided, tasks will be added and removed
+        every ``AUTOSCALE_INTERVAL`` seconds based on how long messages
+        take to process and how many are waiting in the queue.
+
+        Args:
+            future: The future that, when done, will indicate that the
+                consumer is no longer receiving new messages.
+            queue: A queue containing incoming messages to be processed.
+            loop: The event loop used by the application.
+            min_workers: The fewest tasks to run.
+            max_workers: The most tasks to run. If None, exactly
+                ``min_workers`` tasks will be run.
+
+        Raises:
+            Exception: Any exception raised by one of the tasks.
+        """
+        workers = _Workers()
+        total = self.metrics.gauge("workers.total")
+
+        def start(count):
+            for _ in range(count):
+                workers.tasks.add(
+                    loop.create_task(self._process(future, queue, loop, workers))
+                )
+            total.set(len(workers.tasks))
+
+        start(min_workers)
+
+        if max_workers is None:
+            # Cancelling this will cancel the workers, too.
+            await asyncio.gather(*workers.tasks)
+            return
+
+        interval = self.settings["AUTOSCALE_INTERVAL"]
+        utilization = self.settings["AUTOSCALE_UTILIZATION"]
+
+        message_latency = self.metrics.histogram("latency.message")
+        busy = self.metrics.gauge("workers.busy")
+        count, busy_time = message_latency.count, message_latency.sum
+        message_time = None
+        started = loop.time()
+
+        while workers.tasks:
+            try:
+                done, _ = await asyncio.wait(
+                    workers.tasks, timeout=interval, return_when=asyncio.FIRST_COMPLETED
+                )
+            except asyncio.CancelledError:
+                # Stop the workers, too, and wait for them to finish.
+                for task in workers.tasks:
+                    task.cancel()
+                await asyncio.wait(workers.tasks)
+                raise
+            for task in done:
+                workers.tasks.discard(task)
+                # Stop if a task failed.
+                task.result()
+            total.set(len(workers.tasks))
+
+            now = loop.time()
+            if now - started < interval or future.done():
+                continue
+
+            # Work out how many workers were busy on average since the
+            # last check, and how long each message took.
+            processed = message_latency.count - count
+            if processed:
+                message_time = (message_latency.sum - busy_time) / processed
+                load = (message_latency.sum - busy_time) / (now - started)
+            else:
+                load = busy.value
+            count, busy_time = message_latency.count, message_latency.sum
+            started = now
+
+            current = len(workers.tasks)
+            desired = _desired_workers(
+                current,
+                min_workers,
+                max_workers,
+                load=load,
+                backlog=queue.qsize() * (message_time or 0) / interval,
+                utilization=utilization,
+            )
+            if desired > current:
+                start(desired - current)
+            elif desired < current and workers.retire():
+                # Retire idle workers one at a time to avoid removing
+                # workers that will be needed again soon.
+                total.set(current - 1)
+            else:
+                continue
+
+            self.logger.info(
+                "workers.scaled",
+                extra={
+                    "previous_workers": current,
+                    "workers": total.value,
+                    "load": load,
+                    "queue_depth": queue.qsize(),
+                    "message_time": message_time,
+                },
+            )
+
     def _teardown(self, future: Future, loop: AbstractEventLoop) -> None:
         """Tear down the application."""
         tasks = [
@@ -481,6 +1365,498 @@ class Application:
         future = asyncio.gather(*tasks)
         loop.run_until_complete(future)
 
+    async def _wait_for_resume(self) -> None:
+        """Wait until consumption is no longer paused."""
+        while self._pause_reasons:
+            waiter = asyncio.get_event_loop().create_future()
+            self._resume_waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self._resume_waiters:
+                    self._resume_waiters.remove(waiter)
+
+
+class _CallbackError(Exception):
+    """An exception raised by a streaming callback.
+
+    This is used to tell exceptions raised while producing results apart
+    from those raised while postprocessing them.
+
+    Args:
+        exception: The exception raised by the callback.
+    """
+
+    def __init__(self, exception: Exception) -> None:
+        """Initialize the class."""
+        super().__init__(exception)
+        self.exception = exception
+
+
+class _KeyedQueue:
+    """A queue that hands out one message at a time for each key.
+
+    Messages are kept in a lane for their key. A worker that gets a
+    message holds its lane until it calls :meth:`task_done`, so messages
+    with the same key are processed one at a time in the order they
+    were added while messages with different keys are processed
+    concurrently. Lanes are removed as soon as they're empty, so there
+    are never more of them than messages in the queue plus workers.
+
+    It implements the parts of :class:`asyncio.Queue` used by the
+    application.
+
+    Args:
+        key: A callable that takes a message and returns its key.
+        maxsize: The most messages that can be waiting in the queue.
+    """
+
+    def __init__(self, key: Callable[[Message], Hashable], maxsize: int = 0) -> None:
+        """Initialize the class."""
+        self.maxsize = maxsize
+        self._key = key
+        self._lanes: Dict[Hashable, Deque[Message]] = {}
+        self._ready: Deque[Hashable] = deque()
+        self._held: Dict[Task, Hashable] = {}
+        self._size = 0
+        self._stopped = False
+        self._getters: Deque[Future] = deque()
+        self._putters: Deque[Future] = deque()
+
+    def empty(self) -> bool:
+        """Return True if there aren't any messages ready to be processed."""
+        return not self._ready
+
+    def full(self) -> bool:
+        """Return True if no more messages can be added."""
+        return 0 < self.maxsize <= self._size
+
+    async def get(self) -> Message:
+        """Remove and return the next message whose lane isn't held.
+
+        Once ``_STOP`` has been added and no messages are ready,
+        ``_STOP`` is returned.
+        """
+        while not self._ready:
+            if self._stopped:
+                return _STOP
+            await self._wait(self._getters)
+
+        key = self._ready.popleft()
+        message = self._lanes[key].popleft()
+        self._held[asyncio.current_task()] = key
+        self._size -= 1
+        _wake_next(self._putters)
+        return message
+
+    async def put(self, message: Message) -> None:
+        """Add a message, waiting for room if the queue is full."""
+        while self.full():
+            await self._wait(self._putters)
+        self.put_nowait(message)
+
+    def put_nowait(self, message: Message) -> None:
+        """Add a message without waiting for room.
+
+        Raises:
+            QueueFull: If the queue is full.
+        """
+        if message is _STOP:
+            self._stopped = True
+            while self._getters:
+                _wake_next(self._getters)
+            return
+
+        if self.full():
+            raise QueueFull
+
+        key = self._key(message)
+        lane = self._lanes.get(key)
+        if lane is None:
+            # A lane that exists is either ready or held, so only new
+            # lanes need to be marked as ready.
+            lane = self._lanes[key] = deque()
+            self._ready.append(key)
+            _wake_next(self._getters)
+        lane.append(message)
+        self._size += 1
+
+    def qsize(self) -> int:
+        """Return the number of messages waiting in the queue."""
+        return self._size
+
+    def task_done(self) -> None:
+        """Release the lane held by the current task."""
+        key = self._held.pop(asyncio.current_task())
+        if self._lanes[key]:
+            self._ready.append(key)
+            _wake_next(self._getters)
+        else:
+            del self._lanes[key]
+
+    async def _wait(self, waiters: Deque[Future]) -> None:
+        """Wait to be woken up."""
+        waiter = asyncio.get_event_loop().create_future()
+        waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter in waiters:
+                waiters.remove(waiter)
+            elif not waiter.cancelled():
+                # Pass the wake up on to the next task.
+                _wake_next(waiters)
+            raise
+
+
+class _Readers:
+    """The tasks reading messages from the consumer.
+
+    Once any of the tasks is told by the consumer to stop, the others
+    are stopped, too. Tasks waiting on the consumer are cancelled, and
+    tasks adding messages to the queue are allowed to finish so that no
+    messages that have already been read are lost.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the class."""
+        self.stopped = False
+        self._reading: Set[Task] = set()
+
+    @contextmanager
+    def reading(self) -> Iterator[None]:
+        """Mark the current task as waiting on the consumer."""
+        task = asyncio.current_task()
+        self._reading.add(task)
+        try:
+            yield
+        finally:
+            self._reading.discard(task)
+
+    def stop(self) -> None:
+        """Stop all of the tasks."""
+        self.stopped = True
+        for task in self._reading:
+            task.cancel()
+
+
+class _Workers:
+    """The tasks processing messages.
+
+    Workers waiting for a message can be retired. Since they aren't
+    processing anything, they can be cancelled without losing any
+    messages.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the class."""
+        self.tasks: Set[Task] = set()
+        self._retired: Set[Task] = set()
+        self._waiting: Set[Task] = set()
+
+    def retire(self) -> bool:
+        """Retire one of the workers waiting for a message.
+
+        Returns:
+            True if a worker was retired.
+        """
+        if not self._waiting:
+            return False
+
+        task = self._waiting.pop()
+        self._retired.add(task)
+        task.cancel()
+        return True
+
+    def retired(self) -> bool:
+        """Return True if the current task has been retired.
+
+        The task is forgotten once it has been told. It should stop
+        without asking again.
+        """
+        task = asyncio.current_task()
+        if task not in self._retired:
+            return False
+
+        self._retired.discard(task)
+        return True
+
+    @contextmanager
+    def waiting(self) -> Iterator[None]:
+        """Mark the current task as waiting for a message."""
+        task = asyncio.current_task()
+        self._waiting.add(task)
+        try:
+            yield
+        finally:
+            self._waiting.discard(task)
+
+
+async def _aiter(iterable: Iterable) -> AsyncIterator:
+    """Iterate over an iterable asynchronously.
+
+    Args:
+        iterable: The iterable.
+
+    Yields:
+        The items in the iterable.
+    """
+    for item in iterable:
+        yield item
+
+
+def _copy_function(strategy: Any) -> Callable[[Message], Message]:
+    """Return the function used to copy the original message.
+
+    Args:
+        strategy: Either one of ``"none"``, ``"shallow"``, or ``"deep"``
+            or a callable that takes the incoming message and returns
+            the value that should be passed to the message
+            acknowledgement callbacks.
+
+    Returns:
+        The copy function.
+
+    Raises:
+        ValueError: If the strategy isn't valid.
+    """
+    if callable(strategy):
+        return strategy
+
+    try:
+        return _COPY_STRATEGIES[strategy]
+    except (KeyError, TypeError):
+        raise ValueError(
+            "MESSAGE_COPY must be one of {} or a callable. Got {!r}".format(
+                ", ".join(repr(s) for s in _COPY_STRATEGIES), strategy
+            )
+        ) from None
+
+
+async def _stream(
+    results: AsyncIterable, timeout: Optional[float] = None
+) -> AsyncIterator:
+    """Iterate over results produced by a streaming callback.
+
+    Args:
+        results: The results returned by the callback.
+        timeout: The most seconds producing each result can take, if
+            any.
+
+    Yields:
+        The results.
+
+    Raises:
+        _CallbackError: If producing a result raises an exception or
+            takes too long.
+    """
+    iterator = results.__aiter__()
+    try:
+        while True:
+            try:
+                result = await _wait_for(
+                    iterator.__anext__(), "callback", timeout, None
+                )
+            except StopAsyncIteration:
+                return
+            except Exception as e:
+                raise _CallbackError(e) from e
+
+            yield result
+    finally:
+        # Stop the callback if the results weren't all postprocessed.
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+def _stop_processors(queue: Queue) -> None:
+    """Signal to processors waiting on the queue that they should stop.
+
+    If the queue is full, there's no need to signal anything. Every
+    processor will find the queue empty once it has been drained.
+
+    Args:
+        queue: The queue shared by the consumer and the processors.
+    """
+    with suppress(QueueFull):
+        queue.put_nowait(_STOP)
+
+
+async def _wait_for(
+    aw: Awaitable, stage: str, timeout: Optional[float], deadline: Optional[float]
+) -> Any:
+    """Wait for a stage of processing a message to finish.
+
+    Args:
+        aw: The awaitable that runs the stage.
+        stage: The name of the stage.
+        timeout: The most seconds the stage can take, if any.
+        deadline: The time, according to :func:`time.perf_counter`, by
+            which the whole message must be processed, if any.
+
+    Returns:
+        The result of the stage.
+
+    Raises:
+        ProcessingTimeout: If the stage or the message takes too long.
+    """
+    if deadline is not None:
+        remaining = deadline - perf_counter()
+        if timeout is None or remaining < timeout:
+            stage, timeout = "message", remaining
+
+    if timeout is None:
+        return await aw
+
+    # Run the stage in the worker's task rather than a new one (as
+    # asyncio.wait_for would) so that context variables set by one stage
+    # are seen by the others and by the callbacks that finish the
+    # message.
+    task = asyncio.current_task()
+    expired = False
+
+    def expire() -> None:
+        nonlocal expired
+        expired = True
+        task.cancel()
+
+    handle = asyncio.get_running_loop().call_later(max(timeout, 0), expire)
+    try:
+        return await aw
+    except asyncio.CancelledError:
+        # Only the cancellation requested above is a timeout. The worker
+        # itself may have been cancelled too.
+        uncancel = getattr(task, "uncancel", None)
+        if not expired or (uncancel is not None and uncancel()):
+            raise
+        raise ProcessingTimeout(stage) from None
+    finally:
+        handle.cancel()
+
+
+def _add_signal_handlers(
+    loop: AbstractEventLoop, callback: Callable[[int], None]
+) -> Dict[int, Any]:
+    """Call a function when the application is told to stop.
+
+    Handlers are added for SIGINT and SIGTERM unless the signal is being
+    ignored (e.g., by the CLI's supervisor) or signals can't be handled
+    by the loop (e.g., outside of the main thread).
+
+    Args:
+        loop: The event loop used by the application.
+        callback: A callable object that takes the signal number.
+
+    Returns:
+        The previous handlers of the signals that are now handled.
+    """
+    handlers = {}
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        handler = signal.getsignal(signum)
+        if handler is signal.SIG_IGN:
+            continue
+
+        try:
+            loop.add_signal_handler(signum, callback, signum)
+        except RuntimeError:
+            # This includes NotImplementedError, which is raised by
+            # loops that don't support signal handlers.
+            continue
+        handlers[signum] = handler
+    return handlers
+
+
+def _pending(queue: Queue) -> int:
+    """Return the number of messages waiting in the queue.
+
+    Args:
+        queue: The queue shared by the consumer and the processors.
+
+    Returns:
+        The number of messages, not counting the sentinel used to stop
+        the processors.
+    """
+    count = queue.qsize()
+    if _STOP in getattr(queue, "_queue", ()):
+        count -= 1
+    return count
+
+
+def _remove_signal_handlers(loop: AbstractEventLoop, handlers: Dict[int, Any]) -> None:
+    """Restore the signal handlers replaced by the application.
+
+    Args:
+        loop: The event loop used by the application.
+        handlers: The previous handlers.
+    """
+    for signum, handler in handlers.items():
+        loop.remove_signal_handler(signum)
+        signal.signal(signum, handler)
+
+
+def _wake_next(waiters: Deque[Future]) -> None:
+    """Wake up the first task that's still waiting.
+
+    Args:
+        waiters: The futures the tasks are waiting on.
+    """
+    while waiters:
+        waiter = waiters.popleft()
+        if not waiter.done():
+            waiter.set_result(None)
+            return
+
+
+def _is_callback(callback: Any) -> bool:
+    """Return True if the callback can be used as the main callback.
+
+    Args:
+        callback: The callback to check.
+
+    Returns:
+        True if the callback is a coroutine or an asynchronous
+            generator.
+    """
+    if asyncio.iscoroutinefunction(callback):
+        return True
+    return inspect.isasyncgenfunction(callback)
+
+
+def _desired_workers(
+    current: int,
+    minimum: int,
+    maximum: int,
+    *,
+    load: float,
+    backlog: float,
+    utilization: float,
+) -> int:
+    """Return the number of workers needed to keep up with the messages.
+
+    Enough workers are needed to handle the current load and clear the
+    backlog while each one stays busy for the target fraction of the
+    time. When there are more workers than that, only one is removed at
+    a time.
+
+    Args:
+        current: The number of workers.
+        minimum: The fewest workers to use.
+        maximum: The most workers to use.
+        load: The average number of busy workers.
+        backlog: The number of workers needed to process the messages
+            waiting in the queue before the next check.
+        utilization: The fraction of the time each worker should be
+            busy.
+
+    Returns:
+        The number of workers.
+    """
+    needed = math.ceil((load + backlog) / utilization)
+    if needed < current:
+        needed = current - 1
+    return max(minimum, min(maximum, needed))
+
 
 def _new_event_loop() -> AbstractEventLoop:
     """Return a new event loop.
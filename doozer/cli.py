@@ -10,9 +10,13 @@ from functools import wraps
 from importlib import find_loader, import_module
 import inspect
 import logging
+import multiprocessing
+from multiprocessing.connection import wait
 import os
+import signal
 import sys
 from threading import Thread
+import time
 from typing import Any, Callable, Dict, Sequence, Tuple, no_type_check
 
 from argh import ArghParser, CommandError
@@ -25,6 +29,11 @@ from .base import Application, _new_event_loop
 
 __all__ = ("register_commands",)
 
+# The minimum number of seconds between restarts of a worker process.
+# This keeps a process that crashes on startup from being restarted in a
+# tight loop.
+RESTART_DELAY = 1
+
 
 def register_commands(
     namespace: str,
@@ -184,10 +193,19 @@ def run(
     application_path: "the path to the application to run",
     reloader: "reload the application on changes" = False,
     workers: "the number of asynchronous tasks to run" = 1,
+    processes: "the number of worker processes to run" = 1,
     debug: "enable debug mode" = False,
     **kwargs,
 ):
     """Import and run an application."""
+    if processes < 1:
+        raise CommandError("The number of processes must be at least 1.")
+
+    if processes > 1 and (reloader or debug):
+        raise CommandError(
+            "The reloader and debug mode can't be used with multiple processes."
+        )
+
     if kwargs["quiet"]:
         # If quiet mode has been enabled, set the number of verbose
         # flags to -1 so that the level above warning will be used.
@@ -244,6 +262,12 @@ def run(
         runner.start()
         observer.start()
 
+    elif processes > 1:
+        # Each process imports and runs its own copy of the application.
+        # This process only supervises them.
+        app.logger.info("Running {!r} in {} processes...".format(app, processes))
+        _supervise(app, application_path, processes, workers, log_level)
+
     else:
         # If the reloader is not needed, avoid the overhead
         app.logger.info("Running {!r} forever...".format(app))
@@ -347,6 +371,127 @@ def _import_application(application_path: str) -> Tuple[str, Application]:
     return import_path, app
 
 
+def _run_process(application_path: str, num_workers: int, log_level: int) -> None:
+    """Import and run an application inside a worker process.
+
+    Args:
+        application_path: The path to use to import the application.
+        num_workers: The number of asynchronous tasks to run.
+        log_level: The level to use for logging.
+    """
+    # SIGINT sent from a terminal reaches every process in the group.
+    # Leave it to the supervisor, which will send SIGTERM instead.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # Treat SIGTERM like a keyboard interrupt so that the application
+    # stops consuming and finishes the messages it already has.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    logging.basicConfig(level=log_level)
+
+    _, app = _import_application(application_path)
+    app.logger.setLevel(log_level)
+    app.run_forever(num_workers=num_workers)
+
+
+def _supervise(
+    app: Application,
+    application_path: str,
+    processes: int,
+    num_workers: int,
+    log_level: int,
+) -> None:
+    """Run and supervise worker processes.
+
+    Worker processes that exit unexpectedly will be restarted. SIGINT
+    and SIGTERM will be forwarded to the worker processes as SIGTERM so
+    that they can shut down gracefully. If either signal is received a
+    second time, the worker processes will be killed.
+
+    Args:
+        app: The application, used for logging.
+        application_path: The path to use to import the application.
+        processes: The number of worker processes to run.
+        num_workers: The number of asynchronous tasks to run in each
+            process.
+        log_level: The level to use for logging.
+    """
+    # Spawn each process so that it imports the application itself
+    # rather than inheriting the state of this one.
+    context = multiprocessing.get_context("spawn")
+
+    children = {}
+    started = {}
+    stopping = False
+
+    def start(index):
+        """Start the worker process in the given slot."""
+        # Don't restart a slot faster than RESTART_DELAY allows.
+        remaining = started.get(index, 0) + RESTART_DELAY - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+
+        if stopping:
+            return
+
+        process = context.Process(
+            target=_run_process,
+            args=(application_path, num_workers, log_level),
+            name="{}-{}".format(app, index),
+        )
+        process.start()
+        children[index] = process
+        started[index] = time.monotonic()
+        app.logger.debug("process.started", extra={"pid": process.pid})
+
+    def stop(signum, frame):
+        """Forward the signal to the worker processes."""
+        nonlocal stopping
+        forward = signal.SIGKILL if stopping else signal.SIGTERM
+        stopping = True
+        app.logger.info("Stopping {} processes...".format(len(children)))
+        for process in children.values():
+            if process.is_alive():
+                os.kill(process.pid, forward)
+
+    handlers = {
+        signum: signal.signal(signum, stop)
+        for signum in (signal.SIGINT, signal.SIGTERM)
+    }
+
+    try:
+        for index in range(processes):
+            start(index)
+
+        while children:
+            wait([process.sentinel for process in children.values()])
+
+            for index, process in list(children.items()):
+                if process.is_alive():
+                    continue
+
+                process.join()
+                del children[index]
+
+                app.logger.debug(
+                    "process.stopped",
+                    extra={"pid": process.pid, "exitcode": process.exitcode},
+                )
+
+                # Processes that exit cleanly (e.g., because their
+                # consumer aborted) are done.
+                if not stopping and process.exitcode != 0:
+                    app.logger.warning(
+                        "Process {} exited with {}. Restarting...".format(
+                            process.pid, process.exitcode
+                        )
+                    )
+                    start(index)
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+
+
 def _with_namespace(f, include_app):
     """Call the function with the parsed arguments."""
 
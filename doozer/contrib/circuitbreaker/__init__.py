@@ -0,0 +1,282 @@
+"""Circuit breaker plugin for Doozer.
+
+CircuitBreaker is a plugin to stop Doozer applications from processing
+messages while a service they depend on is failing.
+"""
+from __future__ import annotations
+
+import asyncio
+from asyncio import Future, TimerHandle
+from collections import Counter, deque
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Optional, Type
+
+from doozer.base import Application
+from doozer.extensions import Extension
+
+__all__ = ("CircuitBreaker", "CircuitOpenError")
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+
+# The values used to report each state as a gauge.
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+_MODES = ("fail_fast", "pause")
+
+
+class _Call:
+    """The outcome of processing a message.
+
+    Args:
+        generation: If the message is a probe, the half-open period
+            during which it was let through.
+    """
+
+    __slots__ = ("failure", "generation")
+
+    def __init__(self, generation: Optional[int] = None) -> None:
+        """Initialize the instance."""
+        self.failure: Optional[Type[BaseException]] = None
+        self.generation = generation
+
+
+# Each worker processes one message at a time in its own task, so a
+# context variable can carry a message's outcome from the error
+# callback to the acknowledgement callback.
+_current_call: ContextVar[Optional[_Call]] = ContextVar(
+    "circuit_breaker_call", default=None
+)
+
+
+class CircuitOpenError(Exception):
+    """Exception raised when a message is rejected by an open circuit."""
+
+
+class CircuitBreaker(Extension):
+    """A class that stops processing messages while failures are high.
+
+    Attributes:
+        state (str): One of ``"closed"``, ``"open"``, or
+            ``"half_open"``.
+    """
+
+    DEFAULT_SETTINGS = {
+        "CIRCUIT_BREAKER_EXCEPTIONS": {Exception: 0.5},
+        "CIRCUIT_BREAKER_MIN_CALLS": 10,
+        "CIRCUIT_BREAKER_MODE": "fail_fast",
+        "CIRCUIT_BREAKER_PROBES": 3,
+        "CIRCUIT_BREAKER_RESET_TIMEOUT": 30,
+        "CIRCUIT_BREAKER_WINDOW": 100,
+    }
+
+    def init_app(self, app: Application) -> None:
+        """Initialize an ``Application`` instance.
+
+        Args:
+            app: Application instance to be initialized.
+
+        Raises:
+            ValueError: If the mode isn't valid, a failure rate isn't
+                between 0 and 1, or the window, minimum number of calls,
+                or number of probes isn't positive.
+        """
+        super().init_app(app)
+
+        if app.settings["CIRCUIT_BREAKER_MODE"] not in _MODES:
+            raise ValueError(
+                "CIRCUIT_BREAKER_MODE must be one of {}.".format(
+                    ", ".join(repr(mode) for mode in _MODES)
+                )
+            )
+
+        for rate in app.settings["CIRCUIT_BREAKER_EXCEPTIONS"].values():
+            if not 0 < rate <= 1:
+                raise ValueError("Failure rates must be between 0 and 1.")
+
+        for key in (
+            "CIRCUIT_BREAKER_MIN_CALLS",
+            "CIRCUIT_BREAKER_PROBES",
+            "CIRCUIT_BREAKER_WINDOW",
+        ):
+            if app.settings[key] < 1:
+                raise ValueError("{} must be positive.".format(key))
+
+        self.state = CLOSED
+
+        self._window: Deque[Optional[Type[BaseException]]] = deque()
+        self._failures: Dict[Type[BaseException], int] = Counter()
+        self._generation = 0
+        self._probes = 0
+        self._successes = 0
+        self._timer: Optional[TimerHandle] = None
+        self._waiters: Deque[Future] = deque()
+
+        app.metrics.gauge("circuit_breaker.state", lambda: _STATE_VALUES[self.state])
+        self._rejected = app.metrics.counter("circuit_breaker.rejected")
+
+        # The breaker should be checked before any other work is done
+        # and should see failures before any error callback can stop
+        # the others from running.
+        app._callbacks["message_preprocessor"].insert(0, self._before)
+        app._callbacks["error"].insert(0, self._record_failure)
+        app.message_acknowledgement(self._after)
+
+    async def _before(self, app: Application, message: Any) -> Any:
+        """Let the message through if the circuit allows it.
+
+        Raises:
+            CircuitOpenError: If the circuit is open and the mode is
+                ``"fail_fast"``.
+        """
+        _current_call.set(None)
+
+        while True:
+            if self.state == CLOSED:
+                call = _Call()
+                break
+
+            probes = app.settings["CIRCUIT_BREAKER_PROBES"]
+            if self.state == HALF_OPEN and self._probes < probes:
+                # Let a limited number of messages through to check
+                # whether the failures have stopped.
+                self._probes += 1
+                call = _Call(self._generation)
+                break
+
+            if app.settings["CIRCUIT_BREAKER_MODE"] == "fail_fast":
+                self._rejected.inc()
+                raise CircuitOpenError(message)
+
+            await self._wait()
+
+        _current_call.set(call)
+        return message
+
+    async def _record_failure(
+        self, app: Application, message: Any, exc: Exception
+    ) -> None:
+        """Record the exception that caused the message to fail."""
+        call = _current_call.get()
+        if call is None:
+            return
+
+        for exception in app.settings["CIRCUIT_BREAKER_EXCEPTIONS"]:
+            if isinstance(exc, exception):
+                call.failure = exception
+                break
+
+    async def _after(self, app: Application, message: Any) -> None:
+        """Record the outcome of processing the message."""
+        call = _current_call.get()
+        if call is None:
+            # The message was rejected.
+            return
+        _current_call.set(None)
+
+        if call.generation is not None:
+            self._record_probe(call)
+            return
+
+        if self.state != CLOSED:
+            # The message was let through before the circuit opened.
+            return
+
+        window = self._window
+        if len(window) == app.settings["CIRCUIT_BREAKER_WINDOW"]:
+            oldest = window.popleft()
+            if oldest is not None:
+                self._failures[oldest] -= 1
+        window.append(call.failure)
+
+        if call.failure is None:
+            return
+
+        self._failures[call.failure] += 1
+
+        if len(window) < app.settings["CIRCUIT_BREAKER_MIN_CALLS"]:
+            return
+
+        rate = self._failures[call.failure] / len(window)
+        if rate >= app.settings["CIRCUIT_BREAKER_EXCEPTIONS"][call.failure]:
+            self._open(call.failure, rate)
+
+    def _record_probe(self, call: _Call) -> None:
+        """Record the outcome of a probe message."""
+        if call.generation != self._generation or self.state != HALF_OPEN:
+            # The probe was let through during an earlier half-open
+            # period.
+            return
+
+        self._probes -= 1
+
+        if call.failure is not None:
+            self._open(call.failure, None)
+            return
+
+        self._successes += 1
+        if self._successes >= self.app.settings["CIRCUIT_BREAKER_PROBES"]:
+            self._close()
+
+    def _close(self) -> None:
+        """Close the circuit."""
+        self.state = CLOSED
+        self._window.clear()
+        self._failures.clear()
+        self.app.logger.info("circuit_breaker.closed")
+        self._wake()
+
+    def _half_open(self) -> None:
+        """Let probe messages through."""
+        self.state = HALF_OPEN
+        self._generation += 1
+        self._probes = 0
+        self._successes = 0
+        self._timer = None
+        self.app.logger.info("circuit_breaker.half_opened")
+        self._wake()
+
+    def _open(self, exception: Type[BaseException], rate: Optional[float]) -> None:
+        """Open the circuit.
+
+        Args:
+            exception: The exception class that opened the circuit.
+            rate: The failure rate for the exception, if the circuit
+                was closed.
+        """
+        self.state = OPEN
+
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = asyncio.get_event_loop().call_later(
+            self.app.settings["CIRCUIT_BREAKER_RESET_TIMEOUT"], self._half_open
+        )
+
+        self.app.logger.warning(
+            "circuit_breaker.opened",
+            extra={"exception": exception.__name__, "failure_rate": rate},
+        )
+
+        if self.app.settings["CIRCUIT_BREAKER_MODE"] == "pause":
+            # Stop reading new messages until the circuit is half-open.
+            self.app.pause_consumption("circuit_breaker")
+
+    async def _wait(self) -> None:
+        """Wait for the state of the circuit to change."""
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def _wake(self) -> None:
+        """Wake up everything waiting for the state to change."""
+        self.app.resume_consumption("circuit_breaker")
+
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
@@ -0,0 +1,1085 @@
+"""Consumers for Doozer.
+
+The consumers in this package read messages from asyncio queues, files,
+memory-mapped files, sockets, and subprocesses. Each of them provides
+``read_many`` so that messages can be read in batches.
+
+Consumers that read from a stream of bytes split it into records with a
+framer. Records are :class:`memoryview` slices of the chunks read from
+the stream, so they aren't copied unless a record spans two chunks.
+"""
+from __future__ import annotations
+
+import asyncio
+from asyncio import Lock, Queue, StreamReader, StreamWriter, Task
+from asyncio.subprocess import PIPE, Process
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import json
+import mmap
+import os
+import struct
+from typing import Any, Deque, Dict, List, Optional, Sequence, Set, Tuple
+
+from doozer.exceptions import Abort
+
+__all__ = (
+    "FileConsumer",
+    "LengthPrefixFramer",
+    "LineFramer",
+    "MmapConsumer",
+    "QueueConsumer",
+    "SocketConsumer",
+    "SubprocessConsumer",
+)
+
+# A sentinel added to a queue once its consumer has been closed. Each
+# reader that receives it puts it back so that it reaches every reader.
+_CLOSED = object()
+
+# The struct formats used to read length prefixes of each size.
+_PREFIX_FORMATS = {1: "B", 2: "H", 4: "I", 8: "Q"}
+
+
+class LineFramer:
+    """Split bytes into records that end with a delimiter.
+
+    The delimiter isn't included in the records.
+
+    Args:
+        delimiter: The bytes that end each record.
+
+    Raises:
+        ValueError: If the delimiter is empty.
+    """
+
+    def __init__(self, delimiter: bytes = b"\n") -> None:
+        """Initialize the instance."""
+        if not delimiter:
+            raise ValueError("The delimiter cannot be empty.")
+
+        self.delimiter = delimiter
+
+    def final(self, buffer: Any, start: int, end: int) -> List[memoryview]:
+        """Return the record left once the stream has ended.
+
+        The last record doesn't need to end with the delimiter.
+
+        Args:
+            buffer: An object supporting the buffer protocol and
+                ``find``, such as :class:`bytes` or :class:`mmap.mmap`.
+            start: The offset of the first byte not yet framed.
+            end: The offset of the end of the stream.
+
+        Returns:
+            The record, if there is one.
+        """
+        if start >= end:
+            return []
+        return [memoryview(buffer)[start:end]]
+
+    def frame(self, buffer: Any, start: int, end: int) -> Tuple[List[memoryview], int]:
+        """Return the complete records in a buffer.
+
+        Args:
+            buffer: An object supporting the buffer protocol and
+                ``find``, such as :class:`bytes` or :class:`mmap.mmap`.
+            start: The offset at which to start.
+            end: The offset at which to stop.
+
+        Returns:
+            The records and the offset of the first byte after the last
+            one.
+        """
+        delimiter = self.delimiter
+        find = buffer.find
+        size = len(delimiter)
+        view = memoryview(buffer)
+        records = []
+
+        while True:
+            index = find(delimiter, start, end)
+            if index < 0:
+                return records, start
+            records.append(view[start:index])
+            start = index + size
+
+    def resume(self, pending: Sequence[Any], size: int, buffer: Any, end: int) -> int:
+        """Return where a record started in earlier buffers ends.
+
+        Only the new buffer and the end of the earlier ones, in case the
+        delimiter is split between them, are searched.
+
+        Args:
+            pending: The bytes of the record read so far.
+            size: The number of bytes in ``pending``.
+            buffer: The next buffer.
+            end: The offset of the end of the buffer.
+
+        Returns:
+            The offset in the buffer of the first byte after the record,
+            or -1 if it doesn't end in the buffer.
+        """
+        delimiter = self.delimiter
+        overlap = len(delimiter) - 1
+        if overlap:
+            tail = _tail(pending, overlap)
+            index = (tail + bytes(buffer[: min(overlap, end)])).find(delimiter)
+            if index >= 0:
+                return index + len(delimiter) - len(tail)
+
+        index = buffer.find(delimiter, 0, end)
+        if index < 0:
+            return -1
+        return index + len(delimiter)
+
+
+class LengthPrefixFramer:
+    """Split bytes into records that start with their lengths.
+
+    Each record is preceded by its length in bytes as an unsigned
+    integer. The prefix isn't included in the records.
+
+    Args:
+        size: The number of bytes in each prefix. One of 1, 2, 4, or 8.
+        byteorder: Either ``"big"`` or ``"little"``.
+
+    Raises:
+        ValueError: If the size or byte order isn't valid.
+    """
+
+    def __init__(self, size: int = 4, byteorder: str = "big") -> None:
+        """Initialize the instance."""
+        if size not in _PREFIX_FORMATS:
+            raise ValueError("The size must be one of 1, 2, 4, or 8.")
+        if byteorder not in ("big", "little"):
+            raise ValueError('The byte order must be "big" or "little".')
+
+        self.size = size
+        self.byteorder = byteorder
+        self._prefix = struct.Struct(
+            "{}{}".format(">" if byteorder == "big" else "<", _PREFIX_FORMATS[size])
+        )
+
+    def final(self, buffer: Any, start: int, end: int) -> List[memoryview]:
+        """Return the record left once the stream has ended.
+
+        Args:
+            buffer: An object supporting the buffer protocol.
+            start: The offset of the first byte not yet framed.
+            end: The offset of the end of the stream.
+
+        Returns:
+            An empty list. Every record is complete.
+
+        Raises:
+            ValueError: If the stream ended partway through a record.
+        """
+        if start < end:
+            raise ValueError("The stream ended partway through a record.")
+        return []
+
+    def frame(self, buffer: Any, start: int, end: int) -> Tuple[List[memoryview], int]:
+        """Return the complete records in a buffer.
+
+        Args:
+            buffer: An object supporting the buffer protocol, such as
+                :class:`bytes` or :class:`mmap.mmap`.
+            start: The offset at which to start.
+            end: The offset at which to stop.
+
+        Returns:
+            The records and the offset of the first byte after the last
+            one.
+        """
+        unpack_from = self._prefix.unpack_from
+        size = self.size
+        view = memoryview(buffer)
+        records = []
+
+        while end - start >= size:
+            (length,) = unpack_from(buffer, start)
+            if end - start - size < length:
+                break
+            start += size
+            records.append(view[start : start + length])
+            start += length
+
+        return records, start
+
+    def resume(self, pending: Sequence[Any], size: int, buffer: Any, end: int) -> int:
+        """Return where a record started in earlier buffers ends.
+
+        Only the prefix is read. The rest of the record isn't searched.
+
+        Args:
+            pending: The bytes of the record read so far.
+            size: The number of bytes in ``pending``.
+            buffer: The next buffer.
+            end: The offset of the end of the buffer.
+
+        Returns:
+            The offset in the buffer of the first byte after the record,
+            or -1 if it doesn't end in the buffer.
+        """
+        if size + end < self.size:
+            return -1
+
+        prefix = _head(pending, self.size)
+        prefix += bytes(buffer[: self.size - len(prefix)])
+        (length,) = self._prefix.unpack(prefix)
+
+        stop = self.size + length - size
+        if stop > end:
+            return -1
+        return stop
+
+
+class _Reassembler:
+    """Frame a stream of bytes that arrives in chunks.
+
+    Only the bytes of a record that spans two chunks are copied. The
+    rest of the records are slices of the chunks. The chunks a record
+    spans are kept until it ends and are then joined once.
+
+    Args:
+        framer: The framer used to split the stream into records.
+    """
+
+    def __init__(self, framer: Any) -> None:
+        """Initialize the instance."""
+        self.framer = framer
+        self._pending: List[bytes] = []
+        self._size = 0
+
+    def end(self) -> List[memoryview]:
+        """Return the record left once the stream has ended."""
+        remainder = b"".join(self._pending)
+        self._pending, self._size = [], 0
+        return self.framer.final(remainder, 0, len(remainder))
+
+    def feed(self, chunk: bytes) -> List[memoryview]:
+        """Return the records completed by a chunk."""
+        start = 0
+        records = []
+
+        if self._pending:
+            start = self.framer.resume(self._pending, self._size, chunk, len(chunk))
+            if start < 0:
+                self._pending.append(chunk)
+                self._size += len(chunk)
+                return []
+
+            self._pending.append(memoryview(chunk)[:start])
+            buffer = b"".join(self._pending)
+            self._pending, self._size = [], 0
+            records, _ = self.framer.frame(buffer, 0, len(buffer))
+
+        more, end = self.framer.frame(chunk, start, len(chunk))
+        records += more
+        if end < len(chunk):
+            self._pending.append(chunk[end:])
+            self._size = len(chunk) - end
+        return records
+
+
+class _Batch:
+    """Records found by one scan of a memory-mapped file.
+
+    Args:
+        end: The offset of the first byte after the last record.
+        remaining: The number of records not yet processed.
+    """
+
+    __slots__ = ("end", "remaining")
+
+    def __init__(self, end: int, remaining: int) -> None:
+        """Initialize the instance."""
+        self.end = end
+        self.remaining = remaining
+
+
+class MmapConsumer:
+    """A consumer that reads records from a memory-mapped file.
+
+    Records are :class:`memoryview` slices of the mapped file, so they
+    are never copied. The file is scanned for records ``window`` bytes
+    at a time on a thread of its own so that page faults don't block the
+    event loop, and the operating system is asked to read the next
+    window ahead of time where it supports it.
+
+    When ``checkpoint`` is provided, the offset up to which every record
+    has been processed is saved to it every ``checkpoint_interval``
+    seconds and when the consumer is closed. The next consumer created
+    with the same checkpoint resumes from that offset, unless the file
+    has been replaced or truncated since. Offsets are tracked for each
+    scan, so a few records before the offset may be read again.
+
+    A record is considered processed once it has been read unless
+    ``require_acknowledgement`` is True, in which case it isn't until it
+    has been passed to :meth:`acknowledge`. Records that were being
+    processed when the application stopped are then read again after it
+    restarts.
+
+    Args:
+        path: The path to the file.
+        framer: The framer used to split the file into records.
+            Defaults to a :class:`LineFramer`.
+        checkpoint: The path of the file in which to save the offset.
+            If None, the file is read from the start every time.
+        checkpoint_interval: The number of seconds between checkpoints.
+        require_acknowledgement: Whether records must be acknowledged
+            before they're considered processed.
+        window: The number of bytes to scan for records at once.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        framer: Any = None,
+        checkpoint: Optional[str] = None,
+        checkpoint_interval: float = 1,
+        require_acknowledgement: bool = False,
+        window: int = 64 * 1024,
+    ) -> None:
+        """Initialize the instance."""
+        self.path = path
+        self.framer = framer or LineFramer()
+        self.checkpoint = checkpoint
+        self.checkpoint_interval = checkpoint_interval
+        self.require_acknowledgement = require_acknowledgement
+        self.window = window
+
+        self._batches: Deque[_Batch] = deque()
+        self._checkpointed: Optional[int] = None
+        self._ended = False
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._file: Any = None
+        self._inode: Optional[int] = None
+        self._last_checkpoint = 0.0
+        self._lock: Optional[Lock] = None
+        self._mmap: Optional[mmap.mmap] = None
+        self._offset = 0
+        self._opened = False
+        self._outstanding: Dict[int, Tuple[memoryview, _Batch]] = {}
+        self._processed = 0
+        self._records: Deque[Tuple[memoryview, _Batch]] = deque()
+        self._size = 0
+
+    @property
+    def offset(self) -> int:
+        """The offset up to which every record has been processed."""
+        return self._advance()
+
+    async def acknowledge(self, app: Any, message: Any) -> None:
+        """Mark records as processed.
+
+        This can be registered as a ``message_acknowledgement``
+        callback. ``MESSAGE_COPY`` must be set to ``"none"`` so that the
+        records it receives are the ones that were read.
+
+        Args:
+            app: The application. It isn't used.
+            message: A record or a list of records.
+        """
+        records = message if isinstance(message, list) else [message]
+        for record in records:
+            entry = self._outstanding.pop(id(record), None)
+            if entry is not None:
+                entry[1].remaining -= 1
+
+        await self._checkpoint_periodically()
+
+    async def close(self) -> None:
+        """Save a checkpoint and unmap the file."""
+        await self._checkpoint()
+
+        if self._executor is None:
+            return
+
+        self._records.clear()
+        self._outstanding.clear()
+        await self._call(self._close)
+        self._executor.shutdown()
+        self._executor = None
+
+    async def read(self) -> memoryview:
+        """Return the next record.
+
+        Raises:
+            Abort: If every record has been read.
+        """
+        await self._fill()
+        return self._take()
+
+    async def read_many(self, max_count: int, max_wait: float) -> List[memoryview]:
+        """Return up to ``max_count`` records.
+
+        Args:
+            max_count: The most records to return.
+            max_wait: Unused.
+
+        Raises:
+            Abort: If every record has been read.
+        """
+        await self._fill()
+        return [self._take() for _ in range(min(max_count, len(self._records)))]
+
+    def _advance(self) -> int:
+        """Forget the scans whose records have all been processed.
+
+        Returns:
+            The offset up to which every record has been processed.
+        """
+        batches = self._batches
+        while batches and not batches[0].remaining:
+            self._processed = batches.popleft().end
+        return self._processed
+
+    async def _call(self, function: Any, *args: Any) -> Any:
+        """Call a function on the consumer's thread."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="doozer-mmap"
+            )
+
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, function, *args)
+
+    async def _checkpoint(self) -> None:
+        """Save the offset if it has changed."""
+        if self.checkpoint is None or not self._opened:
+            return
+
+        self._last_checkpoint = asyncio.get_event_loop().time()
+
+        offset = self.offset
+        if offset != self._checkpointed:
+            await self._call(self._save, offset)
+            self._checkpointed = offset
+
+    async def _checkpoint_periodically(self) -> None:
+        """Save the offset if enough time has passed since the last time."""
+        if self.checkpoint is None:
+            return
+
+        now = asyncio.get_event_loop().time()
+        if now - self._last_checkpoint >= self.checkpoint_interval:
+            await self._checkpoint()
+
+    def _close(self) -> None:
+        """Unmap and close the file on the consumer's thread."""
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Records are still in use. The file will be unmapped
+                # once they've been released.
+                pass
+            self._mmap = None
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    async def _fill(self) -> None:
+        """Wait until there's a record to read.
+
+        Raises:
+            Abort: If every record has been read.
+        """
+        await self._checkpoint_periodically()
+
+        if self._records:
+            return
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        # Only one reader should scan at a time so that the records
+        # stay in order.
+        async with self._lock:
+            if not self._opened:
+                await self._call(self._open)
+                self._opened = True
+
+            self._advance()
+
+            while not self._records:
+                if self._ended:
+                    await self._checkpoint()
+                    raise Abort("file.ended", None)
+
+                if self._offset >= self._size:
+                    records: List[memoryview] = []
+                    end = self._size
+                else:
+                    records, end = await self._call(self._scan)
+
+                if not records:
+                    # The rest of the file has been scanned. Whatever is
+                    # left doesn't need to end the way the other records
+                    # do.
+                    self._ended = True
+                    if self._mmap is not None:
+                        records = self.framer.final(self._mmap, end, self._size)
+                    end = self._size
+
+                batch = _Batch(end, len(records))
+                self._batches.append(batch)
+                self._records.extend((record, batch) for record in records)
+                self._offset = end
+
+    def _load(self) -> int:
+        """Return the offset saved by the last checkpoint."""
+        if self.checkpoint is None:
+            return 0
+
+        try:
+            with open(self.checkpoint) as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return 0
+
+        if saved["inode"] != self._inode or saved["offset"] > self._size:
+            # The file was replaced or truncated. Start over.
+            return 0
+        return saved["offset"]
+
+    def _open(self) -> None:
+        """Map the file on the consumer's thread."""
+        self._file = open(self.path, "rb")
+        stat = os.fstat(self._file.fileno())
+        self._inode = stat.st_ino
+        self._size = stat.st_size
+
+        self._offset = self._processed = self._load()
+
+        if not self._size:
+            # Empty files can't be mapped.
+            return
+
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(self._mmap, "madvise"):
+            self._mmap.madvise(mmap.MADV_SEQUENTIAL)
+
+    def _save(self, offset: int) -> None:
+        """Save a checkpoint on the consumer's thread.
+
+        The checkpoint is written to a temporary file that then replaces
+        the old one so that it's never left half written.
+        """
+        temporary = "{}.tmp".format(self.checkpoint)
+        with open(temporary, "w") as f:
+            json.dump({"inode": self._inode, "offset": offset}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.checkpoint)
+
+    def _scan(self) -> Tuple[List[memoryview], int]:
+        """Find the next records on the consumer's thread.
+
+        Returns:
+            The records and the offset of the first byte after them. No
+            records are returned only once the end of the file has been
+            reached.
+        """
+        start = self._offset
+        window = self.window
+
+        while True:
+            end = min(start + window, self._size)
+            records, stop = self.framer.frame(self._mmap, start, end)
+            if records or end == self._size:
+                break
+            # A record is longer than the window.
+            window *= 2
+
+        if end < self._size and hasattr(self._mmap, "madvise"):
+            # Ask for the next window to be read ahead of time.
+            page = end - end % mmap.PAGESIZE
+            self._mmap.madvise(
+                mmap.MADV_WILLNEED, page, min(self.window, self._size - page)
+            )
+
+        return records, stop
+
+    def _take(self) -> memoryview:
+        """Return the next record and start tracking it."""
+        record, batch = self._records.popleft()
+        if self.require_acknowledgement:
+            self._outstanding[id(record)] = (record, batch)
+        else:
+            batch.remaining -= 1
+        return record
+
+
+class QueueConsumer:
+    """A consumer that reads messages from an asyncio queue.
+
+    This is useful for testing applications and for running them as
+    part of a larger program. Once :meth:`close` has been called, the
+    messages already in the queue are read and then the consumer stops
+    the application.
+
+    Args:
+        queue: The queue. If not provided, one is created.
+        maxsize: The most messages the created queue can hold. If 0,
+            there is no limit.
+    """
+
+    def __init__(self, queue: Optional[Queue] = None, maxsize: int = 0) -> None:
+        """Initialize the instance."""
+        self.maxsize = maxsize
+        self._queue = queue
+
+    @property
+    def queue(self) -> Queue:
+        """The queue from which messages are read."""
+        # Queues created before the event loop has started can be bound
+        # to the wrong loop, so the queue is created when it's needed.
+        if self._queue is None:
+            self._queue = asyncio.Queue(self.maxsize)
+        return self._queue
+
+    async def close(self) -> None:
+        """Stop the application once the queue is empty."""
+        await self.queue.put(_CLOSED)
+
+    async def put(self, message: Any) -> None:
+        """Add a message to the queue.
+
+        Args:
+            message: The message.
+        """
+        await self.queue.put(message)
+
+    async def read(self) -> Any:
+        """Return the next message.
+
+        Raises:
+            Abort: If the consumer has been closed.
+        """
+        message = await self.queue.get()
+        if message is _CLOSED:
+            self.queue.put_nowait(message)
+            raise Abort("consumer.closed", None)
+        return message
+
+    async def read_many(self, max_count: int, max_wait: float) -> List[Any]:
+        """Return up to ``max_count`` messages.
+
+        If the task is cancelled while waiting for more messages, the
+        messages already removed from the queue are returned rather
+        than lost.
+
+        Args:
+            max_count: The most messages to return.
+            max_wait: The most seconds to wait for more messages after
+                the first one.
+
+        Raises:
+            Abort: If the consumer has been closed.
+        """
+        queue = self.queue
+        messages = [await self.read()]
+
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + max_wait
+        while len(messages) < max_count:
+            try:
+                message = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                except asyncio.CancelledError:
+                    # The application is stopping. It will stop reading
+                    # once it has queued these.
+                    break
+
+            if message is _CLOSED:
+                queue.put_nowait(message)
+                break
+            messages.append(message)
+
+        return messages
+
+
+class SocketConsumer(QueueConsumer):
+    """A consumer that reads records sent to a TCP or Unix socket.
+
+    The consumer listens for connections once it's first read from.
+    Each connection's bytes are split into records by the framer, and
+    records from every connection are read in the order they arrive.
+    Once ``maxsize`` records are waiting to be read, the consumer stops
+    reading from connections until there's room for more.
+
+    Args:
+        host: The host on which to listen for TCP connections.
+        port: The port on which to listen for TCP connections.
+        path: The path of the Unix socket on which to listen instead.
+        framer: The framer used to split the bytes into records.
+            Defaults to a :class:`LineFramer`.
+        chunk_size: The most bytes to read from a connection at once.
+        maxsize: The most records that can wait to be read.
+    """
+
+    def __init__(
+        self,
+        host: Optional[str] = None,
+        port: Optional[int] = None,
+        *,
+        path: Optional[str] = None,
+        framer: Any = None,
+        chunk_size: int = 64 * 1024,
+        maxsize: int = 10000,
+    ) -> None:
+        """Initialize the instance."""
+        super().__init__(maxsize=maxsize)
+        self.host = host
+        self.port = port
+        self.path = path
+        self.framer = framer or LineFramer()
+        self.chunk_size = chunk_size
+
+        self._connections: Set[Task] = set()
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._resumed: Optional[asyncio.Event] = None
+
+    @property
+    def sockets(self) -> List[Any]:
+        """The sockets on which the consumer is listening."""
+        if self._server is None:
+            return []
+        return list(self._server.sockets or [])
+
+    async def close(self) -> None:
+        """Stop listening and stop the application once the queue is empty.
+
+        Open connections are closed without reading anything else from
+        them.
+        """
+        if self._server is not None:
+            self._server.close()
+            for connection in self._connections:
+                connection.cancel()
+            if self._connections:
+                await asyncio.wait(self._connections)
+            await self._server.wait_closed()
+        await super().close()
+
+    def pause(self) -> None:
+        """Stop reading from connections."""
+        self._event().clear()
+
+    async def read(self) -> Any:
+        """Return the next record.
+
+        Raises:
+            Abort: If the consumer has been closed.
+        """
+        await self.start()
+        return await super().read()
+
+    async def read_many(self, max_count: int, max_wait: float) -> List[Any]:
+        """Return up to ``max_count`` records.
+
+        Args:
+            max_count: The most records to return.
+            max_wait: The most seconds to wait for more records after
+                the first one.
+
+        Raises:
+            Abort: If the consumer has been closed.
+        """
+        await self.start()
+        return await super().read_many(max_count, max_wait)
+
+    def resume(self) -> None:
+        """Start reading from connections again."""
+        self._event().set()
+
+    async def start(self) -> None:
+        """Start listening for connections."""
+        if self._server is not None:
+            return
+
+        if self.path is not None:
+            self._server = await asyncio.start_unix_server(self._handle, self.path)
+        else:
+            self._server = await asyncio.start_server(
+                self._handle, self.host, self.port
+            )
+
+    def _event(self) -> asyncio.Event:
+        """Return the event that's set while reading isn't paused."""
+        if self._resumed is None:
+            self._resumed = asyncio.Event()
+            self._resumed.set()
+        return self._resumed
+
+    async def _handle(self, reader: StreamReader, writer: StreamWriter) -> None:
+        """Read records from a connection until it's closed."""
+        reassembler = _Reassembler(self.framer)
+        resumed = self._event()
+        queue = self.queue
+
+        connection = asyncio.current_task()
+        self._connections.add(connection)
+        try:
+            while True:
+                await resumed.wait()
+                chunk = await reader.read(self.chunk_size)
+                if not chunk:
+                    break
+                for record in reassembler.feed(chunk):
+                    await queue.put(record)
+
+            for record in reassembler.end():
+                await queue.put(record)
+        except (ConnectionError, ValueError):
+            # The connection was lost or closed partway through a
+            # record. Whatever was left of the record is dropped.
+            pass
+        finally:
+            self._connections.discard(connection)
+            writer.close()
+
+
+class _StreamConsumer:
+    """A consumer that reads records from a stream of bytes in chunks.
+
+    Subclasses implement ``_read_chunk``, which returns an empty chunk
+    once the stream has ended.
+
+    Args:
+        framer: The framer used to split the bytes into records.
+            Defaults to a :class:`LineFramer`.
+    """
+
+    _reason = "stream.ended"
+
+    def __init__(self, framer: Any = None) -> None:
+        """Initialize the instance."""
+        self.framer = framer or LineFramer()
+
+        self._ended = False
+        self._lock: Optional[Lock] = None
+        self._reassembler = _Reassembler(self.framer)
+        self._records: Deque[memoryview] = deque()
+
+    async def close(self) -> None:
+        """Release anything used to read the stream."""
+
+    async def read(self) -> memoryview:
+        """Return the next record.
+
+        Raises:
+            Abort: If the stream has ended.
+        """
+        await self._fill()
+        return self._records.popleft()
+
+    async def read_many(self, max_count: int, max_wait: float) -> List[memoryview]:
+        """Return up to ``max_count`` records.
+
+        Records are read a chunk at a time, so this doesn't wait for
+        more records once at least one is available.
+
+        Args:
+            max_count: The most records to return.
+            max_wait: Unused.
+
+        Raises:
+            Abort: If the stream has ended.
+        """
+        await self._fill()
+        records = self._records
+        return [records.popleft() for _ in range(min(max_count, len(records)))]
+
+    async def _fill(self) -> None:
+        """Wait until there's a record to read.
+
+        Raises:
+            Abort: If the stream has ended.
+        """
+        if self._records:
+            return
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        # Only one reader should read a chunk at a time so that the
+        # records stay in order.
+        async with self._lock:
+            while not self._records:
+                if self._ended:
+                    raise Abort(self._reason, None)
+
+                chunk = await self._read_chunk()
+                if chunk:
+                    self._records.extend(self._reassembler.feed(chunk))
+                else:
+                    self._ended = True
+                    await self.close()
+                    self._records.extend(self._reassembler.end())
+
+    async def _read_chunk(self) -> bytes:
+        """Return the next chunk of the stream."""
+        raise NotImplementedError
+
+
+class FileConsumer(_StreamConsumer):
+    """A consumer that reads records from a file.
+
+    The file is read in chunks on a thread of its own so that the event
+    loop isn't blocked by the disk.
+
+    Args:
+        path: The path to the file.
+        framer: The framer used to split the file into records.
+            Defaults to a :class:`LineFramer`.
+        chunk_size: The most bytes to read at once.
+        follow: Whether to wait for more records to be appended to the
+            file, like ``tail -f``, rather than stopping at its end. If
+            the file is truncated, it's read again from the start.
+        poll_interval: The number of seconds to wait before checking
+            for more records when following the file.
+    """
+
+    _reason = "file.ended"
+
+    def __init__(
+        self,
+        path: str,
+        framer: Any = None,
+        chunk_size: int = 64 * 1024,
+        follow: bool = False,
+        poll_interval: float = 1,
+    ) -> None:
+        """Initialize the instance."""
+        super().__init__(framer)
+        self.path = path
+        self.chunk_size = chunk_size
+        self.follow = follow
+        self.poll_interval = poll_interval
+
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._file: Any = None
+
+    async def close(self) -> None:
+        """Close the file."""
+        if self._executor is None:
+            return
+
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(self._executor, self._close)
+        self._executor.shutdown()
+        self._executor = None
+
+    def _close(self) -> None:
+        """Close the file on the consumer's thread."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _read(self) -> bytes:
+        """Read a chunk on the consumer's thread."""
+        if self._file is None:
+            self._file = open(self.path, "rb")
+
+        chunk = self._file.read(self.chunk_size)
+        if not chunk and self.follow:
+            if os.fstat(self._file.fileno()).st_size < self._file.tell():
+                # The file was truncated. Start over.
+                self._file.seek(0)
+                chunk = self._file.read(self.chunk_size)
+        return chunk
+
+    async def _read_chunk(self) -> bytes:
+        """Return the next chunk of the file."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="doozer-file"
+            )
+
+        loop = asyncio.get_event_loop()
+        while True:
+            chunk = await loop.run_in_executor(self._executor, self._read)
+            if chunk or not self.follow:
+                return chunk
+            await asyncio.sleep(self.poll_interval)
+
+
+class SubprocessConsumer(_StreamConsumer):
+    """A consumer that reads records written to a subprocess's stdout.
+
+    The subprocess is started once the consumer is first read from.
+    Once it exits, the remaining records are read and then the consumer
+    stops the application.
+
+    Args:
+        args: The program to run and its arguments.
+        framer: The framer used to split the output into records.
+            Defaults to a :class:`LineFramer`.
+        chunk_size: The most bytes to read at once.
+
+    Attributes:
+        returncode (int): The subprocess's exit status, once it has
+            exited.
+    """
+
+    _reason = "subprocess.exited"
+
+    def __init__(
+        self, args: Sequence[str], framer: Any = None, chunk_size: int = 64 * 1024
+    ) -> None:
+        """Initialize the instance."""
+        super().__init__(framer)
+        self.args = args
+        self.chunk_size = chunk_size
+        self.returncode: Optional[int] = None
+
+        self._process: Optional[Process] = None
+
+    async def close(self) -> None:
+        """Stop the subprocess if it's still running."""
+        if self._process is None:
+            return
+
+        if self._process.returncode is None:
+            self._process.terminate()
+        self.returncode = await self._process.wait()
+
+    async def _read_chunk(self) -> bytes:
+        """Return the next chunk of the subprocess's output."""
+        if self._process is None:
+            self._process = await asyncio.create_subprocess_exec(
+                *self.args, stdout=PIPE
+            )
+        return await self._process.stdout.read(self.chunk_size)
+
+
+def _head(parts: Sequence[Any], size: int) -> bytes:
+    """Return up to the first ``size`` bytes of a sequence of buffers."""
+    head = b""
+    for part in parts:
+        if len(head) >= size:
+            break
+        head += bytes(part[: size - len(head)])
+    return head
+
+
+def _tail(parts: Sequence[Any], size: int) -> bytes:
+    """Return up to the last ``size`` bytes of a sequence of buffers."""
+    tail = b""
+    for part in reversed(parts):
+        if len(tail) >= size:
+            break
+        tail = bytes(part[max(len(part) - (size - len(tail)), 0) :]) + tail
+    return tail
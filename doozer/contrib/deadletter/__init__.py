@@ -0,0 +1,275 @@
+"""Dead letter plugin for Doozer.
+
+DeadLetter is a plugin to record the messages that Doozer applications
+fail to process, along with why they failed.
+"""
+from __future__ import annotations
+
+import asyncio
+from asyncio import Lock, Task
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import time
+import traceback
+from typing import Any, Awaitable, Callable, List, Optional
+
+from doozer.base import Application
+from doozer.extensions import Extension
+
+__all__ = ("CallbackSink", "DeadLetter", "FileSink")
+
+
+def _dead_letter(message: Any, exc: Exception) -> dict:
+    """Return the record of a message that failed.
+
+    Args:
+        message: The message that failed.
+        exc: The exception that caused it to fail.
+
+    Returns:
+        The message, the exception, the message's retry information
+        (if it was retried), and the time at which it failed.
+    """
+    retry_info = message.get("_retry") if isinstance(message, dict) else None
+    return {
+        "message": message,
+        "exception": {
+            "type": "{}.{}".format(type(exc).__module__, type(exc).__qualname__),
+            "message": str(exc),
+            "traceback": "".join(
+                traceback.format_exception(type(exc), exc, exc.__traceback__)
+            ),
+        },
+        "retry": retry_info,
+        "failed_at": time.time(),
+    }
+
+
+class CallbackSink:
+    """A sink that passes each batch of dead letters to a coroutine.
+
+    Args:
+        callback: A coroutine that accepts a list of dead letters.
+
+    Raises:
+        TypeError: If the callback isn't a coroutine.
+    """
+
+    def __init__(self, callback: Callable[[List[dict]], Awaitable[None]]) -> None:
+        """Initialize the instance."""
+        if not asyncio.iscoroutinefunction(callback):
+            raise TypeError("The callback is not a coroutine.")
+
+        self.callback = callback
+
+    async def close(self) -> None:
+        """Do nothing. There's nothing to close."""
+
+    async def write(self, dead_letters: List[dict]) -> None:
+        """Pass dead letters to the callback.
+
+        Args:
+            dead_letters: The dead letters to write.
+        """
+        await self.callback(dead_letters)
+
+
+class FileSink:
+    """A sink that appends dead letters to a file as JSON lines.
+
+    Each batch is serialized and written with a single call on a thread
+    of its own so that the event loop isn't blocked by the disk. Values
+    that can't be represented as JSON are written using :func:`repr`.
+
+    Once the file would grow past ``max_bytes``, it's renamed with a
+    suffix of ``.1`` and a new one is started. Files that were already
+    rotated are renamed with the next suffix, and only ``backup_count``
+    of them are kept.
+
+    Args:
+        path: The path to the file.
+        max_bytes: The size at which to rotate the file. If 0, it's
+            never rotated.
+        backup_count: The number of rotated files to keep. If 0, the
+            file is emptied rather than rotated.
+    """
+
+    def __init__(
+        self, path: str, max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5
+    ) -> None:
+        """Initialize the instance."""
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._file: Any = None
+
+    async def close(self) -> None:
+        """Close the file."""
+        if self._executor is None:
+            return
+
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(self._executor, self._close)
+        self._executor.shutdown()
+        self._executor = None
+
+    async def write(self, dead_letters: List[dict]) -> None:
+        """Append dead letters to the file.
+
+        Args:
+            dead_letters: The dead letters to write.
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="doozer-dead-letter"
+            )
+
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(self._executor, self._write, dead_letters)
+
+    def _close(self) -> None:
+        """Close the file on the sink's thread."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _rotate(self) -> None:
+        """Start a new file."""
+        self._file.close()
+
+        if self.backup_count:
+            for i in range(self.backup_count - 1, 0, -1):
+                source = "{}.{}".format(self.path, i)
+                if os.path.exists(source):
+                    os.replace(source, "{}.{}".format(self.path, i + 1))
+            os.replace(self.path, "{}.1".format(self.path))
+            self._file = open(self.path, "ab")
+        else:
+            self._file = open(self.path, "wb")
+
+    def _write(self, dead_letters: List[dict]) -> None:
+        """Write dead letters on the sink's thread."""
+        data = "".join(
+            json.dumps(dead_letter, default=repr) + "\n" for dead_letter in dead_letters
+        ).encode("utf-8")
+
+        if self._file is None:
+            self._file = open(self.path, "ab")
+
+        position = self._file.tell()
+        if self.max_bytes and position and position + len(data) > self.max_bytes:
+            self._rotate()
+
+        self._file.write(data)
+        self._file.flush()
+
+
+class DeadLetter(Extension):
+    """A class that records messages that fail to process."""
+
+    DEFAULT_SETTINGS = {
+        "DEAD_LETTER_BATCH_SIZE": 100,
+        "DEAD_LETTER_BATCH_WAIT": 1,
+        "DEAD_LETTER_EXCEPTIONS": Exception,
+    }
+
+    REQUIRED_SETTINGS = ("DEAD_LETTER_SINK",)
+
+    def init_app(self, app: Application) -> None:
+        """Initialize an ``Application`` instance.
+
+        Args:
+            app: Application instance to be initialized.
+
+        Raises:
+            TypeError: If the sink doesn't have ``write`` and ``close``
+                coroutines.
+            ValueError: If the batch size or wait isn't positive.
+        """
+        super().init_app(app)
+
+        sink = app.settings["DEAD_LETTER_SINK"]
+        for name in ("close", "write"):
+            if not asyncio.iscoroutinefunction(getattr(sink, name, None)):
+                raise TypeError("DEAD_LETTER_SINK.{} is not a coroutine.".format(name))
+
+        for key in ("DEAD_LETTER_BATCH_SIZE", "DEAD_LETTER_BATCH_WAIT"):
+            if app.settings[key] <= 0:
+                raise ValueError("{} must be positive.".format(key))
+
+        self._dead_letters: List[dict] = []
+        self._lock: Optional[Lock] = None
+        self._task: Optional[Task] = None
+
+        app.metrics.gauge("dead_letters.pending", lambda: len(self._dead_letters))
+        self._written = app.metrics.counter("messages.dead_lettered")
+        self._failed = app.metrics.counter("dead_letters.failed")
+
+        # Retry stops the other error callbacks from running when it
+        # retries a message, so only messages that won't be retried
+        # reach this one.
+        app.error(self._record)
+        app.startup(self._start)
+        app.teardown(self._stop)
+
+    async def _flush(self) -> None:
+        """Write the buffered dead letters to the sink.
+
+        Only one batch is written at a time. If the sink raises an
+        exception, it's logged and the batch is dropped.
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            if not self._dead_letters:
+                return
+
+            dead_letters, self._dead_letters = self._dead_letters, []
+            try:
+                await self.app.settings["DEAD_LETTER_SINK"].write(dead_letters)
+            except Exception:
+                self._failed.inc(len(dead_letters))
+                self.app.logger.exception(
+                    "dead_letters.failed", extra={"count": len(dead_letters)}
+                )
+            else:
+                self._written.inc(len(dead_letters))
+
+    async def _flush_periodically(self) -> None:
+        """Flush the buffered dead letters until cancelled."""
+        while True:
+            await asyncio.sleep(self.app.settings["DEAD_LETTER_BATCH_WAIT"])
+            await self._flush()
+
+    async def _record(self, app: Application, message: Any, exc: Exception) -> None:
+        """Buffer a dead letter for the message.
+
+        Once a full batch is buffered, the message waits for it to be
+        written. This keeps a burst of failures from buffering more
+        dead letters than the sink can keep up with.
+        """
+        if not isinstance(exc, app.settings["DEAD_LETTER_EXCEPTIONS"]):
+            return
+
+        self._dead_letters.append(_dead_letter(message, exc))
+
+        if len(self._dead_letters) >= app.settings["DEAD_LETTER_BATCH_SIZE"]:
+            await self._flush()
+
+    async def _start(self, app: Application) -> None:
+        """Start flushing dead letters periodically."""
+        self._task = asyncio.ensure_future(self._flush_periodically())
+
+    async def _stop(self, app: Application) -> None:
+        """Write any buffered dead letters and close the sink."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.wait([self._task])
+            self._task = None
+
+        await self._flush()
+        await app.settings["DEAD_LETTER_SINK"].close()
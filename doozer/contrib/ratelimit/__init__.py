@@ -0,0 +1,170 @@
+"""Rate limiting plugin for Doozer.
+
+RateLimit is a plugin to limit how many messages per second Doozer
+applications pass to their callbacks.
+"""
+from __future__ import annotations
+
+import asyncio
+from collections import OrderedDict
+from typing import Any, Hashable
+
+from doozer.base import Application
+from doozer.extensions import Extension
+
+__all__ = ("RateLimit", "TokenBucket")
+
+
+class TokenBucket:
+    """A token bucket that hands out tokens at a steady pace.
+
+    Rather than tracking the number of tokens in the bucket, the bucket
+    tracks when it will be full again. This allows tokens to be reserved
+    ahead of time so that each caller knows exactly how long to wait.
+
+    Args:
+        rate: The number of tokens added to the bucket each second.
+        burst: The number of tokens the bucket can hold.
+    """
+
+    __slots__ = ("_full_at", "_interval", "_tolerance")
+
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        """Initialize the instance."""
+        self._interval = 1 / rate
+        self._tolerance = (burst - 1) * self._interval
+        self._full_at = float("-inf")
+
+    def reserve(self, now: float) -> float:
+        """Reserve the next token.
+
+        Args:
+            now: The earliest time at which the token can be used.
+
+        Returns:
+            The time at which the token can be used.
+        """
+        at = max(now, self._full_at - self._tolerance)
+        self._full_at = max(self._full_at, at) + self._interval
+        return at
+
+
+class RateLimit(Extension):
+    """A class that limits the rate at which messages are processed."""
+
+    DEFAULT_SETTINGS = {
+        "RATE_LIMIT": None,
+        "RATE_LIMIT_BURST": 1,
+        "RATE_LIMIT_KEY": None,
+        "RATE_LIMIT_MAX_KEYS": 10000,
+        "RATE_LIMIT_PER_KEY": None,
+        "RATE_LIMIT_PER_KEY_BURST": 1,
+    }
+
+    def init_app(self, app: Application) -> None:
+        """Initialize an ``Application`` instance.
+
+        Args:
+            app: Application instance to be initialized.
+
+        Raises:
+            TypeError: If a per-key rate is set without a key function.
+            ValueError: If neither rate is set or any of the rates,
+                bursts, or maximum number of keys isn't positive.
+        """
+        super().init_app(app)
+
+        rate = app.settings["RATE_LIMIT"]
+        per_key_rate = app.settings["RATE_LIMIT_PER_KEY"]
+
+        if rate is None and per_key_rate is None:
+            raise ValueError("RATE_LIMIT or RATE_LIMIT_PER_KEY must be set.")
+
+        if per_key_rate is not None and not callable(app.settings["RATE_LIMIT_KEY"]):
+            raise TypeError("RATE_LIMIT_KEY must be callable.")
+
+        for key in (
+            "RATE_LIMIT",
+            "RATE_LIMIT_BURST",
+            "RATE_LIMIT_MAX_KEYS",
+            "RATE_LIMIT_PER_KEY",
+            "RATE_LIMIT_PER_KEY_BURST",
+        ):
+            if app.settings[key] is not None and app.settings[key] <= 0:
+                raise ValueError("{} must be positive.".format(key))
+
+        if rate is None:
+            self.bucket = None
+        else:
+            self.bucket = TokenBucket(rate, app.settings["RATE_LIMIT_BURST"])
+
+        # Only the most recently used keys are kept. By the time a key
+        # is removed, its bucket will usually be full again.
+        self._buckets: OrderedDict[Hashable, TokenBucket] = OrderedDict()
+        self._waiting = 0
+
+        app.metrics.gauge("rate_limit.waiting", lambda: self._waiting)
+        self._delayed = app.metrics.counter("rate_limit.delayed")
+        self._workers = app.metrics.gauge("workers.total")
+
+        # The limit should be applied as close to the callback as
+        # possible.
+        app.message_preprocessor(self._limit)
+
+    async def _limit(self, app: Application, message: Any) -> Any:
+        """Wait until the message can be processed."""
+        loop = asyncio.get_event_loop()
+        delayed = False
+
+        if app.settings["RATE_LIMIT_PER_KEY"] is not None:
+            bucket = self._key_bucket(app.settings["RATE_LIMIT_KEY"](message))
+            now = loop.time()
+            at = bucket.reserve(now)
+            if at > now:
+                delayed = True
+                await self._wait(app, at - now)
+
+        if self.bucket is not None:
+            # Only take a token from the shared bucket once the message
+            # is released by its key's bucket. Reserving it ahead of
+            # time would hold up messages with other keys.
+            now = loop.time()
+            at = self.bucket.reserve(now)
+            if at > now:
+                delayed = True
+                await self._wait(app, at - now)
+
+        if delayed:
+            self._delayed.inc()
+
+        return message
+
+    def _key_bucket(self, key: Hashable) -> TokenBucket:
+        """Return the bucket for a key."""
+        try:
+            self._buckets.move_to_end(key)
+        except KeyError:
+            self._buckets[key] = TokenBucket(
+                self.app.settings["RATE_LIMIT_PER_KEY"],
+                self.app.settings["RATE_LIMIT_PER_KEY_BURST"],
+            )
+            if len(self._buckets) > self.app.settings["RATE_LIMIT_MAX_KEYS"]:
+                self._buckets.popitem(last=False)
+        return self._buckets[key]
+
+    async def _wait(self, app: Application, delay: float) -> None:
+        """Wait for a token.
+
+        Once every worker is waiting, there's no reason to read more
+        messages, so consumption is paused until one of them is done.
+        """
+        self._waiting += 1
+        if self._waiting >= self._workers.value:
+            app.pause_consumption("rate_limit")
+
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            self._waiting -= 1
+            if self._waiting < self._workers.value:
+                app.resume_consumption("rate_limit")
@@ -6,17 +6,71 @@ messages that fail to process.
 from __future__ import annotations
 
 import asyncio
+from asyncio import Future, Task, TimerHandle
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from contextvars import ContextVar
+from itertools import count
+import json
+import math
 from numbers import Number
+import random
+import sqlite3
 import time
+from time import perf_counter
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
 from doozer.base import Application
 from doozer.exceptions import Abort
 from doozer.extensions import Extension
 
-__all__ = ("Retry", "RetryableException")
-
-
-def _calculate_delay(delay: Number, backoff: Number, number_of_retries: int) -> Number:
+__all__ = (
+    "DurableRetryScheduler",
+    "Retry",
+    "RetryableException",
+    "RetryBudget",
+    "RetryScheduler",
+    "RetryStore",
+)
+
+BackoffStrategy = Callable[
+    [Number, Number, int, Optional[Number], Optional[Number]], Number
+]
+
+# Retry information carries wall clock timestamps so that it means the
+# same thing to every process that sees the message. Within a process,
+# time is measured with a monotonic clock anchored to the wall clock
+# once so that changes to the system clock don't affect timeouts.
+_WALL_CLOCK_ANCHOR = time.time()
+_MONOTONIC_ANCHOR = perf_counter()
+
+# Each worker processes one message at a time in its own task, so a
+# context variable can carry the time processing started from the
+# preprocessor to the error callback.
+_attempt_started: ContextVar[Optional[float]] = ContextVar(
+    "retry_attempt_started", default=None
+)
+
+
+def _calculate_delay(
+    delay: Number,
+    backoff: Number,
+    number_of_retries: int,
+    previous_delay: Optional[Number] = None,
+    max_delay: Optional[Number] = None,
+    strategy: Union[str, BackoffStrategy] = "exponential",
+) -> Number:
     """Return the time to wait before retrying.
 
     Args:
@@ -24,14 +78,102 @@ def _calculate_delay(delay: Number, backoff: Number, number_of_retries: int) ->
             the retry.
         backoff: The factor by which each retry should be extended.
         number_of_retries: The number of retry attempts already made.
+        previous_delay: The amount of time waited before the previous
+            retry attempt, if there was one.
+        max_delay: The most time to wait. If None, there is no limit.
+        strategy: The name of one of the backoff strategies or a
+            callable that takes the other arguments, in order, and
+            returns the amount of time to wait.
 
     Returns:
         The amount of time to wait.
     """
     assert isinstance(backoff, (int, float))
 
-    backoff_factor = backoff ** number_of_retries
-    return delay * backoff_factor
+    function = _backoff_strategy(strategy)
+    return function(delay, backoff, number_of_retries, previous_delay, max_delay)
+
+
+def _backoff_strategy(strategy: Union[str, BackoffStrategy]) -> BackoffStrategy:
+    """Return the function used to calculate the delay.
+
+    Args:
+        strategy: Either one of ``"exponential"``, ``"full_jitter"``, or
+            ``"decorrelated_jitter"`` or a callable.
+
+    Returns:
+        The function.
+
+    Raises:
+        ValueError: If the strategy isn't valid.
+    """
+    if callable(strategy):
+        return strategy
+
+    try:
+        return _BACKOFF_STRATEGIES[strategy]
+    except (KeyError, TypeError):
+        raise ValueError(
+            "RETRY_BACKOFF_STRATEGY must be one of {} or a callable. "
+            "Got {!r}".format(", ".join(repr(s) for s in _BACKOFF_STRATEGIES), strategy)
+        ) from None
+
+
+def _decorrelated_jitter(
+    delay: Number,
+    backoff: Number,
+    number_of_retries: int,
+    previous_delay: Optional[Number],
+    max_delay: Optional[Number],
+) -> Number:
+    """Return a random delay between the base and thrice the last one.
+
+    Each delay depends on the one before it rather than on the number
+    of attempts, so messages that failed together drift apart.
+    """
+    upper = 3 * (previous_delay or delay)
+    if max_delay is not None:
+        upper = min(upper, max_delay)
+    return random.uniform(min(delay, upper), upper)
+
+
+def _exponential(
+    delay: Number,
+    backoff: Number,
+    number_of_retries: int,
+    previous_delay: Optional[Number],
+    max_delay: Optional[Number],
+) -> Number:
+    """Return the delay multiplied by the backoff for each attempt."""
+    try:
+        value = delay * backoff ** number_of_retries
+    except OverflowError:
+        value = math.inf
+
+    if max_delay is not None:
+        value = min(value, max_delay)
+    return value
+
+
+def _full_jitter(
+    delay: Number,
+    backoff: Number,
+    number_of_retries: int,
+    previous_delay: Optional[Number],
+    max_delay: Optional[Number],
+) -> Number:
+    """Return a random delay up to the exponential delay."""
+    upper = _exponential(delay, backoff, number_of_retries, previous_delay, max_delay)
+    return random.uniform(0, upper)
+
+
+# The strategies that can be used to calculate the delay before a
+# retry.
+_BACKOFF_STRATEGIES: Dict[str, BackoffStrategy] = {
+    "decorrelated_jitter": _decorrelated_jitter,
+    "exponential": _exponential,
+    "full_jitter": _full_jitter,
+}
 
 
 def _exceeded_threshold(number_of_retries: int, maximum_retries: int) -> bool:
@@ -52,12 +194,13 @@ def _exceeded_threshold(number_of_retries: int, maximum_retries: int) -> bool:
     return number_of_retries >= maximum_retries
 
 
-def _exceeded_timeout(start_time: Number, duration: Number) -> bool:
+def _exceeded_timeout(start_time: Number, duration: Number, now: float) -> bool:
     """Return True if the timeout has been exceeded.
 
     Args:
-        start_time: The timestamp of the first retry attempt.
+        start_time: The timestamp of the first failed attempt.
         duration: The total number of seconds to retry for.
+        now: The current timestamp.
 
     Returns:
         True if the timeout has passed.
@@ -68,8 +211,12 @@ def _exceeded_timeout(start_time: Number, duration: Number) -> bool:
 
     assert isinstance(duration, (int, float))
 
-    # Duration is in seconds, not milliseconds like start_time.
-    return start_time + (duration * 1000) <= int(time.time())
+    return now - start_time >= duration
+
+
+def _now() -> float:
+    """Return the current timestamp according to the monotonic clock."""
+    return _WALL_CLOCK_ANCHOR + (perf_counter() - _MONOTONIC_ANCHOR)
 
 
 async def _retry(app: Application, message: dict, exc: Exception) -> None:
@@ -92,7 +239,25 @@ async def _retry(app: Application, message: dict, exc: Exception) -> None:
         # next error callback can be called.
         return
 
-    retry_info = _retry_info(message)
+    now = _now()
+    retry_info = _retry_info(message, now)
+
+    history_size = app.settings["RETRY_HISTORY_SIZE"]
+    if history_size:
+        # Record the attempt even if the message won't be retried so
+        # that any remaining error callbacks can see it.
+        started = _attempt_started.get()
+        _attempt_started.set(None)
+
+        attempt = {
+            "elapsed": now - retry_info["start_time"],
+            "exception": type(exc).__name__,
+            "latency": None if started is None else perf_counter() - started,
+        }
+        history = retry_info.setdefault("history", [])
+        history.append(attempt)
+        del history[:-history_size]
+    message["_retry"] = retry_info
 
     threshold = app.settings["RETRY_THRESHOLD"]
     if _exceeded_threshold(retry_info["count"], threshold):
@@ -101,59 +266,514 @@ async def _retry(app: Application, message: dict, exc: Exception) -> None:
         return
 
     timeout = app.settings["RETRY_TIMEOUT"]
-    if _exceeded_timeout(retry_info["start_time"], timeout):
+    if _exceeded_timeout(retry_info["start_time"], timeout, now):
         # If we've gone past the time to stop retrying, don't retry it
         # again.
         return
 
+    budget = app.extensions["retry"].budget
+    if budget is not None and not budget.withdraw():
+        # If too many messages are being retried, treat this one as a
+        # failure.
+        app.logger.debug("retry.budget_exhausted")
+        return
+
+    delay = 0
     if app.settings["RETRY_DELAY"]:
         # If a delay has been specified, calculate the actual delay
-        # based on any backoff and then sleep for that long. Add the
-        # delay time to the retry information so that it can be used
-        # to gain insight into the full history of a retried message.
-        retry_info["delay"] = _calculate_delay(
+        # based on any backoff. Add the delay time to the retry
+        # information so that it can be used to gain insight into the
+        # full history of a retried message.
+        delay = retry_info["delay"] = _calculate_delay(
             delay=app.settings["RETRY_DELAY"],
             backoff=app.settings["RETRY_BACKOFF"],
             number_of_retries=retry_info["count"],
+            previous_delay=retry_info.get("delay"),
+            max_delay=app.settings["RETRY_MAX_DELAY"],
+            strategy=app.settings["RETRY_BACKOFF_STRATEGY"],
         )
-        await asyncio.sleep(retry_info["delay"])
+
+    if history_size:
+        attempt["delay"] = delay
 
     # Update the retry information and retry the message.
     retry_info["count"] += 1
-    message["_retry"] = retry_info
-    await app.settings["RETRY_CALLBACK"](app, message)
+
+    if delay:
+        # Rather than holding on to the worker for the whole delay,
+        # hand the message off to be retried once the delay has passed.
+        await app.extensions["retry"].scheduler.schedule(message, delay)
+    else:
+        await app.settings["RETRY_CALLBACK"](app, message)
 
     # If the exception was retryable, none of the other callbacks should
     # execute.
     raise Abort("message.retried", message)
 
 
-def _retry_info(message: dict) -> dict:
+def _retry_info(message: dict, now: float) -> dict:
     """Return the retry attempt information.
 
     Args:
         message: The message to be retried.
+        now: The current timestamp, used as the start time if this is
+            the message's first failure.
 
     Returns:
         The retry attempt information.
     """
     info = message.get("_retry", {})
     info.setdefault("count", 0)
-    info.setdefault("start_time", int(time.time()))
+    if "start_time" not in info:
+        info["start_time"] = now
     return info
 
 
+async def _start_attempt(app: Application, message: Any) -> Any:
+    """Record the time at which processing the message started."""
+    _attempt_started.set(perf_counter())
+    return message
+
+
 class RetryableException(Exception):
     """Exception to be raised when a message should be retried."""
 
 
+class RetryBudget:
+    """A limit on the share of messages that can be retried.
+
+    The budget is a token bucket. Every message consumed by the
+    application adds ``ratio`` tokens, up to ``burst`` tokens, and every
+    retry takes one. The bucket starts full.
+
+    Args:
+        app: The application whose messages will be retried.
+        ratio: The most retries to allow for each message consumed.
+        burst: The most retries to allow at once.
+    """
+
+    def __init__(self, app: Application, ratio: float, burst: int) -> None:
+        """Initialize the instance."""
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = float(burst)
+
+        self._consumed = app.metrics.counter("messages.consumed")
+        self._last_consumed = self._consumed.value
+        self._rejected = app.metrics.counter("retries.rejected")
+
+    def withdraw(self) -> bool:
+        """Take a token from the bucket if there is one.
+
+        Returns:
+            True if the retry is allowed.
+        """
+        consumed = self._consumed.value
+        self.tokens = min(
+            self.burst, self.tokens + (consumed - self._last_consumed) * self.ratio
+        )
+        self._last_consumed = consumed
+
+        if self.tokens < 1:
+            self._rejected.inc()
+            return False
+
+        self.tokens -= 1
+        return True
+
+
+class RetryScheduler:
+    """Call the retry callback for messages once their delays pass.
+
+    Each message waiting to be retried is held in memory until its
+    delay passes. Once the maximum number of messages are waiting,
+    scheduling another one will wait until one of them is retried.
+
+    Args:
+        app: The application whose messages will be retried.
+        max_pending: The most messages that can wait to be retried.
+    """
+
+    def __init__(self, app: Application, max_pending: int) -> None:
+        """Initialize the instance."""
+        self.app = app
+        self.max_pending = max_pending
+
+        self._ids = count()
+        self._timers: Dict[int, Tuple[TimerHandle, dict]] = {}
+        self._tasks: Set[Task] = set()
+        self._waiters: Deque[Future] = deque()
+
+        app.metrics.gauge("retries.pending", lambda: len(self))
+        self._retried = app.metrics.counter("messages.retried")
+
+    def __len__(self) -> int:
+        """Return the number of messages waiting to be retried."""
+        return len(self._timers) + len(self._tasks)
+
+    async def schedule(self, message: dict, delay: Number) -> None:
+        """Schedule a message to be retried.
+
+        Args:
+            message: The message to retry.
+            delay: The number of seconds to wait before retrying it.
+        """
+        loop = asyncio.get_event_loop()
+
+        while len(self) >= self.max_pending:
+            waiter = loop.create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+
+        id_ = next(self._ids)
+        timer = loop.call_later(delay, self._retry, id_)
+        self._timers[id_] = timer, message
+
+    async def flush(self) -> None:
+        """Retry every scheduled message without waiting any longer."""
+        for id_, (timer, _) in list(self._timers.items()):
+            timer.cancel()
+            self._retry(id_)
+
+        if self._tasks:
+            await asyncio.wait(self._tasks)
+
+    def _retry(self, id_: int) -> None:
+        """Start retrying a message whose delay has passed."""
+        _, message = self._timers.pop(id_)
+
+        task = asyncio.ensure_future(self._send(message))
+        self._tasks.add(task)
+        task.add_done_callback(self._done)
+
+    def _done(self, task: Task) -> None:
+        """Make room for another message once one has been retried."""
+        self._tasks.discard(task)
+
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+    async def _send(self, message: dict) -> None:
+        """Call the retry callback."""
+        try:
+            await self.app.settings["RETRY_CALLBACK"](self.app, message)
+        except Exception as e:
+            self.app.logger.error("message.retry_failed", exc_info=e)
+        else:
+            self._retried.inc()
+
+
+class RetryStore:
+    """A SQLite database of messages waiting to be retried.
+
+    Each message is saved along with the time at which it should be
+    retried. Due times are wall clock timestamps so that they still mean
+    something after the application restarts. An index on the due time
+    lets the messages that are due be read a few at a time no matter
+    how many are waiting.
+
+    The methods block and aren't thread-safe. They should only be called
+    from one thread at a time.
+
+    Args:
+        path: The path to the database. It's created if it doesn't
+            exist.
+        serializer: An object with ``dumps`` and ``loads`` functions,
+            such as :mod:`json` or :mod:`pickle`, used to save messages.
+    """
+
+    def __init__(self, path: str, serializer: Any = json) -> None:
+        """Initialize the instance."""
+        self.path = path
+        self.serializer = serializer
+
+        self._connection = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False
+        )
+        # With write-ahead logging, committed messages survive the
+        # application crashing without every write waiting on the disk.
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS retries ("
+            "id INTEGER PRIMARY KEY, due REAL NOT NULL, message BLOB NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS retries_due ON retries (due)"
+        )
+        (self._count,) = self._connection.execute(
+            "SELECT COUNT(*) FROM retries"
+        ).fetchone()
+
+    def __len__(self) -> int:
+        """Return the number of messages waiting to be retried."""
+        return self._count
+
+    def add(self, message: Any, due: float) -> None:
+        """Save a message.
+
+        Args:
+            message: The message to retry.
+            due: The timestamp at which to retry it.
+        """
+        self._connection.execute(
+            "INSERT INTO retries (due, message) VALUES (?, ?)",
+            (due, self.serializer.dumps(message)),
+        )
+        self._count += 1
+
+    def close(self) -> None:
+        """Close the database."""
+        self._connection.close()
+
+    def due(self, now: float, limit: int) -> List[Tuple[int, Any]]:
+        """Return the messages that are due, oldest first.
+
+        The messages aren't removed until :meth:`remove` is called so
+        that none are lost if the application stops while they're being
+        retried.
+
+        Args:
+            now: The current timestamp.
+            limit: The most messages to return.
+
+        Returns:
+            The ids and messages.
+        """
+        rows = self._connection.execute(
+            "SELECT id, message FROM retries WHERE due <= ? ORDER BY due LIMIT ?",
+            (now, limit),
+        )
+        return [(id_, self.serializer.loads(message)) for id_, message in rows]
+
+    def next_due(self) -> Optional[float]:
+        """Return the earliest due time, or None if nothing is waiting."""
+        (due,) = self._connection.execute("SELECT MIN(due) FROM retries").fetchone()
+        return due
+
+    def postpone(self, ids: List[int], due: float) -> None:
+        """Change when messages should be retried.
+
+        Args:
+            ids: The ids returned by :meth:`due`.
+            due: The timestamp at which to retry them.
+        """
+        self._connection.execute("BEGIN")
+        try:
+            self._connection.executemany(
+                "UPDATE retries SET due = ? WHERE id = ?", [(due, id_) for id_ in ids]
+            )
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            raise
+        self._connection.execute("COMMIT")
+
+    def remove(self, ids: List[int]) -> None:
+        """Remove messages.
+
+        Args:
+            ids: The ids returned by :meth:`due`.
+        """
+        self._connection.execute("BEGIN")
+        try:
+            cursor = self._connection.executemany(
+                "DELETE FROM retries WHERE id = ?", [(id_,) for id_ in ids]
+            )
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            raise
+        self._connection.execute("COMMIT")
+        self._count -= cursor.rowcount
+
+
+class DurableRetryScheduler:
+    """Call the retry callback for messages saved in a store.
+
+    Unlike :class:`RetryScheduler`, messages waiting to be retried are
+    kept in a :class:`RetryStore` rather than in memory. Only the
+    messages that are due are loaded, ``batch_size`` at a time. Messages
+    are removed from the store once the retry callback has succeeded,
+    so a message being retried when the application stops will be
+    retried again after it restarts. If the callback fails, the message
+    is kept and tried again after ``failure_delay`` seconds.
+
+    The store is opened by :meth:`start` and closed by :meth:`flush`.
+    Messages that are still waiting when the application stops are left
+    in the store to be retried once it starts again.
+
+    Args:
+        app: The application whose messages will be retried.
+        path: The path to the database.
+        batch_size: The most messages to load at once.
+        serializer: An object with ``dumps`` and ``loads`` functions
+            used to save messages.
+        failure_delay: The number of seconds to wait before trying
+            again when the retry callback or the store fails.
+    """
+
+    def __init__(
+        self,
+        app: Application,
+        path: str,
+        batch_size: int,
+        serializer: Any = json,
+        failure_delay: Number = 1,
+    ) -> None:
+        """Initialize the instance."""
+        self.app = app
+        self.path = path
+        self.batch_size = batch_size
+        self.serializer = serializer
+        self.failure_delay = failure_delay
+        self.store: Optional[RetryStore] = None
+
+        # SQLite connections shouldn't be used by more than one thread
+        # at a time, so every call to the store goes through one thread.
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._next_due: Optional[float] = None
+        self._task: Optional[Task] = None
+        self._wakeup: Optional[Future] = None
+
+        app.metrics.gauge("retries.pending", lambda: len(self))
+        self._retried = app.metrics.counter("messages.retried")
+
+    def __len__(self) -> int:
+        """Return the number of messages waiting to be retried."""
+        if self.store is None:
+            return 0
+        return len(self.store)
+
+    async def flush(self) -> None:
+        """Stop retrying messages and close the store."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.wait([self._task])
+            self._task = None
+
+        if self.store is not None:
+            await self._call(self.store.close)
+            self.store = None
+
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    async def schedule(self, message: dict, delay: Number) -> None:
+        """Save a message to be retried.
+
+        Args:
+            message: The message to retry.
+            delay: The number of seconds to wait before retrying it.
+        """
+        if self.store is None:
+            await self.start()
+
+        due = _now() + delay
+        await self._call(self.store.add, message, due)
+
+        if self._next_due is None or due < self._next_due:
+            self._next_due = due
+            if self._wakeup is not None and not self._wakeup.done():
+                self._wakeup.set_result(None)
+
+    async def start(self) -> None:
+        """Open the store and start retrying messages as they come due."""
+        if self.store is not None:
+            return
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="doozer-retry"
+        )
+        self.store = await self._call(RetryStore, self.path, self.serializer)
+        self._task = asyncio.ensure_future(self._run())
+
+    async def _call(self, function: Callable, *args: Any) -> Any:
+        """Call a function on the store's thread."""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, function, *args)
+
+    async def _run(self) -> None:
+        """Retry messages as they come due."""
+        loop = asyncio.get_event_loop()
+
+        while True:
+            try:
+                batch = await self._call(self.store.due, _now(), self.batch_size)
+                if batch:
+                    sent = await asyncio.gather(
+                        *(self._send(message) for _, message in batch)
+                    )
+                    # Keep the messages that weren't sent so that they
+                    # aren't lost.
+                    await self._call(
+                        self.store.remove,
+                        [id_ for (id_, _), ok in zip(batch, sent) if ok],
+                    )
+                    failed = [id_ for (id_, _), ok in zip(batch, sent) if not ok]
+                    if failed:
+                        await self._call(
+                            self.store.postpone, failed, _now() + self.failure_delay
+                        )
+                    continue
+
+                # Sleep until the next message is due or an earlier one
+                # is scheduled.
+                self._next_due = await self._call(self.store.next_due)
+            except Exception as e:
+                # Don't stop retrying messages until the application
+                # restarts. Try again once the store has had time to
+                # recover.
+                self.app.logger.error("retry.store_failed", exc_info=e)
+                self._next_due = _now() + self.failure_delay
+
+            if self._next_due is None:
+                timeout = None
+            else:
+                timeout = max(self._next_due - _now(), 0)
+
+            self._wakeup = loop.create_future()
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup, timeout)
+
+    async def _send(self, message: dict) -> bool:
+        """Call the retry callback.
+
+        Returns:
+            True if the callback succeeded.
+        """
+        try:
+            await self.app.settings["RETRY_CALLBACK"](self.app, message)
+        except Exception as e:
+            self.app.logger.error("message.retry_failed", exc_info=e)
+            return False
+
+        self._retried.inc()
+        return True
+
+
 class Retry(Extension):
     """A class that adds retries to an application."""
 
     DEFAULT_SETTINGS = {
         "RETRY_BACKOFF": 1,
+        "RETRY_BACKOFF_STRATEGY": "exponential",
+        "RETRY_BUDGET": None,
+        "RETRY_BUDGET_BURST": 10,
         "RETRY_DELAY": 0,
         "RETRY_EXCEPTIONS": RetryableException,
+        "RETRY_HISTORY_SIZE": 10,
+        "RETRY_MAX_DELAY": None,
+        "RETRY_MAX_PENDING": 1000,
+        "RETRY_STORE": None,
+        "RETRY_STORE_BATCH_SIZE": 100,
+        "RETRY_STORE_SERIALIZER": json,
         "RETRY_THRESHOLD": None,
         "RETRY_TIMEOUT": None,
     }
@@ -168,7 +788,10 @@ class Retry(Extension):
 
         Raises:
             TypeError: If the callback isn't a coroutine.
-            ValueError: If the delay or backoff is negative.
+            ValueError: If the delay, backoff, maximum delay, or history
+                size is negative, the backoff strategy isn't valid, or the
+                maximum number of pending retries, the budget, or the
+                store's batch size isn't positive.
         """
         super().init_app(app)
 
@@ -178,10 +801,65 @@ class Retry(Extension):
         if app.settings["RETRY_BACKOFF"] < 0:
             raise ValueError("The backoff cannot be negative.")
 
+        max_delay = app.settings["RETRY_MAX_DELAY"]
+        if max_delay is not None and max_delay < 0:
+            raise ValueError("The maximum delay cannot be negative.")
+
+        if app.settings["RETRY_HISTORY_SIZE"] < 0:
+            raise ValueError("The history size cannot be negative.")
+
+        _backoff_strategy(app.settings["RETRY_BACKOFF_STRATEGY"])
+
+        ratio = app.settings["RETRY_BUDGET"]
+        if ratio is not None and ratio <= 0:
+            raise ValueError("The retry budget must be positive.")
+
+        if app.settings["RETRY_MAX_PENDING"] < 1:
+            raise ValueError("The maximum number of pending retries must be positive.")
+
+        if app.settings["RETRY_STORE_BATCH_SIZE"] < 1:
+            raise ValueError("The store's batch size must be positive.")
+
         if not asyncio.iscoroutinefunction(app.settings["RETRY_CALLBACK"]):
             raise TypeError("The retry callback is not a coroutine.")
 
+        self.scheduler: Union[RetryScheduler, DurableRetryScheduler]
+        if app.settings["RETRY_STORE"] is None:
+            self.scheduler = RetryScheduler(app, app.settings["RETRY_MAX_PENDING"])
+        else:
+            self.scheduler = DurableRetryScheduler(
+                app,
+                app.settings["RETRY_STORE"],
+                app.settings["RETRY_STORE_BATCH_SIZE"],
+                app.settings["RETRY_STORE_SERIALIZER"],
+            )
+            # Messages saved before the application last stopped
+            # should be retried as soon as it starts.
+            app.startup(self._start)
+
+        if ratio is None:
+            self.budget = None
+        else:
+            self.budget = RetryBudget(app, ratio, app.settings["RETRY_BUDGET_BURST"])
+
+        # Don't lose any messages that are still waiting to be retried
+        # when the application stops. Durable schedulers keep them in
+        # their stores instead.
+        app.teardown(self._flush)
+
         # The retry callback should be executed before all other
         # callbacks. This will ensure that retryable exceptions are
         # retried.
         app._callbacks["error"].insert(0, _retry)
+
+        # Start timing each attempt before any other preprocessing is
+        # done.
+        app._callbacks["message_preprocessor"].insert(0, _start_attempt)
+
+    async def _flush(self, app: Application) -> None:
+        """Retry or save every scheduled message."""
+        await self.scheduler.flush()
+
+    async def _start(self, app: Application) -> None:
+        """Start retrying saved messages."""
+        await self.scheduler.start()
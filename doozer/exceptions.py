@@ -3,7 +3,7 @@ from __future__ import annotations
 
 from .types import Message
 
-__all__ = ("Abort",)
+__all__ = ("Abort", "ProcessingTimeout")
 
 
 class Abort(Exception):
@@ -28,3 +28,24 @@ class Abort(Exception):
         """Initialize the class."""
         super().__init__(reason)
         self.message = message
+
+
+class ProcessingTimeout(Exception):
+    """An exception raised when a message takes too long to process.
+
+    The stage that was running is cancelled and the exception is passed
+    to the error callbacks like any other exception raised while
+    processing the message.
+
+    Args:
+        stage: The deadline that expired. One of ``"preprocess"``,
+            ``"callback"``, ``"postprocess"``, or ``"message"`` if the
+            deadline for the whole message expired first.
+
+    .. versionadded:: 2.0
+    """
+
+    def __init__(self, stage: str) -> None:
+        """Initialize the class."""
+        super().__init__(stage)
+        self.stage = stage
@@ -0,0 +1,109 @@
+"""Run synchronous callbacks in executors."""
+from __future__ import annotations
+
+import asyncio
+from functools import partial, wraps
+from importlib import import_module
+import inspect
+from typing import Any, Callable
+
+from .types import Callback
+
+__all__ = ("in_process", "in_thread")
+
+
+def in_process(function: Callable) -> Callback:
+    """Wrap a function so that it runs in the application's process pool.
+
+    The function will be called with all of the arguments the callback
+    receives except the application, which can't be sent to another
+    process. The function and its arguments must be picklable.
+
+    Args:
+        function: A module-level function.
+
+    Returns:
+        A coroutine function that can be registered as any type of
+        callback.
+
+    Raises:
+        TypeError: If the function is a coroutine.
+    """
+    _check_function(function)
+
+    # Send the function's location rather than the function itself. If
+    # this is used as a decorator, the name will refer to the wrapper
+    # and the function won't be picklable.
+    location = (function.__module__, function.__qualname__)
+
+    @wraps(function)
+    async def wrapper(app, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            app._executor("process"), _call, location, args
+        )
+
+    return wrapper
+
+
+def in_thread(function: Callable) -> Callback:
+    """Wrap a function so that it runs in the application's thread pool.
+
+    The function will be called with the same arguments as the callback
+    it's registered as.
+
+    Args:
+        function: A function.
+
+    Returns:
+        A coroutine function that can be registered as any type of
+        callback.
+
+    Raises:
+        TypeError: If the function is a coroutine.
+    """
+    _check_function(function)
+
+    @wraps(function)
+    async def wrapper(app, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            app._executor("thread"), partial(function, app, *args)
+        )
+
+    return wrapper
+
+
+def _call(location: tuple, args: tuple) -> Any:
+    """Call a function by its location.
+
+    Args:
+        location: The module and qualified name of the function.
+        args: The arguments with which to call the function.
+
+    Returns:
+        The return value of the function.
+    """
+    module, qualname = location
+    function = import_module(module)
+    for name in qualname.split("."):
+        function = getattr(function, name)
+
+    # The name may refer to the wrapper returned by in_process.
+    return inspect.unwrap(function)(*args)
+
+
+def _check_function(function: Callable) -> None:
+    """Check that a function can be run in an executor.
+
+    Args:
+        function: The function.
+
+    Raises:
+        TypeError: If the function isn't callable or is a coroutine.
+    """
+    if not callable(function):
+        raise TypeError("The function must be callable.")
+
+    if asyncio.iscoroutinefunction(function):
+        raise TypeError("The function can't be a coroutine.")
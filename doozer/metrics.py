@@ -0,0 +1,316 @@
+"""Metrics for the message pipeline."""
+from __future__ import annotations
+
+import asyncio
+from bisect import bisect_left
+import json
+import os
+import tempfile
+from typing import Any, Callable, Dict, Optional, Sequence, Union
+
+__all__ = ("Counter", "Gauge", "Histogram", "Metrics")
+
+# Exponential bucket boundaries, in seconds, from 10 microseconds to
+# about a minute and a half.
+DEFAULT_BUCKETS = tuple(0.00001 * 2 ** i for i in range(24))
+
+
+class Counter:
+    """A value that only ever increases."""
+
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        """Initialize the instance."""
+        self.value = 0
+
+    def inc(self, amount: Union[int, float] = 1) -> None:
+        """Increase the value.
+
+        Args:
+            amount: The amount by which to increase the value.
+        """
+        self.value += amount
+
+    def snapshot(self) -> Union[int, float]:
+        """Return the current value."""
+        return self.value
+
+
+class Gauge:
+    """A value that can increase and decrease.
+
+    Args:
+        function: A callable that, if provided, will be called to get
+            the current value instead of the value being set directly.
+    """
+
+    __slots__ = ("_function", "_value")
+
+    def __init__(self, function: Optional[Callable[[], Any]] = None) -> None:
+        """Initialize the instance."""
+        self._function = function
+        self._value = 0
+
+    @property
+    def value(self) -> Union[int, float]:
+        """Return the current value."""
+        if self._function is not None:
+            return self._function()
+        return self._value
+
+    def dec(self, amount: Union[int, float] = 1) -> None:
+        """Decrease the value.
+
+        Args:
+            amount: The amount by which to decrease the value.
+        """
+        self._value -= amount
+
+    def inc(self, amount: Union[int, float] = 1) -> None:
+        """Increase the value.
+
+        Args:
+            amount: The amount by which to increase the value.
+        """
+        self._value += amount
+
+    def set(self, value: Union[int, float]) -> None:
+        """Set the value.
+
+        Args:
+            value: The new value.
+        """
+        self._value = value
+
+    def set_function(self, function: Optional[Callable[[], Any]]) -> None:
+        """Set the function used to get the current value.
+
+        Args:
+            function: A callable that will be called to get the current
+                value. If None, the value set directly will be used.
+        """
+        self._function = function
+
+    def snapshot(self) -> Union[int, float]:
+        """Return the current value."""
+        return self.value
+
+
+class Histogram:
+    """A distribution of observed values.
+
+    Observations are counted in buckets rather than stored so that the
+    memory used by a histogram never grows.
+
+    Args:
+        buckets: The upper bounds of the buckets in ascending order.
+            Values larger than the last bound are counted in an
+            additional, unbounded bucket.
+    """
+
+    __slots__ = ("buckets", "count", "counts", "sum")
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        """Initialize the instance."""
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        """Record an observation.
+
+        Args:
+            value: The observed value.
+        """
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """Return an estimate of a percentile of the observed values.
+
+        The estimate is the upper bound of the bucket containing the
+        percentile. If the percentile falls in the unbounded bucket, the
+        last bound is returned.
+
+        Args:
+            percent: The percentile to estimate, between 0 and 100.
+
+        Returns:
+            The estimate, or None if nothing has been observed.
+        """
+        if not self.count:
+            return None
+
+        rank = self.count * percent / 100
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return self.buckets[-1]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the current state of the histogram."""
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "buckets": dict(zip(map(str, self.buckets + ("+Inf",)), self.counts)),
+        }
+
+
+class Metrics:
+    """A registry of metrics.
+
+    Metrics are created the first time they are requested and the same
+    instance is returned every time after that.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the instance."""
+        self._metrics: Dict[str, Union[Counter, Gauge, Histogram]] = {}
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._metrics
+
+    def counter(self, name: str) -> Counter:
+        """Return a counter.
+
+        Args:
+            name: The name of the counter.
+
+        Returns:
+            The counter.
+        """
+        return self._get(name, Counter)
+
+    def gauge(self, name: str, function: Optional[Callable[[], Any]] = None) -> Gauge:
+        """Return a gauge.
+
+        Args:
+            name: The name of the gauge.
+            function: A callable that, if provided, will be used to get
+                the current value of the gauge.
+
+        Returns:
+            The gauge.
+        """
+        gauge = self._get(name, Gauge)
+        if function is not None:
+            gauge.set_function(function)
+        return gauge
+
+    def histogram(
+        self, name: str, buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        """Return a histogram.
+
+        Args:
+            name: The name of the histogram.
+            buckets: The upper bounds of the histogram's buckets. They
+                are only used when the histogram is first created.
+
+        Returns:
+            The histogram.
+        """
+        return self._get(name, Histogram, buckets)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the current value of every metric."""
+        return {
+            name: metric.snapshot() for name, metric in sorted(self._metrics.items())
+        }
+
+    def dump(self, path: str) -> None:
+        """Write the current value of every metric to a file as JSON.
+
+        The file is replaced atomically so that readers never see a
+        partially written file.
+
+        Args:
+            path: The path to the file.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".metrics-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def exposition(self) -> str:
+        """Return every metric in the Prometheus text format."""
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            name = _metric_name(name)
+            if isinstance(metric, Histogram):
+                lines.append("# TYPE {} histogram".format(name))
+                total = 0
+                for bound, count in zip(metric.buckets + ("+Inf",), metric.counts):
+                    total += count
+                    lines.append('{}_bucket{{le="{}"}} {}'.format(name, bound, total))
+                lines.append("{}_sum {}".format(name, metric.sum))
+                lines.append("{}_count {}".format(name, metric.count))
+            else:
+                kind = "counter" if isinstance(metric, Counter) else "gauge"
+                lines.append("# TYPE {} {}".format(name, kind))
+                lines.append("{} {}".format(name, metric.value))
+        return "\n".join(lines) + "\n"
+
+    async def serve(self, host: str, port: int) -> asyncio.AbstractServer:
+        """Serve the metrics over HTTP.
+
+        Every request, regardless of its path, will receive the
+        Prometheus text format.
+
+        Args:
+            host: The host on which to listen.
+            port: The port on which to listen.
+
+        Returns:
+            The server.
+        """
+
+        async def respond(reader, writer):
+            # Wait for the end of the request's headers before
+            # responding.
+            while (await reader.readline()).strip():
+                pass
+
+            body = self.exposition().encode()
+            writer.write(
+                b"HTTP/1.0 200 OK\r\n"
+                b"Content-Type: text/plain; version=0.0.4\r\n"
+                b"Content-Length: %d\r\n\r\n%s" % (len(body), body)
+            )
+            await writer.drain()
+            writer.close()
+
+        return await asyncio.start_server(respond, host, port)
+
+    def _get(self, name, kind, *args):
+        """Return the named metric, creating it if necessary."""
+        try:
+            metric = self._metrics[name]
+        except KeyError:
+            metric = self._metrics[name] = kind(*args)
+        else:
+            if not isinstance(metric, kind):
+                raise TypeError(
+                    "{} is a {}, not a {}.".format(
+                        name, type(metric).__name__, kind.__name__
+                    )
+                )
+        return metric
+
+
+def _metric_name(name: str) -> str:
+    """Return a name that's valid in the Prometheus text format."""
+    return "doozer_" + "".join(c if c.isalnum() else "_" for c in name)
@@ -1,9 +1,9 @@
 """Custom types for static type analysis."""
 from __future__ import annotations
 
-from typing import Any, Awaitable, Callable, Protocol
+from typing import Any, Awaitable, Callable, List, Protocol
 
-__all__ = ("Callback", "Consumer")
+__all__ = ("BatchConsumer", "Callback", "Consumer", "PausableConsumer")
 
 
 Callback = Callable[..., Awaitable]
@@ -16,3 +16,20 @@ class Consumer(Protocol):
 
     async def read(self) -> Any:
         """The read method of the Consumer Interface."""  # NOQA: D401
+
+
+class BatchConsumer(Consumer, Protocol):
+    """An implementation of the Consumer Interface that reads in batches."""
+
+    async def read_many(self, max_count: int, max_wait: float) -> List[Any]:
+        """The read_many method of the Consumer Interface."""  # NOQA: D401
+
+
+class PausableConsumer(Consumer, Protocol):
+    """An implementation of the Consumer Interface that can be paused."""
+
+    def pause(self) -> None:
+        """The pause method of the Consumer Interface."""  # NOQA: D401
+
+    def resume(self) -> None:
+        """The resume method of the Consumer Interface."""  # NOQA: D401
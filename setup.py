@@ -32,7 +32,7 @@ setup(
     description="A framework for running a Python service driven by a consumer",
     long_description=read("README.rst"),
     license="MIT",
-    packages=find_packages(exclude=["tests"]),
+    packages=find_packages(exclude=["benchmarks", "tests"]),
     zip_safe=False,
     python_requires=">=3.8",
     install_requires=[
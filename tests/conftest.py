@@ -35,6 +35,25 @@ class MockConsumer:
         return 1
 
 
+class MockBatchConsumer:
+    """A stub consumer that reads in batches and then raises Abort."""
+
+    def __init__(self):
+        """Initialize the instance."""
+        self.batches = [[1, 2, 3], [4, 5]]
+
+    async def read(self):
+        """Return an item."""
+        raise NotImplementedError
+
+    async def read_many(self, max_count, max_wait):
+        """Return a batch of items."""
+        if not self.batches:
+            raise Abort("testing", {})
+
+        return self.batches.pop(0)[:max_count]
+
+
 class MockAbortingConsumer:
     """A stub consumer that will raise Abort."""
 
@@ -100,3 +119,9 @@ def test_consumer():
 def test_consumer_with_abort():
     """Return a test consumer."""
     return MockAbortingConsumer()
+
+
+@pytest.fixture
+def test_batch_consumer():
+    """Return a test consumer that reads in batches."""
+    return MockBatchConsumer()
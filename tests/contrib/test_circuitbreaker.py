@@ -0,0 +1,228 @@
+"""Test for doozer.contrib.circuitbreaker."""
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+from doozer.base import Application
+from doozer.contrib import circuitbreaker
+from doozer.exceptions import Abort
+
+
+class DownstreamError(Exception):
+    """An exception raised when a dependency is down."""
+
+
+async def process(app, message, exc=None):
+    """Run a message through the breaker's callbacks."""
+    try:
+        for callback in app._callbacks["message_preprocessor"]:
+            message = await callback(app, message)
+        if exc is not None:
+            raise exc
+    except Exception as e:
+        for callback in app._callbacks["error"]:
+            try:
+                await callback(app, message, e)
+            except Abort:
+                break
+        raised = e
+    else:
+        raised = None
+    finally:
+        for callback in app._callbacks["message_acknowledgement"]:
+            await callback(app, message)
+    return raised
+
+
+@pytest.fixture
+def breaker(test_app):
+    """Return a circuit breaker that opens quickly."""
+    test_app.settings["CIRCUIT_BREAKER_EXCEPTIONS"] = {DownstreamError: 0.5}
+    test_app.settings["CIRCUIT_BREAKER_MIN_CALLS"] = 4
+    test_app.settings["CIRCUIT_BREAKER_PROBES"] = 2
+    test_app.settings["CIRCUIT_BREAKER_RESET_TIMEOUT"] = 0.01
+    test_app.settings["CIRCUIT_BREAKER_WINDOW"] = 4
+    return circuitbreaker.CircuitBreaker(test_app)
+
+
+def test_callback_insertion(test_app, coroutine):
+    """Test that the callbacks are properly registered."""
+    test_app.message_preprocessor(coroutine)
+    test_app.error(coroutine)
+
+    breaker = circuitbreaker.CircuitBreaker(test_app)
+
+    assert test_app._callbacks["message_preprocessor"][0] == breaker._before
+    assert test_app._callbacks["error"][0] == breaker._record_failure
+    assert test_app._callbacks["message_acknowledgement"] == [breaker._after]
+
+
+@pytest.mark.parametrize(
+    "setting, value",
+    (
+        ("CIRCUIT_BREAKER_EXCEPTIONS", {Exception: 0}),
+        ("CIRCUIT_BREAKER_EXCEPTIONS", {Exception: 1.5}),
+        ("CIRCUIT_BREAKER_MIN_CALLS", 0),
+        ("CIRCUIT_BREAKER_MODE", "ignore"),
+        ("CIRCUIT_BREAKER_PROBES", 0),
+        ("CIRCUIT_BREAKER_WINDOW", 0),
+    ),
+)
+def test_invalid_setting_valueerror(test_app, setting, value):
+    """Test ValueError is raised for invalid settings."""
+    test_app.settings[setting] = value
+    with pytest.raises(ValueError):
+        circuitbreaker.CircuitBreaker(test_app)
+
+
+@pytest.mark.asyncio
+async def test_opens(test_app, breaker):
+    """Test that the circuit opens once the failure rate is reached."""
+    await process(test_app, {}, DownstreamError())
+    await process(test_app, {})
+    await process(test_app, {})
+    assert breaker.state == circuitbreaker.CLOSED
+
+    await process(test_app, {}, DownstreamError())
+    assert breaker.state == circuitbreaker.OPEN
+
+    exc = await process(test_app, {})
+    assert isinstance(exc, circuitbreaker.CircuitOpenError)
+    assert test_app.metrics.counter("circuit_breaker.rejected").value == 1
+    assert test_app.metrics.gauge("circuit_breaker.state").value == 2
+
+
+@pytest.mark.asyncio
+async def test_rate_per_exception_class(test_app, breaker):
+    """Test that failure rates are tracked for each exception class."""
+    test_app.settings["CIRCUIT_BREAKER_EXCEPTIONS"] = {
+        DownstreamError: 0.5,
+        ValueError: 0.75,
+    }
+
+    await process(test_app, {})
+    await process(test_app, {})
+    await process(test_app, {}, ValueError())
+    await process(test_app, {}, ValueError())
+    await process(test_app, {}, TypeError())
+
+    assert breaker.state == circuitbreaker.CLOSED
+
+    await process(test_app, {}, DownstreamError())
+    await process(test_app, {}, DownstreamError())
+
+    assert breaker.state == circuitbreaker.OPEN
+
+
+@pytest.mark.asyncio
+async def test_closes_after_probes(test_app, breaker):
+    """Test that the circuit closes after probe messages succeed."""
+    for _ in range(4):
+        await process(test_app, {}, DownstreamError())
+    assert breaker.state == circuitbreaker.OPEN
+
+    await asyncio.sleep(0.02)
+    assert breaker.state == circuitbreaker.HALF_OPEN
+
+    await process(test_app, {})
+    assert breaker.state == circuitbreaker.HALF_OPEN
+
+    await process(test_app, {})
+    assert breaker.state == circuitbreaker.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_probe_failure_reopens(test_app, breaker):
+    """Test that the circuit opens again if a probe message fails."""
+    for _ in range(4):
+        await process(test_app, {}, DownstreamError())
+
+    await asyncio.sleep(0.02)
+    await process(test_app, {}, DownstreamError())
+
+    assert breaker.state == circuitbreaker.OPEN
+
+
+@pytest.mark.asyncio
+async def test_half_open_limits_probes(test_app, breaker):
+    """Test that only so many probe messages are let through at once."""
+    for _ in range(4):
+        await process(test_app, {}, DownstreamError())
+
+    await asyncio.sleep(0.02)
+    for callback in test_app._callbacks["message_preprocessor"]:
+        await callback(test_app, {})
+        await callback(test_app, {})
+        with pytest.raises(circuitbreaker.CircuitOpenError):
+            await callback(test_app, {})
+
+
+@pytest.mark.asyncio
+async def test_pause(test_app, breaker):
+    """Test that messages wait while the circuit is open."""
+    test_app.settings["CIRCUIT_BREAKER_MODE"] = "pause"
+
+    for _ in range(4):
+        await process(test_app, {}, DownstreamError())
+    assert breaker.state == circuitbreaker.OPEN
+    assert test_app._pause_reasons == {"circuit_breaker"}
+
+    exc = await asyncio.wait_for(process(test_app, {}), 1)
+
+    assert exc is None
+    assert breaker.state == circuitbreaker.HALF_OPEN
+    assert not test_app._pause_reasons
+
+
+def test_run_forever(event_loop):
+    """Test that the breaker stops the callback from being called."""
+    calls = 0
+
+    class Consumer:
+        messages = list(range(20))
+
+        async def read(self):
+            if not self.messages:
+                raise Abort("testing", None)
+            return self.messages.pop(0)
+
+    async def callback(app, message):
+        nonlocal calls
+        calls += 1
+        raise DownstreamError()
+
+    app = Application("testing", consumer=Consumer(), callback=callback)
+    app.settings["CIRCUIT_BREAKER_MIN_CALLS"] = 5
+    circuitbreaker.CircuitBreaker(app)
+
+    app.run_forever(loop=event_loop)
+
+    assert calls == 5
+    assert app.metrics.counter("circuit_breaker.rejected").value == 15
+
+
+def test_run_forever_with_timeout(event_loop):
+    """Test that the breaker works when messages have a deadline."""
+
+    class Consumer:
+        messages = list(range(30))
+
+        async def read(self):
+            if not self.messages:
+                raise Abort("testing", None)
+            return self.messages.pop(0)
+
+    async def callback(app, message):
+        raise DownstreamError()
+
+    app = Application("testing", consumer=Consumer(), callback=callback)
+    app.settings["CIRCUIT_BREAKER_MIN_CALLS"] = 5
+    app.settings["MESSAGE_TIMEOUT"] = 5
+    breaker = circuitbreaker.CircuitBreaker(app)
+
+    app.run_forever(loop=event_loop)
+
+    assert breaker.state == circuitbreaker.OPEN
+    assert app.metrics.counter("circuit_breaker.rejected").value == 25
@@ -0,0 +1,560 @@
+"""Test for doozer.contrib.consumers."""
+from __future__ import annotations
+
+import asyncio
+import json
+import mmap
+import os
+import signal
+import struct
+import sys
+
+import pytest
+
+from doozer.base import Application
+from doozer.contrib import consumers
+from doozer.exceptions import Abort
+
+
+def prefixed(*records):
+    """Return records with 2 byte length prefixes."""
+    return b"".join(struct.pack(">H", len(record)) + record for record in records)
+
+
+def test_line_framer():
+    """Test that complete lines are returned without their newlines."""
+    framer = consumers.LineFramer()
+    buffer = b"a\nbc\n\nd"
+
+    records, end = framer.frame(buffer, 0, len(buffer))
+
+    assert [bytes(record) for record in records] == [b"a", b"bc", b""]
+    assert end == 6
+    assert all(record.obj is buffer for record in records)
+    assert [bytes(r) for r in framer.final(buffer, end, len(buffer))] == [b"d"]
+    assert framer.final(buffer, len(buffer), len(buffer)) == []
+
+
+def test_line_framer_delimiter():
+    """Test that a custom delimiter can be used."""
+    framer = consumers.LineFramer(b"\r\n")
+    buffer = b"a\r\nb\nc\r\n"
+
+    records, end = framer.frame(buffer, 0, len(buffer))
+
+    assert [bytes(record) for record in records] == [b"a", b"b\nc"]
+    assert end == len(buffer)
+
+
+def test_line_framer_valueerror():
+    """Test ValueError is raised for an empty delimiter."""
+    with pytest.raises(ValueError):
+        consumers.LineFramer(b"")
+
+
+def test_length_prefix_framer():
+    """Test that complete records are returned without their prefixes."""
+    framer = consumers.LengthPrefixFramer(size=2)
+    buffer = prefixed(b"a", b"", b"bcd") + b"\x00\x05ef"
+
+    records, end = framer.frame(buffer, 0, len(buffer))
+
+    assert [bytes(record) for record in records] == [b"a", b"", b"bcd"]
+    assert end == 10
+    with pytest.raises(ValueError):
+        framer.final(buffer, end, len(buffer))
+
+
+def test_length_prefix_framer_little_endian():
+    """Test that prefixes can be little-endian."""
+    framer = consumers.LengthPrefixFramer(size=4, byteorder="little")
+    buffer = struct.pack("<I", 2) + b"ab"
+
+    records, end = framer.frame(buffer, 0, len(buffer))
+
+    assert [bytes(record) for record in records] == [b"ab"]
+
+
+@pytest.mark.parametrize("size, byteorder", ((3, "big"), (4, "middle")))
+def test_length_prefix_framer_valueerror(size, byteorder):
+    """Test ValueError is raised for invalid arguments."""
+    with pytest.raises(ValueError):
+        consumers.LengthPrefixFramer(size, byteorder)
+
+
+def test_reassembler():
+    """Test that records can span chunks."""
+    reassembler = consumers._Reassembler(consumers.LineFramer())
+
+    first = reassembler.feed(b"a\nb")
+    second = reassembler.feed(b"c\nd\n")
+
+    assert [bytes(record) for record in first + second] == [b"a", b"bc", b"d"]
+    assert reassembler.end() == []
+
+
+@pytest.mark.parametrize(
+    "framer, chunks, expected",
+    (
+        (
+            consumers.LineFramer(),
+            (b"ab", b"c", b"d\n" + b"e" * 1000 + b"\nf\n"),
+            [b"abcd", b"e" * 1000, b"f"],
+        ),
+        (
+            consumers.LineFramer(b"\r\n"),
+            (b"a\r", b"\nb\r\nc\r\n"),
+            [b"a", b"b", b"c"],
+        ),
+        (
+            consumers.LengthPrefixFramer(size=2),
+            (b"\x00", b"\x03ab", b"c\x00\x01d\x00\x00\x00\x01e"),
+            [b"abc", b"d", b"", b"e"],
+        ),
+    ),
+)
+def test_reassembler_only_copies_spanning_record(framer, chunks, expected):
+    """Test that records after one that spans chunks aren't copied."""
+    reassembler = consumers._Reassembler(framer)
+
+    records = []
+    for chunk in chunks:
+        records += reassembler.feed(chunk)
+
+    assert [bytes(record) for record in records] == expected
+    assert all(record.obj is chunks[-1] for record in records[1:])
+    assert reassembler.end() == []
+
+
+@pytest.mark.parametrize(
+    "framer, data, expected",
+    (
+        (consumers.LineFramer(b"\r\n"), b"ab\r\n\r\nc\r\n", [b"ab", b"", b"c"]),
+        (
+            consumers.LengthPrefixFramer(size=2),
+            prefixed(b"ab", b"", b"c"),
+            [b"ab", b"", b"c"],
+        ),
+    ),
+)
+def test_reassembler_one_byte_at_a_time(framer, data, expected):
+    """Test that records and delimiters can span many chunks."""
+    reassembler = consumers._Reassembler(framer)
+
+    records = []
+    for i in range(len(data)):
+        records += reassembler.feed(data[i : i + 1])
+
+    assert [bytes(record) for record in records] == expected
+    assert reassembler.end() == []
+
+
+@pytest.mark.parametrize(
+    "framer, pending, buffer, expected",
+    (
+        (consumers.LineFramer(), [b"ab"], b"cd", -1),
+        (consumers.LineFramer(), [b"ab"], b"c\nd", 2),
+        (consumers.LineFramer(b"\r\n"), [b"a", b"b\r"], b"\nc", 1),
+        (consumers.LineFramer(b"\r\n"), [b"ab"], b"\r\nc", 2),
+        (consumers.LengthPrefixFramer(size=2), [b"\x00"], b"\x03ab", -1),
+        (consumers.LengthPrefixFramer(size=2), [b"\x00", b"\x03a"], b"bcd", 2),
+    ),
+)
+def test_framer_resume(framer, pending, buffer, expected):
+    """Test that the end of a record started earlier is found."""
+    size = sum(len(part) for part in pending)
+    assert framer.resume(pending, size, buffer, len(buffer)) == expected
+
+
+async def read_all(consumer):
+    """Return every record left in the consumer as bytes."""
+    records = []
+    with pytest.raises(Abort):
+        while True:
+            records += await consumer.read_many(10, 0)
+    return [bytes(record) for record in records]
+
+
+@pytest.mark.asyncio
+async def test_mmap_consumer(tmp_path):
+    """Test that records are slices of the mapped file."""
+    path = tmp_path / "messages.txt"
+    path.write_bytes(b"first\nsecond\nlast")
+    consumer = consumers.MmapConsumer(str(path))
+
+    record = await consumer.read()
+    assert bytes(record) == b"first"
+    assert isinstance(record.obj, mmap.mmap)
+    assert await read_all(consumer) == [b"second", b"last"]
+    assert consumer.offset == len(b"first\nsecond\nlast")
+
+    del record
+    await consumer.close()
+
+
+@pytest.mark.asyncio
+async def test_mmap_consumer_small_window(tmp_path):
+    """Test that records longer than the window are found."""
+    path = tmp_path / "messages.bin"
+    path.write_bytes(prefixed(b"a" * 100, b"b", b"c" * 50))
+    consumer = consumers.MmapConsumer(
+        str(path), framer=consumers.LengthPrefixFramer(size=2), window=8
+    )
+
+    assert await read_all(consumer) == [b"a" * 100, b"b", b"c" * 50]
+    await consumer.close()
+
+
+@pytest.mark.asyncio
+async def test_mmap_consumer_empty(tmp_path):
+    """Test that an empty file has no records."""
+    path = tmp_path / "messages.txt"
+    path.write_bytes(b"")
+    consumer = consumers.MmapConsumer(str(path))
+
+    assert await read_all(consumer) == []
+    await consumer.close()
+
+
+@pytest.mark.asyncio
+async def test_mmap_consumer_checkpoint(tmp_path):
+    """Test that a new consumer resumes from the checkpoint."""
+    path = tmp_path / "messages.txt"
+    path.write_bytes(b"a\nb\nc\n")
+    checkpoint = str(tmp_path / "checkpoint")
+
+    consumer = consumers.MmapConsumer(str(path), checkpoint=checkpoint, window=2)
+    assert bytes(await consumer.read()) == b"a"
+    assert bytes(await consumer.read()) == b"b"
+    await consumer.close()
+
+    with open(checkpoint) as f:
+        assert json.load(f)["offset"] == 4
+
+    consumer = consumers.MmapConsumer(str(path), checkpoint=checkpoint)
+    assert await read_all(consumer) == [b"c"]
+    await consumer.close()
+
+    consumer = consumers.MmapConsumer(str(path), checkpoint=checkpoint)
+    assert await read_all(consumer) == []
+    await consumer.close()
+
+
+@pytest.mark.asyncio
+async def test_mmap_consumer_checkpoint_periodically(tmp_path):
+    """Test that checkpoints are saved while records are read."""
+    path = tmp_path / "messages.txt"
+    path.write_bytes(b"a\nb\nc\n")
+    checkpoint = tmp_path / "checkpoint"
+    consumer = consumers.MmapConsumer(
+        str(path), checkpoint=str(checkpoint), checkpoint_interval=0.01, window=2
+    )
+
+    await consumer.read()
+    assert not checkpoint.exists()
+
+    await asyncio.sleep(0.02)
+    await consumer.read()
+    assert json.loads(checkpoint.read_text())["offset"] == 2
+
+    await consumer.close()
+
+
+@pytest.mark.asyncio
+async def test_mmap_consumer_checkpoint_replaced_file(tmp_path):
+    """Test that a replaced file is read from the start."""
+    path = tmp_path / "messages.txt"
+    path.write_bytes(b"a\nb\n")
+    checkpoint = str(tmp_path / "checkpoint")
+
+    consumer = consumers.MmapConsumer(str(path), checkpoint=checkpoint)
+    assert await read_all(consumer) == [b"a", b"b"]
+    await consumer.close()
+
+    replacement = tmp_path / "replacement.txt"
+    replacement.write_bytes(b"c\nd\n")
+    replacement.replace(path)
+
+    consumer = consumers.MmapConsumer(str(path), checkpoint=checkpoint)
+    assert await read_all(consumer) == [b"c", b"d"]
+    await consumer.close()
+
+
+@pytest.mark.asyncio
+async def test_mmap_consumer_require_acknowledgement(tmp_path):
+    """Test that only acknowledged records are checkpointed."""
+    path = tmp_path / "messages.txt"
+    path.write_bytes(b"a\nb\nc\n")
+    checkpoint = str(tmp_path / "checkpoint")
+
+    consumer = consumers.MmapConsumer(
+        str(path), checkpoint=checkpoint, require_acknowledgement=True, window=2
+    )
+    first, second, third = [await consumer.read() for _ in range(3)]
+    await consumer.acknowledge(None, first)
+    await consumer.acknowledge(None, [third])
+    assert consumer.offset == 2
+
+    del first, second, third
+    await consumer.close()
+
+    consumer = consumers.MmapConsumer(str(path), checkpoint=checkpoint)
+    assert await read_all(consumer) == [b"b", b"c"]
+    await consumer.close()
+
+
+@pytest.mark.asyncio
+async def test_queue_consumer():
+    """Test that messages are read from the queue until it's closed."""
+    consumer = consumers.QueueConsumer()
+    for message in range(3):
+        await consumer.put(message)
+    await consumer.close()
+
+    assert await consumer.read() == 0
+    assert await consumer.read_many(5, 0.01) == [1, 2]
+
+    with pytest.raises(Abort):
+        await consumer.read()
+    with pytest.raises(Abort):
+        await consumer.read_many(5, 0.01)
+
+
+@pytest.mark.asyncio
+async def test_queue_consumer_read_many_waits():
+    """Test that read_many waits for more messages."""
+    consumer = consumers.QueueConsumer(asyncio.Queue())
+    await consumer.put(1)
+
+    async def put_later():
+        await asyncio.sleep(0.01)
+        await consumer.put(2)
+
+    task = asyncio.ensure_future(put_later())
+    assert await consumer.read_many(2, 1) == [1, 2]
+    await task
+
+
+@pytest.mark.asyncio
+async def test_queue_consumer_read_many_cancelled():
+    """Test that messages already read are returned when cancelled."""
+    consumer = consumers.QueueConsumer(asyncio.Queue())
+    for message in range(3):
+        await consumer.put(message)
+
+    task = asyncio.ensure_future(consumer.read_many(10, 5))
+    await asyncio.sleep(0.01)
+    task.cancel()
+
+    assert await task == [0, 1, 2]
+    assert consumer.queue.empty()
+
+
+def test_queue_consumer_stopped(event_loop):
+    """Test that messages being batched are processed when stopping."""
+    processed = []
+
+    consumer = consumers.QueueConsumer()
+
+    async def callback(app, message):
+        processed.append(message)
+
+    async def stop():
+        for message in range(3):
+            await consumer.put(message)
+        await asyncio.sleep(0.01)
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    app = Application("testing", consumer=consumer, callback=callback)
+    app.settings["BATCH_SIZE"] = 10
+    app.settings["BATCH_WAIT"] = 5
+
+    @app.startup
+    async def start(app):
+        asyncio.ensure_future(stop())
+
+    app.run_forever(loop=event_loop)
+
+    assert processed == [0, 1, 2]
+    assert app.metrics.counter("messages.abandoned").value == 0
+
+
+@pytest.mark.asyncio
+async def test_file_consumer(tmp_path):
+    """Test that records are read from the file in chunks."""
+    path = tmp_path / "messages.txt"
+    path.write_bytes(b"first\nsecond\nthird\nlast")
+    consumer = consumers.FileConsumer(str(path), chunk_size=4)
+
+    assert bytes(await consumer.read()) == b"first"
+    records = []
+    with pytest.raises(Abort):
+        while True:
+            records += await consumer.read_many(10, 0)
+
+    assert [bytes(record) for record in records] == [b"second", b"third", b"last"]
+    assert consumer._file is None
+
+
+@pytest.mark.asyncio
+async def test_file_consumer_follow(tmp_path):
+    """Test that records appended to a followed file are read."""
+    path = tmp_path / "messages.txt"
+    path.write_bytes(b"first\n")
+    consumer = consumers.FileConsumer(str(path), follow=True, poll_interval=0.01)
+
+    assert bytes(await consumer.read()) == b"first"
+
+    read = asyncio.ensure_future(consumer.read())
+    await asyncio.sleep(0.02)
+    assert not read.done()
+
+    with path.open("ab") as f:
+        f.write(b"second\n")
+    assert bytes(await asyncio.wait_for(read, 1)) == b"second"
+
+    # Start over once the file is truncated.
+    path.write_bytes(b"new\n")
+    assert bytes(await asyncio.wait_for(consumer.read(), 1)) == b"new"
+
+    await consumer.close()
+
+
+@pytest.mark.asyncio
+async def test_socket_consumer():
+    """Test that records are read from every connection."""
+    consumer = consumers.SocketConsumer("127.0.0.1", 0)
+    await consumer.start()
+    port = consumer.sockets[0].getsockname()[1]
+
+    _, first = await asyncio.open_connection("127.0.0.1", port)
+    _, second = await asyncio.open_connection("127.0.0.1", port)
+    first.write(b"a\nb")
+    await first.drain()
+    assert bytes(await asyncio.wait_for(consumer.read(), 1)) == b"a"
+
+    second.write(b"c\n")
+    await second.drain()
+    assert bytes(await asyncio.wait_for(consumer.read(), 1)) == b"c"
+
+    first.write(b"c\n")
+    first.close()
+    assert bytes(await asyncio.wait_for(consumer.read(), 1)) == b"bc"
+
+    second.close()
+    await consumer.close()
+    with pytest.raises(Abort):
+        await consumer.read_many(10, 0.01)
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="Unix sockets are unavailable")
+@pytest.mark.asyncio
+async def test_socket_consumer_unix(tmp_path):
+    """Test that records can be read from a Unix socket."""
+    path = str(tmp_path / "doozer.sock")
+    consumer = consumers.SocketConsumer(
+        path=path, framer=consumers.LengthPrefixFramer(size=2)
+    )
+    await consumer.start()
+
+    _, writer = await asyncio.open_unix_connection(path)
+    writer.write(prefixed(b"a", b"b"))
+    writer.close()
+
+    records = await asyncio.wait_for(consumer.read_many(2, 1), 1)
+    assert [bytes(record) for record in records] == [b"a", b"b"]
+
+    await consumer.close()
+
+
+@pytest.mark.asyncio
+async def test_socket_consumer_pause():
+    """Test that connections aren't read from while paused."""
+    consumer = consumers.SocketConsumer("127.0.0.1", 0)
+    await consumer.start()
+    port = consumer.sockets[0].getsockname()[1]
+    consumer.pause()
+
+    _, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"a\n")
+    await writer.drain()
+
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(consumer.read(), 0.05)
+
+    consumer.resume()
+    assert bytes(await asyncio.wait_for(consumer.read(), 1)) == b"a"
+
+    writer.close()
+    await consumer.close()
+
+
+@pytest.mark.asyncio
+async def test_subprocess_consumer():
+    """Test that records are read from the subprocess's output."""
+    consumer = consumers.SubprocessConsumer(
+        [sys.executable, "-c", "print('a'); print('b')"]
+    )
+
+    records = []
+    with pytest.raises(Abort):
+        while True:
+            records += await consumer.read_many(10, 0)
+
+    assert [bytes(record) for record in records] == [b"a", b"b"]
+    assert consumer.returncode == 0
+
+
+def test_run_forever(event_loop, tmp_path):
+    """Test that an application can read records from a file."""
+    path = tmp_path / "messages.txt"
+    path.write_bytes(b"".join(b"%d\n" % i for i in range(100)))
+    processed = []
+
+    async def callback(app, message):
+        processed.append(int(message))
+
+    app = Application(
+        "testing",
+        consumer=consumers.FileConsumer(str(path), chunk_size=64),
+        callback=callback,
+    )
+    app.settings["BATCH_SIZE"] = 10
+
+    app.run_forever(num_workers=4, loop=event_loop)
+
+    assert sorted(processed) == list(range(100))
+
+
+def test_run_forever_mmap(event_loop, tmp_path):
+    """Test that a restarted application resumes from the checkpoint."""
+    path = tmp_path / "messages.txt"
+    path.write_bytes(b"".join(b"%d\n" % i for i in range(100)))
+    checkpoint = str(tmp_path / "checkpoint")
+    processed = []
+
+    async def callback(app, message):
+        processed.append(int(message))
+
+    def create_app():
+        consumer = consumers.MmapConsumer(
+            str(path), checkpoint=checkpoint, require_acknowledgement=True, window=64
+        )
+        app = Application("testing", consumer=consumer, callback=callback)
+        app.settings["MESSAGE_COPY"] = "none"
+        app.message_acknowledgement(consumer.acknowledge)
+
+        @app.teardown
+        async def close(app):
+            await app.consumer.close()
+
+        return app
+
+    create_app().run_forever(loop=event_loop)
+    assert sorted(processed) == list(range(100))
+
+    path.write_bytes(path.read_bytes() + b"".join(b"%d\n" % i for i in range(100, 110)))
+    processed.clear()
+
+    create_app().run_forever(loop=asyncio.new_event_loop())
+    assert sorted(processed) == list(range(100, 110))
@@ -0,0 +1,195 @@
+"""Test for doozer.contrib.deadletter."""
+from __future__ import annotations
+
+import json
+
+import pytest
+
+from doozer.base import Application
+from doozer.contrib import deadletter, retry
+from doozer.exceptions import Abort
+
+
+class ListSink:
+    """A sink that keeps each batch of dead letters."""
+
+    def __init__(self):
+        """Initialize the instance."""
+        self.batches = []
+        self.closed = False
+
+    async def close(self):
+        """Mark the sink as closed."""
+        self.closed = True
+
+    async def write(self, dead_letters):
+        """Keep the batch."""
+        self.batches.append(dead_letters)
+
+
+@pytest.fixture
+def sink(test_app):
+    """Return a sink for the test application."""
+    sink = ListSink()
+    test_app.settings["DEAD_LETTER_SINK"] = sink
+    return sink
+
+
+def test_dead_letter():
+    """Test that a dead letter records the message and exception."""
+    try:
+        raise ValueError("testing")
+    except ValueError as e:
+        dead_letter = deadletter._dead_letter({"_retry": {"count": 2}}, e)
+
+    assert dead_letter["message"] == {"_retry": {"count": 2}}
+    assert dead_letter["exception"]["type"] == "builtins.ValueError"
+    assert dead_letter["exception"]["message"] == "testing"
+    assert 'raise ValueError("testing")' in dead_letter["exception"]["traceback"]
+    assert dead_letter["retry"] == {"count": 2}
+    assert isinstance(dead_letter["failed_at"], float)
+
+
+def test_callback_insertion(test_app, coroutine, sink):
+    """Test that the callback is registered as the last error callback."""
+    test_app.error(coroutine)
+
+    extension = deadletter.DeadLetter(test_app)
+
+    assert test_app._callbacks["error"] == [coroutine, extension._record]
+
+
+@pytest.mark.parametrize(
+    "setting, value, exception",
+    (
+        ("DEAD_LETTER_BATCH_SIZE", 0, ValueError),
+        ("DEAD_LETTER_BATCH_WAIT", 0, ValueError),
+        ("DEAD_LETTER_SINK", object(), TypeError),
+    ),
+)
+def test_invalid_settings(test_app, sink, setting, value, exception):
+    """Test that invalid settings raise exceptions."""
+    test_app.settings[setting] = value
+    with pytest.raises(exception):
+        deadletter.DeadLetter(test_app)
+
+
+def test_callback_sink_typeerror():
+    """Test TypeError is raised if the callback isn't a coroutine."""
+    with pytest.raises(TypeError):
+        deadletter.CallbackSink(print)
+
+
+@pytest.mark.asyncio
+async def test_batches(test_app, sink):
+    """Test that dead letters are written in batches."""
+    test_app.settings["DEAD_LETTER_BATCH_SIZE"] = 2
+    extension = deadletter.DeadLetter(test_app)
+
+    for i in range(5):
+        await extension._record(test_app, i, ValueError())
+
+    assert [[d["message"] for d in batch] for batch in sink.batches] == [
+        [0, 1],
+        [2, 3],
+    ]
+    assert test_app.metrics.gauge("dead_letters.pending").value == 1
+    assert test_app.metrics.counter("messages.dead_lettered").value == 4
+
+
+@pytest.mark.asyncio
+async def test_exceptions(test_app, sink):
+    """Test that only the configured exceptions are recorded."""
+    test_app.settings["DEAD_LETTER_EXCEPTIONS"] = ValueError
+    extension = deadletter.DeadLetter(test_app)
+
+    await extension._record(test_app, 1, TypeError())
+    await extension._record(test_app, 2, ValueError())
+    await extension._flush()
+
+    assert [d["message"] for d in sink.batches[0]] == [2]
+
+
+@pytest.mark.asyncio
+async def test_sink_exception(test_app, caplog):
+    """Test that a batch the sink fails to write is logged and dropped."""
+
+    async def callback(dead_letters):
+        raise OSError()
+
+    test_app.settings["DEAD_LETTER_SINK"] = deadletter.CallbackSink(callback)
+    extension = deadletter.DeadLetter(test_app)
+
+    await extension._record(test_app, 1, ValueError())
+    await extension._flush()
+
+    assert "dead_letters.failed" in caplog.messages
+    assert test_app.metrics.counter("dead_letters.failed").value == 1
+    assert test_app.metrics.gauge("dead_letters.pending").value == 0
+
+
+@pytest.mark.asyncio
+async def test_file_sink(tmp_path):
+    """Test that dead letters are appended to the file as JSON lines."""
+    path = tmp_path / "dead_letters.jsonl"
+    sink = deadletter.FileSink(str(path))
+
+    await sink.write([{"message": 1}, {"message": object}])
+    await sink.write([{"message": 3}])
+    await sink.close()
+
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert lines == [
+        {"message": 1},
+        {"message": "<class 'object'>"},
+        {"message": 3},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_file_sink_rotates(tmp_path):
+    """Test that the file is rotated once it's too big."""
+    path = tmp_path / "dead_letters.jsonl"
+    sink = deadletter.FileSink(str(path), max_bytes=20, backup_count=2)
+
+    for i in range(4):
+        await sink.write([{"message": i}])
+    await sink.close()
+
+    assert path.read_text() == '{"message": 3}\n'
+    assert (tmp_path / "dead_letters.jsonl.1").read_text() == '{"message": 2}\n'
+    assert (tmp_path / "dead_letters.jsonl.2").read_text() == '{"message": 1}\n'
+    assert not (tmp_path / "dead_letters.jsonl.3").exists()
+
+
+def test_run_forever(event_loop):
+    """Test that messages that exhaust their retries are recorded."""
+    sink = ListSink()
+    retried = []
+
+    class Consumer:
+        messages = [{"id": 1}, {"id": 2}]
+
+        async def read(self):
+            if not self.messages:
+                raise Abort("testing", None)
+            return self.messages.pop(0)
+
+    async def callback(app, message):
+        raise retry.RetryableException()
+
+    async def retry_callback(app, message):
+        retried.append(message["id"])
+
+    app = Application("testing", consumer=Consumer(), callback=callback)
+    app.settings["RETRY_CALLBACK"] = retry_callback
+    app.settings["RETRY_THRESHOLD"] = 0
+    app.settings["DEAD_LETTER_SINK"] = sink
+    retry.Retry(app)
+    deadletter.DeadLetter(app)
+
+    app.run_forever(loop=event_loop)
+
+    assert not retried
+    assert [d["message"]["id"] for d in sink.batches[0]] == [1, 2]
+    assert sink.closed
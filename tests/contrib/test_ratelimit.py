@@ -0,0 +1,162 @@
+"""Test for doozer.contrib.ratelimit."""
+from __future__ import annotations
+
+import asyncio
+import time
+
+import pytest
+
+from doozer.base import Application
+from doozer.contrib import ratelimit
+from doozer.exceptions import Abort
+
+
+@pytest.mark.parametrize(
+    "burst, expected",
+    ((1, [0, 0.5, 1, 1.5]), (2, [0, 0, 0.5, 1]), (3, [0, 0, 0, 0.5])),
+)
+def test_token_bucket(burst, expected):
+    """Test that tokens are handed out at a steady pace after a burst."""
+    bucket = ratelimit.TokenBucket(rate=2, burst=burst)
+    assert [bucket.reserve(10) - 10 for _ in range(4)] == expected
+
+
+def test_token_bucket_refills():
+    """Test that the bucket refills while it isn't used."""
+    bucket = ratelimit.TokenBucket(rate=2, burst=2)
+    assert [bucket.reserve(10) for _ in range(3)] == [10, 10, 10.5]
+    assert [bucket.reserve(12) for _ in range(3)] == [12, 12, 12.5]
+
+
+def test_token_bucket_reserve_later():
+    """Test that a token can be reserved for later."""
+    bucket = ratelimit.TokenBucket(rate=2)
+    assert bucket.reserve(11) == 11
+    assert bucket.reserve(10) == 11.5
+
+
+def test_callback_insertion(test_app, coroutine):
+    """Test that the callback is registered as the last preprocessor."""
+    test_app.message_preprocessor(coroutine)
+    test_app.settings["RATE_LIMIT"] = 10
+
+    limit = ratelimit.RateLimit(test_app)
+
+    assert test_app._callbacks["message_preprocessor"] == [coroutine, limit._limit]
+
+
+@pytest.mark.parametrize(
+    "settings, exception",
+    (
+        ({}, ValueError),
+        ({"RATE_LIMIT": 0}, ValueError),
+        ({"RATE_LIMIT": 10, "RATE_LIMIT_BURST": 0}, ValueError),
+        ({"RATE_LIMIT_PER_KEY": 10}, TypeError),
+        (
+            {"RATE_LIMIT_PER_KEY": 10, "RATE_LIMIT_KEY": len, "RATE_LIMIT_MAX_KEYS": 0},
+            ValueError,
+        ),
+    ),
+)
+def test_invalid_settings(test_app, settings, exception):
+    """Test that invalid settings raise exceptions."""
+    test_app.settings.update(settings)
+    with pytest.raises(exception):
+        ratelimit.RateLimit(test_app)
+
+
+@pytest.mark.asyncio
+async def test_limit(test_app):
+    """Test that messages wait for a token."""
+    test_app.settings["RATE_LIMIT"] = 100
+    limit = ratelimit.RateLimit(test_app)
+
+    started = time.perf_counter()
+    for i in range(5):
+        assert await limit._limit(test_app, i) == i
+
+    assert time.perf_counter() - started >= 0.035
+    assert test_app.metrics.counter("rate_limit.delayed").value == 4
+
+
+@pytest.mark.asyncio
+async def test_limit_per_key(test_app):
+    """Test that each key has its own limit."""
+    test_app.settings["RATE_LIMIT_PER_KEY"] = 1
+    test_app.settings["RATE_LIMIT_KEY"] = lambda message: message["key"]
+    test_app.settings["RATE_LIMIT_MAX_KEYS"] = 2
+    limit = ratelimit.RateLimit(test_app)
+
+    for key in ("a", "b", "c"):
+        await asyncio.wait_for(limit._limit(test_app, {"key": key}), 0.1)
+
+    assert list(limit._buckets) == ["b", "c"]
+    assert test_app.metrics.counter("rate_limit.delayed").value == 0
+
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(limit._limit(test_app, {"key": "c"}), 0.1)
+
+
+@pytest.mark.asyncio
+async def test_pauses_consumption(test_app):
+    """Test that consumption is paused while every worker is waiting."""
+    test_app.metrics.gauge("workers.total").set(2)
+    test_app.settings["RATE_LIMIT"] = 50
+    limit = ratelimit.RateLimit(test_app)
+
+    await limit._limit(test_app, 1)
+    second = asyncio.ensure_future(limit._limit(test_app, 2))
+    await asyncio.sleep(0)
+    assert not test_app._pause_reasons
+
+    third = asyncio.ensure_future(limit._limit(test_app, 3))
+    await asyncio.sleep(0)
+    assert test_app._pause_reasons == {"rate_limit"}
+
+    await asyncio.gather(second, third)
+    assert not test_app._pause_reasons
+
+
+def test_run_forever(event_loop):
+    """Test that messages are processed at the limited rate."""
+    processed = []
+
+    class Consumer:
+        messages = list(range(6))
+
+        async def read(self):
+            if not self.messages:
+                raise Abort("testing", None)
+            return self.messages.pop(0)
+
+    async def callback(app, message):
+        processed.append(time.perf_counter())
+
+    app = Application("testing", consumer=Consumer(), callback=callback)
+    app.settings["RATE_LIMIT"] = 50
+    ratelimit.RateLimit(app)
+
+    app.run_forever(num_workers=3, loop=event_loop)
+
+    assert len(processed) == 6
+    assert processed[-1] - processed[0] >= 0.09
+
+
+@pytest.mark.asyncio
+async def test_limit_per_key_doesnt_hold_up_other_keys(test_app):
+    """Test that a throttled key doesn't delay messages with other keys."""
+    test_app.settings["RATE_LIMIT"] = 500
+    test_app.settings["RATE_LIMIT_PER_KEY"] = 1
+    test_app.settings["RATE_LIMIT_KEY"] = lambda message: message["key"]
+    limit = ratelimit.RateLimit(test_app)
+
+    await limit._limit(test_app, {"key": "a"})
+    throttled = asyncio.ensure_future(limit._limit(test_app, {"key": "a"}))
+    await asyncio.sleep(0.01)
+
+    await asyncio.wait_for(limit._limit(test_app, {"key": "b"}), 0.1)
+    assert not throttled.done()
+
+    throttled.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await throttled
@@ -3,10 +3,13 @@ from __future__ import annotations
 
 import asyncio
 from contextlib import suppress
+import json
 import time
+from unittest import mock
 
 import pytest
 
+from doozer.base import Application
 from doozer.contrib import retry
 from doozer.exceptions import Abort
 
@@ -31,6 +34,103 @@ def test_calculate_delay(delay, backoff, count, expected):
     assert actual == expected
 
 
+@pytest.mark.parametrize("count, expected", ((0, 1), (3, 8), (4, 10), (5000, 10)))
+def test_calculate_delay_max_delay(count, expected):
+    """Test that the delay is capped."""
+    actual = retry._calculate_delay(1, 2, count, max_delay=10)
+    assert actual == expected
+
+
+@pytest.mark.parametrize("count, upper", ((0, 1), (3, 8), (10, 10)))
+def test_calculate_delay_full_jitter(count, upper):
+    """Test the full jitter strategy."""
+    delays = [
+        retry._calculate_delay(1, 2, count, max_delay=10, strategy="full_jitter")
+        for _ in range(100)
+    ]
+    assert all(0 <= delay <= upper for delay in delays)
+    assert len(set(delays)) > 1
+
+
+@pytest.mark.parametrize(
+    "previous_delay, lower, upper", ((None, 1, 3), (2, 1, 6), (5, 1, 10))
+)
+def test_calculate_delay_decorrelated_jitter(previous_delay, lower, upper):
+    """Test the decorrelated jitter strategy."""
+    delays = [
+        retry._calculate_delay(
+            1,
+            2,
+            1,
+            previous_delay=previous_delay,
+            max_delay=10,
+            strategy="decorrelated_jitter",
+        )
+        for _ in range(100)
+    ]
+    assert all(lower <= delay <= upper for delay in delays)
+    assert len(set(delays)) > 1
+
+
+def test_calculate_delay_callable():
+    """Test that the strategy can be a callable."""
+
+    def strategy(delay, backoff, number_of_retries, previous_delay, max_delay):
+        return (delay, backoff, number_of_retries, previous_delay, max_delay)
+
+    actual = retry._calculate_delay(1, 2, 3, 4, 5, strategy=strategy)
+    assert actual == (1, 2, 3, 4, 5)
+
+
+@pytest.mark.parametrize(
+    "setting, value",
+    (
+        ("RETRY_BACKOFF_STRATEGY", "linear"),
+        ("RETRY_BUDGET", 0),
+        ("RETRY_HISTORY_SIZE", -1),
+        ("RETRY_MAX_DELAY", -1),
+    ),
+)
+def test_invalid_setting_valueerror(test_app, coroutine, setting, value):
+    """Test ValueError is raised for invalid settings."""
+    test_app.settings["RETRY_CALLBACK"] = coroutine
+    test_app.settings[setting] = value
+    with pytest.raises(ValueError):
+        retry.Retry(test_app)
+
+
+def test_budget(test_app):
+    """Test that the budget limits retries to a share of messages."""
+    consumed = test_app.metrics.counter("messages.consumed")
+    budget = retry.RetryBudget(test_app, ratio=0.1, burst=2)
+
+    assert [budget.withdraw() for _ in range(3)] == [True, True, False]
+
+    consumed.inc(15)
+    assert [budget.withdraw() for _ in range(2)] == [True, False]
+
+    # The bucket never holds more than the burst.
+    consumed.inc(100)
+    assert [budget.withdraw() for _ in range(3)] == [True, True, False]
+
+    assert test_app.metrics.counter("retries.rejected").value == 3
+
+
+@pytest.mark.asyncio
+async def test_callback_exceeds_budget(test_app, coroutine):
+    """Test that callback doesn't retry when the budget is exhausted."""
+    test_app.settings["RETRY_CALLBACK"] = coroutine
+    test_app.settings["RETRY_BUDGET"] = 0.1
+    test_app.settings["RETRY_BUDGET_BURST"] = 1
+    retry.Retry(test_app)
+
+    with pytest.raises(Abort):
+        await retry._retry(test_app, {}, retry.RetryableException())
+
+    # Nothing is raised since the message isn't retried.
+    await retry._retry(test_app, {}, retry.RetryableException())
+
+
 @pytest.mark.parametrize(
     "number_of_retries, threshold, expected",
     [
@@ -56,22 +156,32 @@ def test_exceeded_threshold(number_of_retries, threshold, expected):
     [
         # Retry forever.
         (0, None, False),  # now
-        (10000, None, False),  # 10 seconds ago
+        (10, None, False),  # 10 seconds ago
         # Don't retry.
         (0, 0, True),
-        (10000, 0, True),
+        (10, 0, True),
+        (10, 5, True),
+        (0.5, 0.25, True),
         # Retry.
-        (1000, 10, False),
-        (10000, 20, False),
+        (1, 10, False),
+        (10, 20, False),
+        (0.25, 0.5, False),
     ],
 )
 def test_exceeded_timeout(offset, duration, expected):
     """Test _exceeded_timeout."""
-    start_time = int(time.time()) - offset
-    actual = retry._exceeded_timeout(start_time, duration)
+    now = time.time()
+    actual = retry._exceeded_timeout(now - offset, duration, now)
     assert actual == expected
 
 
+def test_now_ignores_clock_changes():
+    """Test that changes to the system clock don't affect the time."""
+    before = retry._now()
+    with mock.patch("time.time", return_value=0):
+        assert retry._now() >= before
+
+
 def test_callback_insertion(test_app, coroutine):
     """Test that the callback is properly registered."""
     # Add an error callback before registering Retry.
@@ -85,6 +195,7 @@ def test_callback_insertion(test_app, coroutine):
     retry.Retry(test_app)
 
     assert test_app._callbacks["error"][0] is retry._retry
+    assert test_app._callbacks["message_preprocessor"][0] is retry._start_attempt
 
 
 @pytest.mark.asyncio
@@ -127,6 +238,45 @@ async def test_callback_exceeds_timeout(test_app, coroutine):
     assert original_callback_called
 
 
+@pytest.mark.asyncio
+async def test_history(test_app, coroutine):
+    """Test that each attempt is recorded in the retry history."""
+    test_app.settings["RETRY_CALLBACK"] = coroutine
+    test_app.settings["RETRY_HISTORY_SIZE"] = 2
+    test_app.settings["RETRY_THRESHOLD"] = 2
+    retry.Retry(test_app)
+
+    message = {}
+    for _ in range(3):
+        await retry._start_attempt(test_app, message)
+        with suppress(Abort):
+            await retry._retry(test_app, message, retry.RetryableException())
+
+    assert message["_retry"]["count"] == 2
+    history = message["_retry"]["history"]
+    assert len(history) == 2
+    assert history[0]["elapsed"] > 0
+    assert history[0]["delay"] == 0
+    assert history[0]["latency"] >= 0
+    # The last attempt isn't retried.
+    assert "delay" not in history[1]
+    assert history[1]["elapsed"] >= history[0]["elapsed"]
+
+
+@pytest.mark.asyncio
+async def test_history_disabled(test_app, coroutine):
+    """Test that no history is kept when its size is 0."""
+    test_app.settings["RETRY_CALLBACK"] = coroutine
+    test_app.settings["RETRY_HISTORY_SIZE"] = 0
+    retry.Retry(test_app)
+
+    message = {}
+    with suppress(Abort):
+        await retry._retry(test_app, message, retry.RetryableException())
+
+    assert "history" not in message["_retry"]
+
+
 @pytest.mark.asyncio
 async def test_callback_prevents_others(test_app, coroutine):
     """Test that the callback blocks other callbacks."""
@@ -139,21 +289,396 @@ async def test_callback_prevents_others(test_app, coroutine):
 
 
 @pytest.mark.asyncio
-async def test_delay(monkeypatch, test_app, coroutine):
-    """Test that retry delays."""
-    sleep_called = False
+async def test_delay(test_app):
+    """Test that retry delays without holding on to the worker."""
+    retried = []
 
-    test_app.settings["RETRY_CALLBACK"] = coroutine
-    test_app.settings["RETRY_DELAY"] = 1
-    retry.Retry(test_app)
-
-    async def sleep(duration):
-        nonlocal sleep_called
-        sleep_called = True
+    async def callback(app, message):
+        retried.append(message)
 
-    monkeypatch.setattr(asyncio, "sleep", sleep)
+    test_app.settings["RETRY_CALLBACK"] = callback
+    test_app.settings["RETRY_DELAY"] = 0.01
+    retry.Retry(test_app)
 
     with suppress(Abort):
         await retry._retry(test_app, {}, retry.RetryableException())
 
-    assert sleep_called
+    assert not retried
+    assert test_app.metrics.gauge("retries.pending").value == 1
+
+    await asyncio.sleep(0.02)
+
+    assert retried == [
+        {
+            "_retry": {
+                "count": 1,
+                "start_time": mock.ANY,
+                "delay": 0.01,
+                "history": [
+                    {
+                        "delay": 0.01,
+                        "elapsed": 0,
+                        "exception": "RetryableException",
+                        "latency": None,
+                    }
+                ],
+            }
+        }
+    ]
+    assert test_app.metrics.gauge("retries.pending").value == 0
+    assert test_app.metrics.counter("messages.retried").value == 1
+
+
+@pytest.mark.asyncio
+async def test_scheduler_max_pending(test_app, coroutine):
+    """Test that scheduling waits once too many retries are pending."""
+    test_app.settings["RETRY_CALLBACK"] = coroutine
+    scheduler = retry.RetryScheduler(test_app, max_pending=1)
+
+    await scheduler.schedule({}, 0.01)
+    second = asyncio.ensure_future(scheduler.schedule({}, 0.01))
+    await asyncio.sleep(0)
+
+    assert not second.done()
+    assert len(scheduler) == 1
+
+    await asyncio.wait_for(second, 1)
+    assert len(scheduler) == 1
+
+    await scheduler.flush()
+
+
+@pytest.mark.asyncio
+async def test_scheduler_flush(test_app):
+    """Test that flushing retries scheduled messages right away."""
+    retried = []
+
+    async def callback(app, message):
+        retried.append(message)
+
+    test_app.settings["RETRY_CALLBACK"] = callback
+    scheduler = retry.RetryScheduler(test_app, max_pending=10)
+
+    await scheduler.schedule({"a": 1}, 60)
+    await scheduler.flush()
+
+    assert retried == [{"a": 1}]
+    assert not len(scheduler)
+
+
+@pytest.mark.asyncio
+async def test_scheduler_callback_exception(test_app, caplog):
+    """Test that an exception raised while retrying is logged."""
+
+    async def callback(app, message):
+        raise ValueError()
+
+    test_app.settings["RETRY_CALLBACK"] = callback
+    scheduler = retry.RetryScheduler(test_app, max_pending=10)
+
+    await scheduler.schedule({}, 0)
+    await scheduler.flush()
+
+    assert "message.retry_failed" in caplog.messages
+
+
+@pytest.mark.parametrize("setting", ("RETRY_MAX_PENDING", "RETRY_STORE_BATCH_SIZE"))
+def test_max_pending_valueerror(test_app, coroutine, setting):
+    """Test ValueError is raised if a maximum isn't positive."""
+    test_app.settings["RETRY_CALLBACK"] = coroutine
+    test_app.settings[setting] = 0
+    with pytest.raises(ValueError):
+        retry.Retry(test_app)
+
+
+def test_teardown_flushes(event_loop):
+    """Test that scheduled retries are sent when the application stops."""
+    retried = []
+
+    class Consumer:
+        messages = [{"id": 1}]
+
+        async def read(self):
+            if not self.messages:
+                raise Abort("testing", None)
+            return self.messages.pop(0)
+
+    async def callback(app, message):
+        raise retry.RetryableException()
+
+    async def retry_callback(app, message):
+        retried.append(message["id"])
+
+    app = Application("testing", consumer=Consumer(), callback=callback)
+    app.settings["RETRY_CALLBACK"] = retry_callback
+    app.settings["RETRY_DELAY"] = 60
+    retry.Retry(app)
+
+    app.run_forever(loop=event_loop)
+
+    assert retried == [1]
+
+
+def test_store(tmp_path):
+    """Test that the store returns messages once they're due."""
+    path = str(tmp_path / "retries.db")
+    store = retry.RetryStore(path)
+
+    store.add({"id": 1}, 20)
+    store.add({"id": 2}, 10)
+    store.add({"id": 3}, 30)
+
+    assert len(store) == 3
+    assert store.next_due() == 10
+    assert store.due(5, 10) == []
+
+    due = store.due(20, 10)
+    assert [message for _, message in due] == [{"id": 2}, {"id": 1}]
+
+    store.postpone([due[0][0]], 40)
+    assert store.due(20, 10) == [(mock.ANY, {"id": 1})]
+
+    store.remove([id_ for id_, _ in due])
+    assert len(store) == 1
+    assert store.next_due() == 30
+
+
+def test_store_survives_restart(tmp_path):
+    """Test that saved messages are still there after reopening."""
+    path = str(tmp_path / "retries.db")
+    store = retry.RetryStore(path)
+    store.add({"id": 1}, 10)
+    store.close()
+
+    store = retry.RetryStore(path)
+    assert len(store) == 1
+    assert store.due(10, 10) == [(mock.ANY, {"id": 1})]
+
+
+@pytest.mark.asyncio
+async def test_durable_scheduler(test_app, tmp_path):
+    """Test that saved messages are retried once they're due."""
+    retried = []
+
+    async def callback(app, message):
+        retried.append(message)
+
+    test_app.settings["RETRY_CALLBACK"] = callback
+    scheduler = retry.DurableRetryScheduler(
+        test_app, str(tmp_path / "retries.db"), batch_size=2
+    )
+
+    await scheduler.schedule({"id": 1}, 60)
+    for id_ in range(2, 7):
+        await scheduler.schedule({"id": id_}, 0.01)
+    assert test_app.metrics.gauge("retries.pending").value == 6
+
+    await asyncio.sleep(0.1)
+
+    assert sorted(message["id"] for message in retried) == [2, 3, 4, 5, 6]
+    assert len(scheduler) == 1
+    assert test_app.metrics.counter("messages.retried").value == 5
+
+    await scheduler.flush()
+
+
+@pytest.mark.asyncio
+async def test_durable_scheduler_wakes_up(test_app, tmp_path):
+    """Test that scheduling an earlier message wakes the scheduler."""
+    retried = []
+
+    async def callback(app, message):
+        retried.append(message)
+
+    test_app.settings["RETRY_CALLBACK"] = callback
+    scheduler = retry.DurableRetryScheduler(
+        test_app, str(tmp_path / "retries.db"), batch_size=10
+    )
+
+    await scheduler.schedule({"id": 1}, 60)
+    await asyncio.sleep(0.01)
+    await scheduler.schedule({"id": 2}, 0)
+    await asyncio.sleep(0.05)
+
+    assert retried == [{"id": 2}]
+
+    await scheduler.flush()
+
+
+@pytest.mark.asyncio
+async def test_durable_scheduler_keeps_failures(test_app, tmp_path):
+    """Test that messages whose retry fails stay in the store."""
+    retried = []
+
+    async def callback(app, message):
+        retried.append(message)
+        if message["id"] == 1 and len(retried) == 1:
+            raise Exception("testing")
+
+    test_app.settings["RETRY_CALLBACK"] = callback
+    scheduler = retry.DurableRetryScheduler(
+        test_app, str(tmp_path / "retries.db"), batch_size=10, failure_delay=0.2
+    )
+
+    await scheduler.schedule({"id": 1}, 0)
+    await scheduler.schedule({"id": 2}, 0)
+    await asyncio.sleep(0.1)
+
+    assert len(scheduler) == 1
+    assert scheduler.store.due(retry._now(), 10) == []
+
+    await asyncio.sleep(0.2)
+
+    assert [message["id"] for message in retried] == [1, 2, 1]
+    assert len(scheduler) == 0
+    assert test_app.metrics.counter("messages.retried").value == 2
+
+    await scheduler.flush()
+
+
+@pytest.mark.asyncio
+async def test_durable_scheduler_store_exception(test_app, tmp_path, caplog):
+    """Test that the scheduler keeps going after the store fails."""
+    retried = []
+
+    async def callback(app, message):
+        retried.append(message)
+
+    class Serializer:
+        calls = 0
+
+        @staticmethod
+        def dumps(message):
+            return json.dumps(message)
+
+        @classmethod
+        def loads(cls, data):
+            cls.calls += 1
+            if cls.calls == 1:
+                raise ValueError("testing")
+            return json.loads(data)
+
+    test_app.settings["RETRY_CALLBACK"] = callback
+    scheduler = retry.DurableRetryScheduler(
+        test_app,
+        str(tmp_path / "retries.db"),
+        batch_size=10,
+        serializer=Serializer,
+        failure_delay=0.01,
+    )
+
+    await scheduler.schedule({"id": 1}, 0)
+    await asyncio.sleep(0.1)
+
+    assert "retry.store_failed" in caplog.text
+    assert retried == [{"id": 1}]
+
+    await scheduler.flush()
+
+
+def test_durable_retries_survive_restart(event_loop, tmp_path):
+    """Test that saved retries are sent after the application restarts."""
+    retried = []
+
+    class Consumer:
+        def __init__(self, messages):
+            self.messages = messages
+
+        async def read(self):
+            if not self.messages:
+                await asyncio.sleep(0.1)
+                raise Abort("testing", None)
+            return self.messages.pop(0)
+
+    async def callback(app, message):
+        raise retry.RetryableException()
+
+    async def retry_callback(app, message):
+        retried.append(message["id"])
+
+    def create_app(messages, delay):
+        app = Application("testing", consumer=Consumer(messages), callback=callback)
+        app.settings["RETRY_CALLBACK"] = retry_callback
+        app.settings["RETRY_DELAY"] = delay
+        app.settings["RETRY_STORE"] = str(tmp_path / "retries.db")
+        retry.Retry(app)
+        return app
+
+    create_app([{"id": 1}], 0.2).run_forever(loop=event_loop)
+    assert retried == []
+
+    time.sleep(0.1)
+
+    app = create_app([], 0.2)
+    app.run_forever(loop=asyncio.new_event_loop())
+    assert retried == [1]
+    assert app.metrics.gauge("retries.pending").value == 0
+
+
+def test_timeout_under_load(event_loop):
+    """Test that messages stop being retried as soon as they time out."""
+    count = 50
+    failed = []
+
+    class Consumer:
+        messages = [{"id": i} for i in range(count)]
+
+        async def read(self):
+            while not self.messages:
+                if len(failed) == count:
+                    raise Abort("testing", None)
+                await asyncio.sleep(0.001)
+            return self.messages.pop(0)
+
+    async def callback(app, message):
+        await asyncio.sleep(0.001)
+        raise retry.RetryableException()
+
+    async def retry_callback(app, message):
+        Consumer.messages.append(message)
+
+    app = Application("testing", consumer=Consumer(), callback=callback)
+    app.settings["RETRY_CALLBACK"] = retry_callback
+    app.settings["RETRY_TIMEOUT"] = 0.05
+    retry.Retry(app)
+
+    @app.error
+    async def record_failure(app, message, exc):
+        failed.append(message)
+
+    app.run_forever(num_workers=4, loop=event_loop)
+
+    for message in failed:
+        *_, previous, last = message["_retry"]["history"]
+        assert previous["elapsed"] < 0.05 <= last["elapsed"]
+        assert last["latency"] >= 0.001
+
+
+def test_history_latency_with_timeout(event_loop):
+    """Test that attempts are timed when messages have a deadline."""
+    retried = []
+
+    class Consumer:
+        messages = [{"id": 1}]
+
+        async def read(self):
+            if not self.messages:
+                raise Abort("testing", None)
+            return self.messages.pop(0)
+
+    async def callback(app, message):
+        await asyncio.sleep(0.001)
+        raise retry.RetryableException()
+
+    async def retry_callback(app, message):
+        retried.append(message)
+
+    app = Application("testing", consumer=Consumer(), callback=callback)
+    app.settings["MESSAGE_TIMEOUT"] = 5
+    app.settings["RETRY_CALLBACK"] = retry_callback
+    retry.Retry(app)
+
+    app.run_forever(loop=event_loop)
+
+    (message,) = retried
+    assert message["_retry"]["history"][0]["latency"] >= 0.001
@@ -2,9 +2,12 @@
 from __future__ import annotations
 
 import asyncio
+import os
+import signal
 
 import pytest
 
+from doozer import base
 from doozer.base import Application
 from doozer.exceptions import Abort
 
@@ -51,6 +54,216 @@ def test_consume(event_loop, test_consumer):
     assert queue.qsize() == 1
 
 
+def test_consume_read_many(event_loop, test_batch_consumer):
+    """Test Application._consume with a consumer that reads in batches."""
+    queue = asyncio.Queue()
+
+    app = Application("testing", consumer=test_batch_consumer)
+    app.settings["BATCH_SIZE"] = 10
+
+    event_loop.run_until_complete(app._consume(queue))
+
+    assert [queue.get_nowait() for _ in range(queue.qsize())] == [1, 2, 3, 4, 5]
+
+
+@pytest.mark.parametrize(
+    "batch_size, expected", ((10, [[1, 2, 3], [4, 5]]), (2, [[1, 2], [4, 5]]))
+)
+def test_consume_batch_callback(event_loop, test_batch_consumer, batch_size, expected):
+    """Test Application._consume with batch callbacks enabled."""
+    queue = asyncio.Queue()
+
+    app = Application("testing", consumer=test_batch_consumer)
+    app.settings["BATCH_CALLBACK"] = True
+    app.settings["BATCH_SIZE"] = batch_size
+
+    event_loop.run_until_complete(app._consume(queue))
+
+    assert [queue.get_nowait() for _ in range(queue.qsize())] == expected
+
+
+def test_consume_batch_callback_without_read_many(event_loop, test_consumer_with_abort):
+    """Test that batch callbacks work with consumers without read_many."""
+    queue = asyncio.Queue()
+
+    app = Application("testing", consumer=test_consumer_with_abort)
+    app.settings["BATCH_CALLBACK"] = True
+
+    event_loop.run_until_complete(app._consume(queue))
+
+    assert queue.get_nowait() == [1]
+
+
+def test_consume_multiple_readers(event_loop):
+    """Test that the consumer can be read from by more than one task."""
+    reading = 0
+    most_reading = 0
+
+    class Consumer:
+        messages = list(range(6))
+
+        async def read(self):
+            nonlocal reading, most_reading
+            reading += 1
+            most_reading = max(most_reading, reading)
+            await asyncio.sleep(0)
+            reading -= 1
+            if not self.messages:
+                raise Abort("testing", None)
+            return self.messages.pop(0)
+
+    actual = []
+
+    async def callback(app, message):
+        actual.append(message)
+
+    app = Application("testing", consumer=Consumer(), callback=callback)
+    app.settings["NUM_READERS"] = 3
+
+    app.run_forever(loop=event_loop)
+
+    assert most_reading == 3
+    assert sorted(actual) == list(range(6))
+
+
+def test_consume_abort_stops_other_readers(event_loop, coroutine):
+    """Test that the first reader told to stop stops the others."""
+    reads = 0
+
+    class Consumer:
+        async def read(self):
+            nonlocal reads
+            reads += 1
+            if reads == 1:
+                await asyncio.sleep(0)
+                raise Abort("testing", None)
+            # Wait forever.
+            await asyncio.Event().wait()
+
+    app = Application("testing", consumer=Consumer(), callback=coroutine)
+    app.settings["NUM_READERS"] = 2
+
+    app.run_forever(loop=event_loop)
+
+    assert reads == 2
+
+
+def test_run_forever_prefetch_count(event_loop):
+    """Test that PREFETCH_COUNT sets how many messages can be queued."""
+    queue_sizes = []
+
+    class Consumer:
+        messages = list(range(10))
+
+        async def read(self):
+            if not self.messages:
+                raise Abort("testing", None)
+            return self.messages.pop(0)
+
+    async def callback(app, message):
+        for _ in range(10):
+            await asyncio.sleep(0)
+        queue_sizes.append(app.metrics.gauge("queue.depth").value)
+
+    app = Application("testing", consumer=Consumer(), callback=callback)
+    app.settings["PREFETCH_COUNT"] = 4
+
+    app.run_forever(loop=event_loop)
+
+    assert max(queue_sizes) == 4
+
+
+@pytest.mark.parametrize(
+    "setting",
+    (
+        "ACKNOWLEDGEMENT_BATCH_SIZE",
+        "ACKNOWLEDGEMENT_BATCH_WAIT",
+        "CALLBACK_TIMEOUT",
+        "MAX_WORKERS",
+        "MESSAGE_TIMEOUT",
+        "NUM_READERS",
+        "POSTPROCESS_TIMEOUT",
+        "PREFETCH_COUNT",
+        "PREPROCESS_TIMEOUT",
+        "SHUTDOWN_TIMEOUT",
+    ),
+)
+def test_run_forever_invalid_valueerror(test_consumer, coroutine, setting):
+    """Test ValueError is raised for invalid reader settings."""
+    app = Application("testing", consumer=test_consumer, callback=coroutine)
+    app.settings[setting] = 0
+    with pytest.raises(ValueError):
+        app.run_forever()
+
+
+def test_pause_consumption(event_loop):
+    """Test that the consumer isn't read while consumption is paused."""
+    calls = []
+
+    class Consumer:
+        async def read(self):
+            calls.append("read")
+            raise Abort("testing", None)
+
+        def pause(self):
+            calls.append("pause")
+
+        def resume(self):
+            calls.append("resume")
+
+    queue = asyncio.Queue()
+    app = Application("testing", consumer=Consumer())
+
+    app.pause_consumption("a")
+    app.pause_consumption("b")
+    task = event_loop.create_task(app._consume(queue))
+    event_loop.run_until_complete(asyncio.sleep(0))
+
+    app.resume_consumption("a")
+    event_loop.run_until_complete(asyncio.sleep(0))
+
+    assert calls == ["pause"]
+    assert not task.done()
+
+    app.resume_consumption("b")
+    event_loop.run_until_complete(asyncio.wait_for(task, 1))
+
+    assert calls == ["pause", "resume", "read"]
+
+
+def test_resume_consumption_not_paused(test_consumer):
+    """Test that resuming consumption that isn't paused does nothing."""
+    app = Application("testing", consumer=test_consumer)
+    app.resume_consumption()
+    assert not app._pause_reasons
+
+
+def test_run_forever_pause_consumption(event_loop):
+    """Test that messages already read are processed while paused."""
+    actual = []
+
+    class Consumer:
+        messages = list(range(5))
+
+        async def read(self):
+            if not self.messages:
+                raise Abort("testing", None)
+            return self.messages.pop(0)
+
+    async def callback(app, message):
+        if message == 0:
+            app.pause_consumption()
+            asyncio.get_event_loop().call_later(0.01, app.resume_consumption)
+        actual.append((message, app.metrics.gauge("consumption.paused").value))
+
+    app = Application("testing", consumer=Consumer(), callback=callback)
+    app.settings["PREFETCH_COUNT"] = 2
+
+    app.run_forever(loop=event_loop)
+
+    assert actual == [(0, 1), (1, 1), (2, 1), (3, 0), (4, 0)]
+
+
 def test_consumer_aborts(event_loop):
     """Test that the application stops after the consumer aborts."""
     consumer_called = False
@@ -112,6 +325,74 @@ def test_callback_not_coroutine_typerror(callback):
         app.run_forever()
 
 
+@pytest.mark.parametrize("acknowledgement", (None, "", False, 10, sum))
+def test_batch_acknowledgement_not_coroutine_typeerror(acknowledgement):
+    """Test TypeError is raised if acknowledgement isn't a coroutine."""
+    app = Application("testing")
+    with pytest.raises(TypeError):
+        app.batch_acknowledgement(acknowledgement)
+
+
+def test_batch_acknowledgement(event_loop, coroutine, cancelled_future, queue):
+    """Test that messages are acknowledged in batches."""
+    batches = []
+    for message in range(5):
+        queue.put_nowait(message)
+
+    app = Application("testing", callback=coroutine)
+    app.settings["ACKNOWLEDGEMENT_BATCH_SIZE"] = 2
+
+    @app.batch_acknowledgement
+    async def acknowledge(app, messages):
+        batches.append(messages)
+
+    event_loop.run_until_complete(app._process(cancelled_future, queue, event_loop))
+
+    assert batches == [[0, 1], [2, 3]]
+    assert app._acknowledged == [4]
+
+    event_loop.run_until_complete(app._flush_acknowledgements())
+
+    assert batches == [[0, 1], [2, 3], [4]]
+    assert app.metrics.counter("acknowledgements.flushed").value == 3
+
+
+def test_batch_acknowledgement_exception(event_loop, caplog):
+    """Test that a failed batch is logged and dropped."""
+    app = Application("testing")
+    app._acknowledged = [1, 2]
+
+    @app.batch_acknowledgement
+    async def acknowledge(app, messages):
+        raise Exception()
+
+    event_loop.run_until_complete(app._flush_acknowledgements())
+
+    assert "acknowledgements.failed" in caplog.messages
+    assert app.metrics.counter("acknowledgements.failed").value == 1
+    assert not app._acknowledged
+
+
+@pytest.mark.asyncio
+async def test_acknowledge_periodically():
+    """Test that batches are acknowledged before they fill up."""
+    batches = []
+
+    app = Application("testing")
+    app.settings["ACKNOWLEDGEMENT_BATCH_WAIT"] = 0.01
+    app._acknowledged = [1]
+
+    @app.batch_acknowledgement
+    async def acknowledge(app, messages):
+        batches.append(messages)
+
+    task = asyncio.ensure_future(app._acknowledge_periodically())
+    await asyncio.sleep(0.05)
+    task.cancel()
+
+    assert batches == [[1]]
+
+
 @pytest.mark.parametrize("error_callback", (None, "", False, 10, sum))
 def test_error_not_coroutine_typeerror(error_callback):
     """Test TypeError is raised if error callback isn't a coroutine."""
@@ -153,6 +434,85 @@ def test_message_acknowledgement_original_message(
     assert actual == expected
 
 
+@pytest.mark.parametrize(
+    "strategy, same_object, same_items",
+    (("none", True, True), ("shallow", False, True), ("deep", False, False)),
+)
+def test_message_acknowledgement_copy_strategy(
+    event_loop, coroutine, cancelled_future, queue, strategy, same_object, same_items
+):
+    """Test the strategies for copying the original message."""
+    actual = None
+
+    expected = {"items": []}
+    queue.put_nowait(expected)
+
+    app = Application("testing", callback=coroutine)
+    app.settings["MESSAGE_COPY"] = strategy
+
+    @app.message_acknowledgement
+    async def acknowledge(app, message):
+        nonlocal actual
+        actual = message
+
+    event_loop.run_until_complete(app._process(cancelled_future, queue, event_loop))
+
+    assert actual == expected
+    assert (actual is expected) is same_object
+    assert (actual["items"] is expected["items"]) is same_items
+
+
+def test_message_acknowledgement_copy_callable(
+    event_loop, coroutine, cancelled_future, queue
+):
+    """Test that a callable can be used to copy the original message."""
+    actual = None
+
+    queue.put_nowait({"tag": 1, "body": "spam"})
+
+    app = Application("testing", callback=coroutine)
+    app.settings["MESSAGE_COPY"] = lambda message: message["tag"]
+
+    @app.message_acknowledgement
+    async def acknowledge(app, message):
+        nonlocal actual
+        actual = message
+
+    event_loop.run_until_complete(app._process(cancelled_future, queue, event_loop))
+
+    assert actual == 1
+
+
+def test_message_acknowledgement_copy_skipped(
+    event_loop, coroutine, cancelled_future, queue
+):
+    """Test that the message isn't copied without acknowledgements."""
+    copy_called = False
+
+    def copy(message):
+        nonlocal copy_called
+        copy_called = True
+        return message
+
+    queue.put_nowait("original")
+
+    app = Application("testing", callback=coroutine)
+    app.settings["MESSAGE_COPY"] = copy
+
+    event_loop.run_until_complete(app._process(cancelled_future, queue, event_loop))
+
+    assert not copy_called
+
+
+@pytest.mark.parametrize("strategy", (None, "", "deepest", 10))
+def test_message_copy_invalid_valueerror(test_consumer, coroutine, strategy):
+    """Test ValueError is raised if the copy strategy isn't valid."""
+    app = Application("testing", consumer=test_consumer, callback=coroutine)
+    app.settings["MESSAGE_COPY"] = strategy
+    with pytest.raises(ValueError):
+        app.run_forever()
+
+
 @pytest.mark.parametrize("preprocess", (None, "", False, 10, sum))
 def test_message_preprocessor_not_coroutine_typeerror(preprocess):
     """Test TypeError is raised if preprocessor isn't a coroutine."""
@@ -190,6 +550,198 @@ async def test_postprocess_results(original, expected):
     assert callback2_called
 
 
+@pytest.mark.asyncio
+@pytest.mark.parametrize("concurrency", (2, 5))
+async def test_postprocess_results_concurrently(concurrency):
+    """Test that results are postprocessed concurrently."""
+    running = 0
+    most_running = 0
+    actual = []
+
+    app = Application("testing")
+    app.settings["POSTPROCESS_CONCURRENCY"] = concurrency
+
+    @app.result_postprocessor
+    async def callback(app, result):
+        nonlocal running, most_running
+        running += 1
+        most_running = max(most_running, running)
+        await asyncio.sleep(0)
+        running -= 1
+        if result % 3 == 0:
+            raise Abort("testing", result)
+        actual.append(result)
+
+    await app._postprocess_results(range(10))
+
+    assert most_running == concurrency
+    assert sorted(actual) == [1, 2, 4, 5, 7, 8]
+
+
+@pytest.mark.asyncio
+async def test_postprocess_results_concurrently_exception():
+    """Test that an exception stops postprocessing new results."""
+    actual = []
+
+    app = Application("testing")
+    app.settings["POSTPROCESS_CONCURRENCY"] = 2
+
+    @app.result_postprocessor
+    async def callback(app, result):
+        await asyncio.sleep(0)
+        if result == 1:
+            raise ValueError()
+        actual.append(result)
+
+    with pytest.raises(ValueError):
+        await app._postprocess_results(range(10))
+
+    assert actual == [0]
+
+
+def test_postprocess_results_concurrently_timeout(event_loop, cancelled_future, queue):
+    """Test that results still being postprocessed are cancelled."""
+    actual = []
+
+    queue.put_nowait(1)
+
+    async def callback(app, message):
+        return range(4)
+
+    app = Application("testing", callback=callback)
+    app.settings["POSTPROCESS_CONCURRENCY"] = 4
+    app.settings["POSTPROCESS_TIMEOUT"] = 0.01
+
+    @app.result_postprocessor
+    async def postprocess(app, result):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            actual.append(("cancelled", result))
+            raise
+
+    @app.message_acknowledgement
+    async def acknowledge(app, message):
+        actual.append(("acknowledged", message))
+
+    event_loop.run_until_complete(
+        asyncio.wait_for(app._process(cancelled_future, queue, event_loop), 1)
+    )
+
+    assert sorted(actual[:-1]) == [("cancelled", i) for i in range(4)]
+    assert actual[-1] == ("acknowledged", 1)
+    assert app.metrics.counter("messages.timed_out").value == 1
+
+
+@pytest.mark.asyncio
+async def test_postprocess_results_streaming():
+    """Test that streamed results are postprocessed as they're produced."""
+    actual = []
+
+    async def callback(app, message):
+        for i in range(3):
+            actual.append(("produced", i))
+            yield i
+
+    app = Application("testing", callback=callback)
+
+    @app.result_postprocessor
+    async def postprocess(app, result):
+        actual.append(("postprocessed", result))
+
+    await app._postprocess_results(callback(app, None))
+
+    assert actual == [
+        ("produced", 0),
+        ("postprocessed", 0),
+        ("produced", 1),
+        ("postprocessed", 1),
+        ("produced", 2),
+        ("postprocessed", 2),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_postprocess_results_streaming_concurrently():
+    """Test that streamed results don't get ahead of postprocessing."""
+    produced = 0
+    most_ahead = 0
+    postprocessed = 0
+
+    async def callback(app, message):
+        nonlocal produced
+        for i in range(10):
+            produced += 1
+            yield i
+
+    app = Application("testing", callback=callback)
+    app.settings["POSTPROCESS_CONCURRENCY"] = 3
+
+    @app.result_postprocessor
+    async def postprocess(app, result):
+        nonlocal most_ahead, postprocessed
+        most_ahead = max(most_ahead, produced - postprocessed)
+        await asyncio.sleep(0)
+        postprocessed += 1
+
+    await app._postprocess_results(callback(app, None))
+
+    assert postprocessed == 10
+    assert most_ahead == 3
+
+
+@pytest.mark.parametrize("concurrency", (1, 2))
+def test_process_streaming_exception(event_loop, cancelled_future, queue, concurrency):
+    """Test that exceptions raised while streaming call the error callbacks."""
+    actual = []
+    error = None
+
+    async def callback(app, message):
+        yield 1
+        raise ValueError()
+
+    app = Application("testing", callback=callback)
+    app.settings["POSTPROCESS_CONCURRENCY"] = concurrency
+
+    @app.result_postprocessor
+    async def postprocess(app, result):
+        actual.append(result)
+
+    @app.error
+    async def on_error(app, message, exc):
+        nonlocal error
+        error = exc
+
+    queue.put_nowait("message")
+    event_loop.run_until_complete(app._process(cancelled_future, queue, event_loop))
+
+    assert actual == [1]
+    assert isinstance(error, ValueError)
+    assert app.metrics.counter("messages.failed").value == 1
+
+
+def test_process_streaming_abort(event_loop, cancelled_future, queue):
+    """Test that streaming callbacks can abort the message."""
+    error_called = False
+
+    async def callback(app, message):
+        yield 1
+        raise Abort("testing", message)
+
+    app = Application("testing", callback=callback)
+
+    @app.error
+    async def on_error(app, message, exc):
+        nonlocal error_called
+        error_called = True
+
+    queue.put_nowait("message")
+    event_loop.run_until_complete(app._process(cancelled_future, queue, event_loop))
+
+    assert not error_called
+    assert app.metrics.counter("messages.aborted").value == 1
+
+
 def test_process_exception_stops_application(event_loop, test_consumer):
     """Test that the application stops after a processing exception."""
 
@@ -206,6 +758,99 @@ def test_process_exception_stops_application(event_loop, test_consumer):
         app.run_forever(loop=event_loop)
 
 
+def test_process_stopped_by_sentinel(event_loop, coroutine, queue):
+    """Test that idle processors stop once the consumer is done."""
+    future = event_loop.create_future()
+
+    app = Application("testing", callback=coroutine)
+
+    tasks = [
+        event_loop.create_task(app._process(future, queue, event_loop))
+        for _ in range(3)
+    ]
+
+    # Let the processors start waiting on the empty queue.
+    event_loop.run_until_complete(asyncio.sleep(0))
+    assert not any(task.done() for task in tasks)
+
+    future.set_result(None)
+    base._stop_processors(queue)
+
+    event_loop.run_until_complete(asyncio.wait_for(asyncio.gather(*tasks), 1))
+
+
+def test_process_wakes_up_for_message(event_loop, queue):
+    """Test that an idle processor handles a message when it arrives."""
+    actual = None
+
+    async def callback(app, message):
+        nonlocal actual
+        actual = message
+
+    future = event_loop.create_future()
+
+    app = Application("testing", callback=callback)
+    task = event_loop.create_task(app._process(future, queue, event_loop))
+
+    event_loop.run_until_complete(asyncio.sleep(0))
+    queue.put_nowait("message")
+    event_loop.run_until_complete(asyncio.sleep(0))
+
+    assert actual == "message"
+
+    future.set_result(None)
+    base._stop_processors(queue)
+    event_loop.run_until_complete(asyncio.wait_for(task, 1))
+
+
+def test_process_retired(event_loop, coroutine, queue):
+    """Test that an idle processor exits when it's retired."""
+    future = event_loop.create_future()
+
+    app = Application("testing", callback=coroutine)
+    workers = base._Workers()
+    tasks = [
+        event_loop.create_task(app._process(future, queue, event_loop, workers))
+        for _ in range(2)
+    ]
+
+    event_loop.run_until_complete(asyncio.sleep(0))
+    assert workers.retire()
+    event_loop.run_until_complete(asyncio.sleep(0))
+
+    assert [task.done() for task in tasks].count(True) == 1
+    assert not any(task.cancelled() for task in tasks if task.done())
+    # Retired tasks aren't kept once they've stopped.
+    assert not workers._retired
+
+    future.set_result(None)
+    base._stop_processors(queue)
+    event_loop.run_until_complete(asyncio.wait_for(asyncio.gather(*tasks), 1))
+
+
+def test_process_with_sleep_time(event_loop, monkeypatch, coroutine, queue):
+    """Test that processors poll the queue when SLEEP_TIME is set."""
+    sleep_called = False
+
+    app = Application("testing", callback=coroutine)
+    app.settings["SLEEP_TIME"] = 0
+
+    original_sleep = asyncio.sleep
+
+    async def sleep(duration):
+        nonlocal sleep_called
+        sleep_called = True
+        future.set_result(None)
+        await original_sleep(duration)
+
+    monkeypatch.setattr(asyncio, "sleep", sleep)
+
+    future = event_loop.create_future()
+    event_loop.run_until_complete(app._process(future, queue, event_loop))
+
+    assert sleep_called
+
+
 @pytest.mark.parametrize("postprocess", (None, "", False, 10, sum))
 def test_result_postprocessor_not_coroutine_typeerror(postprocess):
     """Test TypeError is raised if postprocessor isn't a coroutine."""
@@ -280,3 +925,321 @@ def test_run_forever(event_loop, test_consumer_with_abort):
     assert postprocess_called
     assert acknowledgement_called
     assert teardown_called
+
+
+def test_run_forever_batch_callback(event_loop, test_batch_consumer):
+    """Test that the callback receives batches of messages."""
+    actual = []
+
+    async def callback(app, messages):
+        actual.append(messages)
+
+    app = Application("testing", consumer=test_batch_consumer, callback=callback)
+    app.settings["BATCH_CALLBACK"] = True
+    app.settings["BATCH_SIZE"] = 10
+
+    app.run_forever(loop=event_loop)
+
+    assert actual == [[1, 2, 3], [4, 5]]
+
+
+def test_run_forever_streaming(event_loop, test_consumer_with_abort):
+    """Test that the callback can be an asynchronous generator."""
+    actual = []
+
+    async def callback(app, message):
+        yield message
+        yield message + 1
+
+    app = Application("testing", consumer=test_consumer_with_abort, callback=callback)
+
+    @app.result_postprocessor
+    async def postprocess(app, result):
+        actual.append(result)
+
+    app.run_forever(loop=event_loop)
+
+    assert actual == [1, 2]
+
+
+@pytest.mark.parametrize(
+    "current, load, backlog, expected",
+    (
+        (2, 1.5, 0, 2),  # Busy enough.
+        (2, 1.5, 1.5, 4),  # Behind.
+        (2, 3, 10, 8),  # Limited by the maximum.
+        (6, 0.5, 0, 5),  # Removed one at a time.
+        (2, 0, 0, 1),  # Limited by the minimum.
+    ),
+)
+def test_desired_workers(current, load, backlog, expected):
+    """Test _desired_workers."""
+    actual = base._desired_workers(
+        current, 1, 8, load=load, backlog=backlog, utilization=0.75
+    )
+    assert actual == expected
+
+
+def test_run_forever_autoscale(event_loop, caplog):
+    """Test that workers are added when messages wait to be processed."""
+    most_workers = 0
+
+    class Consumer:
+        messages = list(range(100))
+
+        async def read(self):
+            if not self.messages:
+                raise Abort("testing", None)
+            return self.messages.pop(0)
+
+    async def callback(app, message):
+        nonlocal most_workers
+        most_workers = max(most_workers, app.metrics.gauge("workers.busy").value)
+        await asyncio.sleep(0.001)
+
+    app = Application("testing", consumer=Consumer(), callback=callback)
+    app.settings["AUTOSCALE_INTERVAL"] = 0.01
+    app.settings["MAX_WORKERS"] = 4
+
+    with caplog.at_level("INFO", logger="testing"):
+        app.run_forever(loop=event_loop)
+
+    assert most_workers > 1
+    assert "workers.scaled" in caplog.messages
+
+
+@pytest.mark.parametrize(
+    "settings, exception",
+    (
+        ({"MESSAGE_KEY": "key"}, TypeError),
+        ({"MESSAGE_KEY": str, "BATCH_CALLBACK": True}, ValueError),
+        ({"MESSAGE_KEY": str, "NUM_READERS": 2}, ValueError),
+    ),
+)
+def test_run_forever_invalid_message_key(test_consumer, coroutine, settings, exception):
+    """Test that invalid message keys raise exceptions."""
+    app = Application("testing", consumer=test_consumer, callback=coroutine)
+    app.settings.update(settings)
+    with pytest.raises(exception):
+        app.run_forever()
+
+
+@pytest.mark.asyncio
+async def test_keyed_queue():
+    """Test that only one message is handed out at a time for each key."""
+    queue = base._KeyedQueue(lambda message: message[0])
+    for message in ("a1", "a2", "b1", "a3"):
+        await queue.put(message)
+
+    release = asyncio.Event()
+
+    async def process():
+        message = await queue.get()
+        await release.wait()
+        queue.task_done()
+        return message
+
+    first = asyncio.gather(process(), process())
+    await asyncio.sleep(0)
+    assert queue.empty()
+    assert queue.qsize() == 2
+
+    release.set()
+    assert await first == ["a1", "b1"]
+    assert await process() == "a2"
+    assert await process() == "a3"
+    assert not queue._lanes
+
+
+@pytest.mark.asyncio
+async def test_keyed_queue_full():
+    """Test that messages wait for room in a full queue."""
+    queue = base._KeyedQueue(str, maxsize=1)
+    await queue.put(1)
+
+    with pytest.raises(asyncio.QueueFull):
+        queue.put_nowait(2)
+
+    put = asyncio.ensure_future(queue.put(2))
+    await asyncio.sleep(0)
+    assert not put.done()
+
+    assert await queue.get() == 1
+    await asyncio.wait_for(put, 1)
+    assert await queue.get() == 2
+
+
+@pytest.mark.asyncio
+async def test_keyed_queue_stop():
+    """Test that waiting tasks are stopped once no messages are ready."""
+    queue = base._KeyedQueue(str)
+    await queue.put(1)
+    await queue.put(1)
+    assert await queue.get() == 1
+
+    waiting = asyncio.ensure_future(queue.get())
+    await asyncio.sleep(0)
+    base._stop_processors(queue)
+
+    assert await asyncio.wait_for(waiting, 1) is base._STOP
+
+    queue.task_done()
+    assert await queue.get() == 1
+
+
+def test_run_forever_message_key(event_loop):
+    """Test that messages with the same key are processed in order."""
+    processing = set()
+    processed = []
+    most_busy = 0
+
+    class Consumer:
+        messages = [(key, i) for i in range(5) for key in "abc"]
+
+        async def read(self):
+            if not self.messages:
+                raise Abort("testing", None)
+            return self.messages.pop(0)
+
+    async def callback(app, message):
+        nonlocal most_busy
+        key = message[0]
+        assert key not in processing
+        processing.add(key)
+        most_busy = max(most_busy, len(processing))
+        await asyncio.sleep(0.001 * (3 - "abc".index(key)))
+        processing.discard(key)
+        processed.append(message)
+
+    app = Application("testing", consumer=Consumer(), callback=callback)
+    app.settings["MESSAGE_KEY"] = lambda message: message[0]
+
+    app.run_forever(num_workers=4, loop=event_loop)
+
+    assert most_busy > 1
+    for key in "abc":
+        assert [i for k, i in processed if k == key] == list(range(5))
+
+
+def test_run_forever_batch_acknowledgement(event_loop):
+    """Test that the last batch is acknowledged on shutdown."""
+    batches = []
+
+    class Consumer:
+        messages = list(range(5))
+
+        async def read(self):
+            if not self.messages:
+                raise Abort("testing", None)
+            return self.messages.pop(0)
+
+    async def callback(app, message):
+        pass
+
+    app = Application("testing", consumer=Consumer(), callback=callback)
+    app.settings["ACKNOWLEDGEMENT_BATCH_SIZE"] = 2
+    app.settings["ACKNOWLEDGEMENT_BATCH_WAIT"] = 10
+
+    @app.batch_acknowledgement
+    async def acknowledge(app, messages):
+        batches.append(messages)
+
+    app.run_forever(loop=event_loop)
+
+    assert batches == [[0, 1], [2, 3], [4]]
+
+
+class EndlessConsumer:
+    """A consumer that never runs out of messages."""
+
+    def __init__(self):
+        """Initialize the instance."""
+        self.count = 0
+
+    async def read(self):
+        """Return the next message."""
+        self.count += 1
+        return self.count
+
+
+def test_run_forever_stops_on_signal(event_loop):
+    """Test that messages already read are processed after a signal."""
+    acknowledged = []
+    teardown_called = False
+
+    async def callback(app, message):
+        if message == 1:
+            os.kill(os.getpid(), signal.SIGTERM)
+        await asyncio.sleep(0.01)
+
+    consumer = EndlessConsumer()
+    app = Application("testing", consumer=consumer, callback=callback)
+
+    @app.message_acknowledgement
+    async def acknowledge(app, message):
+        acknowledged.append(message)
+
+    @app.teardown
+    async def teardown(app):
+        nonlocal teardown_called
+        teardown_called = True
+
+    app.run_forever(num_workers=2, loop=event_loop)
+
+    assert acknowledged == list(range(1, consumer.count + 1))
+    assert app.metrics.counter("messages.abandoned").value == 0
+    assert teardown_called
+
+
+@pytest.mark.parametrize("signals, timeout", ((1, 0.05), (2, None)))
+def test_run_forever_abandons_messages(event_loop, caplog, signals, timeout):
+    """Test that messages are abandoned once the shutdown deadline passes."""
+    acknowledged = []
+    teardown_called = False
+
+    async def callback(app, message):
+        if message == 1:
+            for _ in range(signals):
+                os.kill(os.getpid(), signal.SIGTERM)
+        await asyncio.sleep(10)
+
+    app = Application("testing", consumer=EndlessConsumer(), callback=callback)
+    app.settings["PREFETCH_COUNT"] = 3
+    app.settings["SHUTDOWN_TIMEOUT"] = timeout
+
+    @app.message_acknowledgement
+    async def acknowledge(app, message):
+        acknowledged.append(message)
+
+    @app.teardown
+    async def teardown(app):
+        nonlocal teardown_called
+        teardown_called = True
+
+    app.run_forever(num_workers=2, loop=event_loop)
+
+    # Two messages were being processed, three were in the queue, and
+    # one was waiting to be added to the queue.
+    assert not acknowledged
+    assert app.metrics.counter("messages.abandoned").value == 6
+    assert "messages.abandoned" in caplog.messages
+    assert teardown_called
+
+
+def test_run_forever_restores_signal_handlers(event_loop, test_consumer_with_abort):
+    """Test that the signal handlers are restored once the loop stops."""
+
+    async def callback(app, message):
+        assert signal.getsignal(signal.SIGINT) is not handler
+
+    def handler(signum, frame):
+        pass
+
+    app = Application("testing", consumer=test_consumer_with_abort, callback=callback)
+
+    previous = signal.signal(signal.SIGINT, handler)
+    try:
+        app.run_forever(loop=event_loop)
+        assert signal.getsignal(signal.SIGINT) is handler
+    finally:
+        signal.signal(signal.SIGINT, previous)
@@ -0,0 +1,58 @@
+"""Test the benchmarks."""
+from __future__ import annotations
+
+import pytest
+
+from benchmarks import runner, scenarios
+
+
+@pytest.mark.parametrize("scenario", scenarios.SCENARIOS, ids=lambda s: s.name)
+def test_run_scenario(scenario):
+    """Test that each scenario processes every message."""
+    result = runner.run_scenario(scenario.name, 10)
+
+    assert result["messages"] == scenarios.scenario_messages(scenario, 10)
+    assert result["messages_per_second"] > 0
+    assert result["latency"]["p50"] <= result["latency"]["max"]
+
+
+@pytest.mark.parametrize(
+    "percent, expected", ((50, 5), (90, 9), (99, 10), (100, 10), (0, 1))
+)
+def test_percentile(percent, expected):
+    """Test that percentiles use the nearest rank."""
+    assert runner._percentile(list(range(1, 11)), percent) == expected
+
+
+def test_compare():
+    """Test that results are compared by scenario."""
+    baseline = {
+        "results": [
+            {
+                "name": "a",
+                "messages_per_second": 100,
+                "latency": {"p99": 0.002},
+                "peak_rss": 1000,
+            },
+        ],
+    }
+    current = {
+        "results": [
+            {
+                "name": "a",
+                "messages_per_second": 150,
+                "latency": {"p99": 0.001},
+                "peak_rss": None,
+            },
+            {
+                "name": "b",
+                "messages_per_second": 100,
+                "latency": {"p99": 0.001},
+                "peak_rss": 1000,
+            },
+        ],
+    }
+
+    assert runner.compare(baseline, current) == [
+        {"name": "a", "messages_per_second": 0.5, "p99": -0.5, "peak_rss": None}
+    ]
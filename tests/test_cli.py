@@ -63,6 +63,30 @@ def double_mock_service(modules_tmpdir, test_app):
     )
 
 
+@pytest.fixture
+def crashing_mock_service(modules_tmpdir, test_app):
+    """Create a module for a fake service that crashes once."""
+    marker = modules_tmpdir.join("crashed")
+    crashing_service = modules_tmpdir.join("crashing_service.py")
+    crashing_service.write(
+        "\n".join(
+            (
+                "import os",
+                "from doozer import Application",
+                getsource(type(test_app)),
+                "class CrashingApplication(MockApplication):",
+                "    def run_forever(self, *args, **kwargs):",
+                "        if not os.path.exists({!r}):".format(str(marker)),
+                "            open({!r}, 'w').close()".format(str(marker)),
+                "            raise SystemExit(1)",
+                "        super().run_forever(*args, **kwargs)",
+                "app = CrashingApplication()",
+            )
+        )
+    )
+    return marker
+
+
 def test_applicationaction(good_mock_service):
     """Test _ApplicationAction."""
     action = cli._ApplicationAction(option_strings="a", dest="app")
@@ -300,3 +324,36 @@ def test_run_with_reloader(good_mock_service, cli_kwargs, caplog, capsys):
     out, _ = capsys.readouterr()
     assert "Running <Application: testing> with reloader" in caplog.text
     assert "Run, Forrest, run!" in out
+
+
+@pytest.mark.parametrize("processes", (0, -1))
+def test_run_with_invalid_processes(good_mock_service, cli_kwargs, processes):
+    """Test that run fails with fewer than one process."""
+    with pytest.raises(CommandError):
+        cli.run("good_import:app", processes=processes, **cli_kwargs)
+
+
+@pytest.mark.parametrize("option", ("reloader", "debug"))
+def test_run_with_processes_and_reloader(good_mock_service, cli_kwargs, option):
+    """Test that multiple processes can't be used with the reloader."""
+    with pytest.raises(CommandError):
+        cli.run("good_import:app", processes=2, **{option: True}, **cli_kwargs)
+
+
+def test_run_with_processes(good_mock_service, cli_kwargs, caplog, capfd):
+    """Test that an app is run in multiple processes."""
+    cli.run("good_import:app", processes=2, **cli_kwargs)
+    out, _ = capfd.readouterr()
+    assert "Running <Application: testing> in 2 processes" in caplog.text
+    assert out.count("Run, Forrest, run!") == 2
+
+
+def test_run_with_processes_restarts(
+    monkeypatch, crashing_mock_service, cli_kwargs, caplog, capfd
+):
+    """Test that processes that crash are restarted."""
+    monkeypatch.setattr(cli, "RESTART_DELAY", 0)
+    cli.run("crashing_service:app", processes=2, **cli_kwargs)
+    out, _ = capfd.readouterr()
+    assert "Restarting" in caplog.text
+    assert out.count("Run, Forrest, run!") >= 2
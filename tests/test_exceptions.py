@@ -2,6 +2,10 @@
 
 from __future__ import annotations
 
+import asyncio
+
+import pytest
+
 from doozer import exceptions
 from doozer.base import Application
 
@@ -150,3 +154,119 @@ def test_abort_postprocess(event_loop, cancelled_future, queue):
 
     assert postprocess1_called_count == 2
     assert postprocess2_called_count == 1
+
+
+@pytest.mark.parametrize(
+    "setting, stage",
+    (
+        ("PREPROCESS_TIMEOUT", "preprocess"),
+        ("CALLBACK_TIMEOUT", "callback"),
+        ("POSTPROCESS_TIMEOUT", "postprocess"),
+        ("MESSAGE_TIMEOUT", "message"),
+    ),
+)
+def test_processing_timeout(event_loop, cancelled_future, queue, setting, stage):
+    """Test that a stage that takes too long is cancelled."""
+    errors = []
+    cancelled = []
+
+    queue.put_nowait(stage)
+
+    async def hang(message):
+        if message == stage:
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(message)
+                raise
+        return message
+
+    async def callback(app, message):
+        return [await hang("callback")]
+
+    app = Application("testing", callback=callback)
+    app.settings[setting] = 0.01
+
+    @app.message_preprocessor
+    async def preprocess(app, message):
+        await asyncio.sleep(0.006)
+        return await hang("preprocess")
+
+    @app.result_postprocessor
+    async def postprocess(app, result):
+        await asyncio.sleep(0.006)
+        await hang("postprocess")
+
+    @app.error
+    async def error(app, message, exc):
+        errors.append(exc)
+
+    event_loop.run_until_complete(app._process(cancelled_future, queue, event_loop))
+
+    if stage == "message":
+        # Neither stage takes too long by itself.
+        assert not cancelled
+    else:
+        assert cancelled == [stage]
+    assert len(errors) == 1
+    assert isinstance(errors[0], exceptions.ProcessingTimeout)
+    assert errors[0].stage == stage
+    assert app.metrics.counter("messages.timed_out").value == 1
+    assert app.metrics.counter("messages.failed").value == 1
+
+
+def test_processing_timeout_streaming(event_loop, cancelled_future, queue):
+    """Test that each result from a streaming callback is timed."""
+    errors = []
+    results = []
+
+    queue.put_nowait(1)
+
+    async def callback(app, message):
+        yield 1
+        await asyncio.sleep(10)
+        yield 2
+
+    app = Application("testing", callback=callback)
+    app.settings["CALLBACK_TIMEOUT"] = 0.01
+
+    @app.result_postprocessor
+    async def postprocess(app, result):
+        # Postprocessing doesn't count against the callback's timeout.
+        await asyncio.sleep(0.02)
+        results.append(result)
+
+    @app.error
+    async def error(app, message, exc):
+        errors.append(exc)
+
+    event_loop.run_until_complete(app._process(cancelled_future, queue, event_loop))
+
+    assert results == [1]
+    assert len(errors) == 1
+    assert isinstance(errors[0], exceptions.ProcessingTimeout)
+    assert errors[0].stage == "callback"
+    assert app.metrics.counter("messages.timed_out").value == 1
+
+
+def test_processing_timeout_not_reached(event_loop, cancelled_future, queue):
+    """Test that messages processed in time aren't affected."""
+    results = []
+
+    queue.put_nowait(1)
+
+    async def callback(app, message):
+        return [message]
+
+    app = Application("testing", callback=callback)
+    app.settings["CALLBACK_TIMEOUT"] = 1
+    app.settings["MESSAGE_TIMEOUT"] = 1
+
+    @app.result_postprocessor
+    async def postprocess(app, result):
+        results.append(result)
+
+    event_loop.run_until_complete(app._process(cancelled_future, queue, event_loop))
+
+    assert results == [1]
+    assert app.metrics.counter("messages.timed_out").value == 0
@@ -0,0 +1,117 @@
+"""Test running synchronous callbacks in executors."""
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+
+import pytest
+
+from doozer import Application, in_process, in_thread
+
+
+@pytest.fixture
+def modules_tmpdir(tmpdir, monkeypatch):
+    """Add a temporary directory for modules to sys.path."""
+    tmp = tmpdir.mkdir("tmp_modules")
+    monkeypatch.syspath_prepend(str(tmp))
+    return tmp
+
+
+@pytest.fixture
+def process_module(modules_tmpdir):
+    """Create a module with a function that runs in a process pool."""
+    modules_tmpdir.join("process_callbacks.py").write(
+        "\n".join(
+            (
+                "import os",
+                "from doozer import in_process",
+                "@in_process",
+                "def get_pid(message):",
+                "    return os.getpid(), message",
+            )
+        )
+    )
+
+
+@pytest.mark.parametrize("function", (None, "", 10))
+@pytest.mark.parametrize("decorator", (in_process, in_thread))
+def test_not_callable_typeerror(decorator, function):
+    """Test TypeError is raised if the function isn't callable."""
+    with pytest.raises(TypeError):
+        decorator(function)
+
+
+@pytest.mark.parametrize("decorator", (in_process, in_thread))
+def test_coroutine_typeerror(decorator, coroutine):
+    """Test TypeError is raised if the function is a coroutine."""
+    with pytest.raises(TypeError):
+        decorator(coroutine)
+
+
+def test_in_thread_registered():
+    """Test that wrapped functions can be registered as callbacks."""
+    app = Application("testing")
+
+    @app.message_preprocessor
+    @in_thread
+    def preprocess(app, message):
+        return message
+
+    assert app._callbacks["message_preprocessor"] == [preprocess]
+    assert preprocess.__qualname__.endswith("preprocess")
+
+
+@pytest.mark.asyncio
+async def test_in_thread():
+    """Test that wrapped functions run in the application's thread pool."""
+
+    @in_thread
+    def callback(app, message):
+        return threading.current_thread().name, app, message
+
+    app = Application("testing")
+    app.settings["THREAD_POOL_SIZE"] = 1
+
+    name, actual_app, actual_message = await callback(app, "message")
+
+    assert name.startswith("testing")
+    assert actual_app is app
+    assert actual_message == "message"
+    assert app._executors["thread"]._max_workers == 1
+
+    app._shutdown_executors()
+    assert not app._executors
+
+
+@pytest.mark.asyncio
+async def test_in_process(process_module):
+    """Test that wrapped functions run in the application's process pool."""
+    from process_callbacks import get_pid
+
+    app = Application("testing")
+    app.settings["PROCESS_POOL_SIZE"] = 1
+
+    try:
+        pid, message = await get_pid(app, "message")
+    finally:
+        app._shutdown_executors()
+
+    assert pid != os.getpid()
+    assert message == "message"
+
+
+def test_run_forever_shuts_down_executors(event_loop, test_consumer_with_abort):
+    """Test that run_forever shuts down the executors."""
+    thread_ids = set()
+
+    @in_thread
+    def callback(app, message):
+        thread_ids.add(threading.get_ident())
+
+    app = Application("testing", consumer=test_consumer_with_abort, callback=callback)
+    app.run_forever(loop=event_loop)
+
+    assert thread_ids and threading.get_ident() not in thread_ids
+    assert not app._executors
+    assert asyncio.iscoroutinefunction(callback)
@@ -0,0 +1,178 @@
+"""Test metrics."""
+from __future__ import annotations
+
+import asyncio
+import json
+
+import pytest
+
+from doozer.base import Application
+from doozer.exceptions import Abort
+from doozer.metrics import Counter, Gauge, Histogram, Metrics
+
+
+def test_counter():
+    """Test Counter."""
+    counter = Counter()
+    counter.inc()
+    counter.inc(2)
+    assert counter.value == 3
+
+
+def test_gauge():
+    """Test Gauge."""
+    gauge = Gauge()
+    gauge.inc(5)
+    gauge.dec(2)
+    assert gauge.value == 3
+
+    gauge.set(10)
+    assert gauge.value == 10
+
+
+def test_gauge_function():
+    """Test Gauge with a function."""
+    gauge = Gauge(lambda: 42)
+    gauge.set(10)
+    assert gauge.value == 42
+
+
+def test_histogram():
+    """Test Histogram."""
+    histogram = Histogram(buckets=(1, 2, 4))
+    for value in (0.5, 1, 1.5, 3, 10):
+        histogram.observe(value)
+
+    assert histogram.counts == [2, 1, 1, 1]
+    assert histogram.count == 5
+    assert histogram.sum == 16
+
+
+@pytest.mark.parametrize(
+    "percent, expected", ((0, 1), (40, 1), (50, 2), (80, 4), (99, 4), (100, 4))
+)
+def test_histogram_percentile(percent, expected):
+    """Test Histogram.percentile."""
+    histogram = Histogram(buckets=(1, 2, 4))
+    for value in (0.5, 1, 1.5, 3, 10):
+        histogram.observe(value)
+
+    assert histogram.percentile(percent) == expected
+
+
+def test_histogram_percentile_empty():
+    """Test Histogram.percentile without any observations."""
+    assert Histogram().percentile(50) is None
+
+
+def test_metrics_same_instance():
+    """Test that the same metric is returned each time."""
+    metrics = Metrics()
+    assert metrics.counter("a") is metrics.counter("a")
+    assert "a" in metrics
+
+
+def test_metrics_wrong_type_typeerror():
+    """Test TypeError is raised when a metric's type doesn't match."""
+    metrics = Metrics()
+    metrics.counter("a")
+    with pytest.raises(TypeError):
+        metrics.gauge("a")
+
+
+def test_metrics_dump(tmpdir):
+    """Test Metrics.dump."""
+    metrics = Metrics()
+    metrics.counter("messages.consumed").inc()
+
+    path = tmpdir.join("metrics.json")
+    metrics.dump(str(path))
+
+    assert json.loads(path.read()) == {"messages.consumed": 1}
+
+
+def test_metrics_exposition():
+    """Test Metrics.exposition."""
+    metrics = Metrics()
+    metrics.counter("messages.consumed").inc()
+    metrics.histogram("latency.read", buckets=(1,)).observe(0.5)
+
+    assert metrics.exposition().splitlines() == [
+        "# TYPE doozer_latency_read histogram",
+        'doozer_latency_read_bucket{le="1"} 1',
+        'doozer_latency_read_bucket{le="+Inf"} 1',
+        "doozer_latency_read_sum 0.5",
+        "doozer_latency_read_count 1",
+        "# TYPE doozer_messages_consumed counter",
+        "doozer_messages_consumed 1",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_metrics_serve():
+    """Test Metrics.serve."""
+    metrics = Metrics()
+    metrics.counter("messages.consumed").inc()
+
+    server = await metrics.serve("127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"GET /metrics HTTP/1.0\r\n\r\n")
+    response = await reader.read()
+    writer.close()
+
+    server.close()
+    await server.wait_closed()
+
+    assert response.startswith(b"HTTP/1.0 200 OK")
+    assert response.endswith(b"doozer_messages_consumed 1\n")
+
+
+def test_run_forever_metrics(event_loop):
+    """Test that run_forever records metrics."""
+
+    class Consumer:
+        messages = [1, 2, 3, 4]
+
+        async def read(self):
+            if not self.messages:
+                raise Abort("testing", None)
+            return self.messages.pop(0)
+
+    async def callback(app, message):
+        if message == 2:
+            raise Abort("testing", message)
+        if message == 3:
+            raise Exception()
+        return [message]
+
+    app = Application("testing", consumer=Consumer(), callback=callback)
+    app.run_forever(num_workers=2, loop=event_loop)
+
+    snapshot = app.metrics.snapshot()
+    assert snapshot["messages.consumed"] == 4
+    assert snapshot["messages.processed"] == 2
+    assert snapshot["messages.aborted"] == 1
+    assert snapshot["messages.failed"] == 1
+    assert snapshot["messages.acknowledged"] == 4
+    assert snapshot["latency.read"]["count"] == 4
+    assert snapshot["latency.callback"]["count"] == 2
+    assert snapshot["latency.postprocess"]["count"] == 2
+    assert snapshot["workers.total"] == 2
+    assert snapshot["workers.busy"] == 0
+
+
+def test_run_forever_metrics_file(event_loop, test_consumer_with_abort, tmpdir):
+    """Test that run_forever writes the metrics to a file."""
+
+    async def callback(app, message):
+        pass
+
+    path = tmpdir.join("metrics.json")
+
+    app = Application("testing", consumer=test_consumer_with_abort, callback=callback)
+    app.settings["METRICS_FILE"] = str(path)
+    app.run_forever(loop=event_loop)
+
+    assert json.loads(path.read())["messages.processed"] == 1